@@ -0,0 +1,240 @@
+"""
+Admission control for database-bound requests.
+
+Requests are sorted into route classes, each with its own concurrency limit
+and a bounded wait queue:
+
+    read   - single-row lookups (GET by id, small reference lists)
+    list   - full-table list, sync, search, analytics and matching endpoints
+    write  - POST/PUT/PATCH/DELETE
+    export - bulk report/export downloads and batch jobs
+    ingest - group-commit update ingestion (waits on the writer, holds no connection)
+
+Health checks, system endpoints, docs and the SSE change feed bypass
+admission entirely. When a class's queue is full, or a queued request waits
+longer than ADMISSION_QUEUE_TIMEOUT, the request is rejected with 503 and
+Retry-After instead of piling up on the connection pool and threadpool.
+Because every class has its own limit, heavy lists can never take the slots
+single-row lookups need.
+
+The default limits of the database-bound classes add up to the default pool
+capacity (DB_POOL_SIZE + DB_MAX_OVERFLOW = 30), and stay below anyio's 40
+worker threads so non-database requests always find a thread. Ingest
+requests are async and only wait on the ingest writer, so their limit is
+much higher.
+
+Each class also gets a statement timeout: `SET LOCAL statement_timeout` per
+transaction on Postgres, and a progress-handler deadline reset before every
+statement on SQLite. A timed-out statement becomes a 503. Streamed lists fetch
+from one cursor while the client reads, so they call
+`restart_statement_deadline` before each chunk: like a FETCH from a Postgres
+server-side cursor, each chunk gets the full timeout, and a slow client can't
+cut the stream short.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+READ = "read"
+LIST = "list"
+WRITE = "write"
+EXPORT = "export"
+INGEST = "ingest"
+
+
+def _class_settings(name: str, limit: int, queue: int, timeout_ms: int) -> Tuple[int, int, int]:
+    prefix = f"ADMISSION_{name.upper()}"
+    return (
+        int(os.getenv(f"{prefix}_LIMIT", str(limit))),
+        int(os.getenv(f"{prefix}_QUEUE", str(queue))),
+        int(os.getenv(f"{prefix}_STATEMENT_TIMEOUT_MS", str(timeout_ms))),
+    )
+
+
+# class -> (concurrency limit, max queued requests, statement timeout in ms)
+ROUTE_CLASS_SETTINGS: Dict[str, Tuple[int, int, int]] = {
+    READ: _class_settings(READ, 16, 64, 2000),
+    LIST: _class_settings(LIST, 4, 16, 15000),
+    WRITE: _class_settings(WRITE, 8, 32, 5000),
+    EXPORT: _class_settings(EXPORT, 2, 4, 120000),
+    INGEST: _class_settings(INGEST, 256, 512, 5000),
+}
+
+# Paths that are never queued or limited
+EXEMPT_PATHS: List[Pattern] = [
+    re.compile(r"^/$"),
+    re.compile(r"^/api/system/"),
+    re.compile(r"^/(docs|redoc|openapi\.json)"),
+    re.compile(r"^/api/intake-requests/events$"),
+]
+
+# (method, path pattern, class); first match wins. Unmatched GETs are reads, everything else a write.
+ROUTE_CLASS_RULES: List[Tuple[str, Pattern, str]] = [
+    ("GET", re.compile(r"^/api/accounts$"), LIST),
+    ("GET", re.compile(r"^/api/accounts/search$"), LIST),
+    ("GET", re.compile(r"^/api/intake-requests$"), LIST),
+    ("GET", re.compile(r"^/api/changes$"), LIST),
+    ("GET", re.compile(r"^/api/search$"), LIST),
+    ("GET", re.compile(r"^/api/analytics/onboarding$"), LIST),
+    ("GET", re.compile(r"^/api/intake-requests/\d+/matches$"), LIST),
+    ("GET", re.compile(r"^/api/reports/\d+/download$"), EXPORT),
+    ("POST", re.compile(r"^/api/updates/ingest$"), INGEST),
+    ("POST", re.compile(r"^/api/health-scores/run$"), EXPORT),
+]
+
+current_statement_timeout_ms: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "current_statement_timeout_ms", default=None
+)
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Route class for a request, or None when it bypasses admission control."""
+    if method == "OPTIONS" or any(pattern.match(path) for pattern in EXEMPT_PATHS):
+        return None
+    for rule_method, pattern, route_class in ROUTE_CLASS_RULES:
+        if method == rule_method and pattern.match(path):
+            return route_class
+    return READ if method in ("GET", "HEAD") else WRITE
+
+
+class Gate:
+    """Concurrency limit with a bounded FIFO wait queue."""
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if not self._semaphore.locked():
+            # Free slot: acquire() returns without yielding, so no other request can slip in first
+            await self._semaphore.acquire()
+            self.active += 1
+            return True
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "queue_size": self.queue_size, "active": self.active,
+                "waiting": self.waiting, "rejected": self.rejected}
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app, settings: Optional[Dict[str, Tuple[int, int, int]]] = None,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.app = app
+        self.settings = settings or ROUTE_CLASS_SETTINGS
+        self.queue_timeout = queue_timeout
+        self.gates = {name: Gate(name, limit, queue) for name, (limit, queue, _) in self.settings.items()}
+        admission_middlewares.append(self)
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if route_class is None or not ADMISSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        gate = self.gates[route_class]
+        if not await gate.acquire(self.queue_timeout):
+            await _reject(send, f"Server is busy ({route_class} capacity reached), please retry")
+            return
+
+        token = current_statement_timeout_ms.set(self.settings[route_class][2])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_statement_timeout_ms.reset(token)
+            gate.release()
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+admission_middlewares: List[AdmissionControlMiddleware] = []
+
+
+def admission_stats() -> dict:
+    return admission_middlewares[-1].stats() if admission_middlewares else {}
+
+
+async def _reject(send, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(ADMISSION_RETRY_AFTER).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def is_statement_timeout(exc: OperationalError) -> bool:
+    orig = getattr(exc, "orig", None)
+    if getattr(orig, "pgcode", None) == "57014":  # query_canceled
+        return True
+    return "interrupted" in str(orig).lower()
+
+
+def _set_sqlite_deadline(dbapi_connection, timeout_ms: Optional[int]) -> None:
+    if timeout_ms:
+        deadline = time.monotonic() + timeout_ms / 1000
+        # A non-zero return aborts the running statement with "interrupted"
+        dbapi_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+    else:
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def restart_statement_deadline(connection) -> None:
+    """Give the statement still being fetched on `connection` a fresh timeout (SQLite; Postgres needs none)."""
+    if connection.dialect.name == "sqlite":
+        _set_sqlite_deadline(connection.connection.dbapi_connection, current_statement_timeout_ms.get())
+
+
+@event.listens_for(Engine, "begin")
+def _apply_statement_timeout(conn):
+    timeout_ms = current_statement_timeout_ms.get()
+    if conn.dialect.name == "postgresql" and timeout_ms:
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _apply_sqlite_deadline(conn, cursor, statement, parameters, context, executemany):
+    if conn.dialect.name == "sqlite":
+        _set_sqlite_deadline(conn.connection.dbapi_connection, current_statement_timeout_ms.get())
@@ -0,0 +1,258 @@
+"""
+Time-bucketed adoption analytics.
+
+`onboarding_analytics(session, interval, start, end)` returns, for the window
+[start, end] bucketed by week, month, quarter or year:
+
+    onboardings      - accounts onboarded per bucket, per platform (from
+                       month_onboarded_db / month_onboarded_sf)
+    time_to_onboard  - per onboarding bucket and platform, days from an
+                       account's first recorded update to its onboarding month
+    update_cadence   - updates, active accounts and updates per active
+                       account per bucket (hot and archived updates)
+    platform_status  - current Platform.onboarding_status counts per platform
+
+On Postgres the bucketing and aggregation run in the database (date_trunc +
+GROUP BY, percentile_cont for medians), so a three-year chart is a handful of
+small grouped queries. SQLite has no date_trunc; there the narrow date
+columns are fetched and bucketed with NumPy. Every series is zero-filled so
+each bucket in the window is present.
+
+Results are cached per (interval, window, account) and dropped when the cache
+bus reports a write to accounts, platforms or updates.
+"""
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Date, cast, func, literal, union_all
+from sqlmodel import Session, select
+
+from cache import ALL_KEYS, bus, cache
+from models import Account, Platform, Update, UpdateArchive
+
+INTERVALS = ["week", "month", "quarter", "year"]
+DEFAULT_WINDOW_DAYS = 3 * 365
+
+CACHE_TABLE = "onboarding_analytics"
+SOURCE_TABLES = {"accounts", "platforms_crm", "updates"}
+
+# (series label, Account column)
+ONBOARDING_COLUMNS = [("Databricks", Account.month_onboarded_db), ("Snowflake", Account.month_onboarded_sf)]
+
+
+def _on_bus_message(table: str, key: str) -> None:
+    if table in SOURCE_TABLES:
+        cache.invalidate(CACHE_TABLE, ALL_KEYS)
+
+
+bus.subscribe(_on_bus_message)
+
+
+def bucket_dates(dates: np.ndarray, interval: str) -> np.ndarray:
+    """Start of each date's bucket, as datetime64[D]. Weeks start on Monday, like date_trunc."""
+    dates = dates.astype("datetime64[D]")
+    if interval == "week":
+        days = dates.astype(np.int64)
+        return (days - (days - 4) % 7).astype("datetime64[D]")  # 1970-01-05 was a Monday
+    if interval == "month":
+        return dates.astype("datetime64[M]").astype("datetime64[D]")
+    if interval == "quarter":
+        months = dates.astype("datetime64[M]").astype(np.int64)
+        return (months - months % 3).astype("datetime64[M]").astype("datetime64[D]")
+    if interval == "year":
+        return dates.astype("datetime64[Y]").astype("datetime64[D]")
+    raise ValueError(f"Unknown interval: {interval!r}")
+
+
+def bucket_range(start: date, end: date, interval: str) -> List[date]:
+    """Every bucket start that overlaps [start, end], in order."""
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    return [d.item() for d in np.unique(bucket_dates(days, interval))]
+
+
+def _dates(values) -> np.ndarray:
+    return np.array(values, dtype="datetime64[D]")
+
+
+def _updates():
+    """Hot and archived updates as one selectable (account_uid, date)."""
+    return union_all(
+        select(Update.account_uid, Update.date),
+        select(UpdateArchive.account_uid, UpdateArchive.date),
+    ).subquery()
+
+
+def _trunc(interval: str, column):
+    return cast(func.date_trunc(interval, column), Date)
+
+
+def _in_window(column, start: date, end: date):
+    return (column >= start) & (column < end + timedelta(days=1))
+
+
+def _onboardings_sql(session: Session, interval: str, start: date, end: date) -> Dict[str, Dict[date, int]]:
+    series = {}
+    for label, column in ONBOARDING_COLUMNS:
+        bucket = _trunc(interval, column).label("bucket")
+        rows = session.execute(
+            select(bucket, func.count()).where(_in_window(column, start, end)).group_by(bucket)
+        ).all()
+        series[label] = dict(rows)
+    return series
+
+
+def _onboardings_numpy(session: Session, interval: str, start: date, end: date) -> Dict[str, Dict[date, int]]:
+    series = {}
+    for label, column in ONBOARDING_COLUMNS:
+        values = session.execute(select(column).where(_in_window(column, start, end))).scalars().all()
+        buckets, counts = np.unique(bucket_dates(_dates(values), interval), return_counts=True)
+        series[label] = {b.item(): int(c) for b, c in zip(buckets, counts)}
+    return series
+
+
+def _first_updates():
+    updates = _updates()
+    return (
+        select(updates.c.account_uid, func.min(updates.c.date).label("first_date"))
+        .group_by(updates.c.account_uid)
+        .subquery()
+    )
+
+
+def _time_to_onboard_sql(session: Session, interval: str, start: date, end: date) -> Dict[str, Dict[date, dict]]:
+    first = _first_updates()
+    series = {}
+    for label, column in ONBOARDING_COLUMNS:
+        days = (column - first.c.first_date).label("days")
+        bucket = _trunc(interval, column).label("bucket")
+        rows = session.execute(
+            select(bucket, func.count(), func.avg(days), func.percentile_cont(0.5).within_group(days))
+            .join(first, first.c.account_uid == Account.uid)
+            .where(_in_window(column, start, end), first.c.first_date <= column)
+            .group_by(bucket)
+        ).all()
+        series[label] = {b: {"accounts": n, "avg_days": round(float(avg), 1), "median_days": float(median)}
+                         for b, n, avg, median in rows}
+    return series
+
+
+def _time_to_onboard_numpy(session: Session, interval: str, start: date, end: date) -> Dict[str, Dict[date, dict]]:
+    first = _first_updates()
+    series = {}
+    for label, column in ONBOARDING_COLUMNS:
+        rows = session.execute(
+            select(column, first.c.first_date)
+            .join(first, first.c.account_uid == Account.uid)
+            .where(_in_window(column, start, end), first.c.first_date <= column)
+        ).all()
+        onboarded = _dates([r[0] for r in rows])
+        days = (onboarded - _dates([r[1] for r in rows])).astype(np.int64)
+        buckets = bucket_dates(onboarded, interval)
+        order = np.argsort(buckets, kind="stable")
+        buckets, days = buckets[order], days[order]
+        starts, index = np.unique(buckets, return_index=True)
+        series[label] = {
+            b.item(): {"accounts": int(group.size), "avg_days": round(float(group.mean()), 1),
+                       "median_days": float(np.median(group))}
+            for b, group in zip(starts, np.split(days, index[1:]))
+        }
+    return series
+
+
+def _cadence_sql(session: Session, interval: str, start: date, end: date,
+                 account_uid: Optional[str]) -> Dict[date, Tuple[int, int]]:
+    updates = _updates()
+    bucket = _trunc(interval, updates.c.date).label("bucket")
+    query = (
+        select(bucket, func.count(), func.count(updates.c.account_uid.distinct()))
+        .where(_in_window(updates.c.date, start, end))
+        .group_by(bucket)
+    )
+    if account_uid:
+        query = query.where(updates.c.account_uid == account_uid)
+    return {b: (n, active) for b, n, active in session.execute(query).all()}
+
+
+def _cadence_numpy(session: Session, interval: str, start: date, end: date,
+                   account_uid: Optional[str]) -> Dict[date, Tuple[int, int]]:
+    updates = _updates()
+    query = select(updates.c.date, updates.c.account_uid).where(_in_window(updates.c.date, start, end))
+    if account_uid:
+        query = query.where(updates.c.account_uid == account_uid)
+    rows = session.execute(query).all()
+    if not rows:
+        return {}
+    buckets = bucket_dates(_dates([r[0] for r in rows]), interval)
+    _, accounts = np.unique(np.array([r[1] for r in rows], dtype=object), return_inverse=True)
+    starts, bucket_codes, counts = np.unique(buckets, return_inverse=True, return_counts=True)
+    # Distinct (bucket, account) pairs, then count them per bucket
+    pairs = np.unique(bucket_codes.astype(np.int64) * (accounts.max() + 1) + accounts)
+    active = np.bincount(pairs // (accounts.max() + 1), minlength=starts.size)
+    return {b.item(): (int(n), int(a)) for b, n, a in zip(starts, counts, active)}
+
+
+def _platform_status(session: Session) -> Dict[str, Dict[str, int]]:
+    rows = session.execute(
+        select(Platform.platform_name, func.coalesce(Platform.onboarding_status, literal("Unknown")), func.count())
+        .group_by(Platform.platform_name, Platform.onboarding_status)
+    ).all()
+    status: Dict[str, Dict[str, int]] = {}
+    for platform, onboarding_status, count in rows:
+        platform_counts = status.setdefault(platform or "Unknown", {})
+        platform_counts[onboarding_status] = platform_counts.get(onboarding_status, 0) + count
+    return status
+
+
+def default_window(end: Optional[date] = None, start: Optional[date] = None) -> Tuple[date, date]:
+    end = end or date.today()
+    return start or end - timedelta(days=DEFAULT_WINDOW_DAYS), end
+
+
+def onboarding_analytics(session: Session, interval: str = "month", start: Optional[date] = None,
+                         end: Optional[date] = None, account_uid: Optional[str] = None) -> dict:
+    """All series for the window, zero-filled per bucket. Cached until a relevant write."""
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval: {interval!r}")
+    start, end = default_window(end, start)
+    # Widen to whole buckets so the first one isn't partial
+    start = bucket_dates(_dates([start]), interval)[0].item()
+    key = f"{interval}:{start}:{end}:{account_uid or ''}"
+    return cache.get_or_load(CACHE_TABLE, key,
+                             lambda: _compute(session, interval, start, end, account_uid))
+
+
+def _compute(session: Session, interval: str, start: date, end: date, account_uid: Optional[str]) -> dict:
+    if session.get_bind().dialect.name == "postgresql":
+        onboardings = _onboardings_sql(session, interval, start, end)
+        time_to_onboard = _time_to_onboard_sql(session, interval, start, end)
+        cadence = _cadence_sql(session, interval, start, end, account_uid)
+    else:
+        onboardings = _onboardings_numpy(session, interval, start, end)
+        time_to_onboard = _time_to_onboard_numpy(session, interval, start, end)
+        cadence = _cadence_numpy(session, interval, start, end, account_uid)
+
+    buckets = bucket_range(start, end, interval)
+    empty_time = {"accounts": 0, "avg_days": None, "median_days": None}
+    return {
+        "interval": interval,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "account_uid": account_uid,
+        "buckets": [b.isoformat() for b in buckets],
+        "onboardings": {
+            label: [{"bucket": b.isoformat(), "accounts": counts.get(b, 0)} for b in buckets]
+            for label, counts in onboardings.items()
+        },
+        "time_to_onboard": {
+            label: [{"bucket": b.isoformat(), **stats.get(b, empty_time)} for b in buckets]
+            for label, stats in time_to_onboard.items()
+        },
+        "update_cadence": [
+            {"bucket": b.isoformat(), "updates": n, "active_accounts": active,
+             "updates_per_account": round(n / active, 2) if active else 0.0}
+            for b in buckets for n, active in [cadence.get(b, (0, 0))]
+        ],
+        "platform_status": _platform_status(session),
+    }
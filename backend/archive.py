@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Hot/cold split for account activity notes.
+
+`updates` holds the recent window (UPDATES_HOT_DAYS, by `date`); older rows
+are moved to `updates_archive` with their ids intact. Account update reads
+serve the hot window unless `include_archived=true` is passed, so the common
+read touches only recent rows through the (account_uid, date) index.
+
+The archival job moves rows in batches of UPDATES_ARCHIVE_BATCH_SIZE, each in
+its own short transaction (copy, then delete the same ids), so it can run
+while the API is serving traffic:
+
+    python archive.py            # archive everything older than the horizon
+    python archive.py --days 180 # override UPDATES_HOT_DAYS for this run
+
+Updates without a date are never archived.
+"""
+
+import argparse
+import os
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, literal, or_
+from sqlmodel import Session, select
+
+load_dotenv()
+
+from cache import invalidate
+from changes import OP_DELETE, record_changes
+from database import engine
+from fieldsets import rows_to_dicts, select_fields
+from models import Update, UpdateArchive
+
+UPDATES_HOT_DAYS = int(os.getenv("UPDATES_HOT_DAYS", "365"))
+UPDATES_ARCHIVE_BATCH_SIZE = int(os.getenv("UPDATES_ARCHIVE_BATCH_SIZE", "1000"))
+
+UPDATE_COLUMNS = ["id", "account_uid", "description", "author", "platform", "date"]
+
+
+def hot_cutoff(days: int = UPDATES_HOT_DAYS) -> date:
+    return date.today() - timedelta(days=days)
+
+
+def archive_batch(session: Session, cutoff: date, batch_size: int = UPDATES_ARCHIVE_BATCH_SIZE) -> int:
+    """Move one batch of updates dated before `cutoff` into updates_archive. Returns rows moved."""
+    ids = session.exec(
+        select(Update.id).where(Update.date < cutoff).order_by(Update.date, Update.id).limit(batch_size)
+    ).all()
+    if not ids:
+        return 0
+    columns = [Update.__table__.columns[name] for name in UPDATE_COLUMNS]
+    session.execute(
+        insert(UpdateArchive).from_select(
+            UPDATE_COLUMNS + ["archived_at"],
+            select(*columns, literal(datetime.utcnow())).where(Update.id.in_(ids)),
+        )
+    )
+    session.execute(delete(Update).where(Update.id.in_(ids)))
+    # Core DELETE bypasses the flush hooks; delta sync clients must drop these rows from `updates`
+    record_changes(session, "updates", ids, OP_DELETE)
+    invalidate(session, "updates")
+    return len(ids)
+
+
+def archive_updates(days: int = UPDATES_HOT_DAYS, batch_size: int = UPDATES_ARCHIVE_BATCH_SIZE) -> int:
+    cutoff = hot_cutoff(days)
+    total = 0
+    while True:
+        with Session(engine) as session:
+            moved = archive_batch(session, cutoff, batch_size)
+            session.commit()
+        total += moved
+        if moved < batch_size:
+            return total
+
+
+def account_updates(session: Session, uid: str, include_archived: bool = False,
+                    names: Optional[List[str]] = None) -> list:
+    """An account's updates, newest first: the hot window, plus the archive when asked for."""
+    cutoff = hot_cutoff()
+    sources = [(Update, or_(Update.date >= cutoff, Update.date.is_(None)))]
+    if include_archived:
+        # Rows past the horizon that the job hasn't moved yet are still in `updates`
+        sources = [(Update, None), (UpdateArchive, None)]
+
+    results = []
+    for model, window in sources:
+        if names:
+            query = select_fields(model, names).where(model.account_uid == uid)
+        else:
+            query = select(model).where(model.account_uid == uid)
+        if window is not None:
+            query = query.where(window)
+        # Archived rows are older, so hot-then-archive keeps the whole list newest first
+        query = query.order_by(model.date.desc().nulls_first(), model.id.desc())
+        if names:
+            results += rows_to_dicts(session.execute(query), names)
+        elif model is UpdateArchive:
+            results += [Update(**row.model_dump(include=set(UPDATE_COLUMNS))) for row in session.exec(query)]
+        else:
+            results += session.exec(query).all()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old account updates into updates_archive")
+    parser.add_argument("--days", type=int, default=UPDATES_HOT_DAYS, help="Hot window in days")
+    parser.add_argument("--batch-size", type=int, default=UPDATES_ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    moved = archive_updates(args.days, args.batch_size)
+    print(f"Archived {moved} updates older than {hot_cutoff(args.days)}")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Compression benchmark for the CRM API
+
+Builds a synthetic /api/accounts style JSON payload and reports, for each
+encoder setting, the compressed size, ratio and CPU time per response, plus
+the cost of serving the same body from the compressed-body cache.
+
+Usage:
+    python bench_compression.py [num_accounts]
+"""
+
+import json
+import sys
+import time
+
+from compression import CompressedBodyCache, compress, brotli
+
+
+def build_payload(num_accounts: int) -> bytes:
+    accounts = []
+    for i in range(num_accounts):
+        accounts.append({
+            "uid": f"ACC-{i:06d}",
+            "team": f"Team {i % 50}",
+            "business_it_area": ["Finance", "Marketing", "Operations", "IT"][i % 4],
+            "vp": f"VP {i % 12}",
+            "team_admin": f"admin{i % 80}@example.com",
+            "use_case": "Consolidate reporting pipelines into the lakehouse",
+            "use_case_status": ["Active", "Planning", "Completed"][i % 3],
+            "databricks": "Onboarded" if i % 2 else "Not Started",
+            "month_onboarded_db": "2024-03-01",
+            "snowflake": "In Progress",
+            "month_onboarded_sf": None,
+            "north_star_domain": "Enterprise Data",
+            "business_or_it": "Business" if i % 3 else "IT",
+            "centerwell_or_insurance": "Centerwell" if i % 2 else "Insurance",
+            "git_repo": f"https://dev.azure.com/org/project/_git/repo-{i}",
+            "unique_identifier": f"UID-{i}",
+            "associated_ado_items": ", ".join(f"ADO-{i * 10 + j}" for j in range(5)),
+            "team_artifacts": "Runbooks, architecture diagrams, onboarding checklist and data contracts",
+            "current_tech_stack": "Databricks, Azure Data Factory, Power BI, SQL Server, Python, dbt, Airflow",
+            "ad_groups": "; ".join(f"AAD-GRP-{i % 40}-{role}" for role in ("Readers", "Writers", "Admins")),
+            "notes": ("Weekly sync with the platform team. Migration of legacy SSIS packages is tracked "
+                      "in ADO; blockers are network approvals and service principal access. ") * 3,
+            "csm": f"CSM {i % 9}",
+            "health": ["Green", "Yellow", "Red"][i % 3],
+            "health_reason": "On track" if i % 3 == 0 else "Waiting on access requests",
+        })
+    return json.dumps(accounts).encode()
+
+
+def time_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    num_accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    body = build_payload(num_accounts)
+    repeat = 5
+
+    print("=" * 72)
+    print(f"Compression benchmark - {num_accounts} accounts, {len(body) / 1024:.1f} KiB uncompressed")
+    print("=" * 72)
+    print(f"{'encoder':<16}{'size KiB':>12}{'ratio':>10}{'ms/resp':>12}{'MiB/s':>12}")
+
+    settings = [("gzip", {"gzip_level": level}, f"gzip-{level}") for level in (1, 6, 9)]
+    if brotli is not None:
+        settings += [("br", {"brotli_quality": q}, f"br-{q}") for q in (1, 4, 6, 11)]
+    else:
+        print("(brotli not installed - skipping br)")
+
+    for encoding, kwargs, label in settings:
+        compressed = compress(body, encoding, **kwargs)
+        seconds = time_call(lambda: compress(body, encoding, **kwargs), 1 if label == "br-11" else repeat)
+        print(f"{label:<16}{len(compressed) / 1024:>12.1f}{len(body) / len(compressed):>10.1f}"
+              f"{seconds * 1000:>12.2f}{len(body) / seconds / 1048576:>12.1f}")
+
+    cache = CompressedBodyCache()
+    encoding = "br" if brotli is not None else "gzip"
+
+    def cached():
+        key = cache.key(encoding, body)
+        value = cache.get(key)
+        if value is None:
+            cache.put(key, compress(body, encoding))
+
+    cached()
+    seconds = time_call(cached, 50)
+    print(f"{'cache hit (' + encoding + ')':<16}{'':>12}{'':>10}{seconds * 1000:>12.2f}{len(body) / seconds / 1048576:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Triage board: intake requests grouped into one column per request state.
+
+A request can hold several state assignments; its column is its current
+state, the most recently assigned one (or none, for the unassigned column).
+That state and the time it was entered are denormalized onto the request as
+`current_state_id` / `state_entered_at` and kept up to date in the same
+transaction as every write to request_state_assignments, by calling
+`refresh_current_states` with the affected request ids. Those writes also
+bump the request's `updated_at`, so a card that just moved sorts first.
+
+`GET /api/intake-requests/board` then needs three statements however many
+requests there are: the states, a count per column (GROUP BY over the
+`(current_state_id, updated_at)` index), and the first page of every column
+(a UNION ALL of one newest-first index range per column). Further pages of
+one column come from `GET /api/intake-requests/board/column`.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, union_all, update
+from sqlmodel import Session
+
+from cache import invalidate
+from changes import OP_UPSERT, record_changes
+from database import engine
+from fieldsets import column_names, rows_to_dicts
+from models import IntakeRequest, RequestStateAssignment
+
+BOARD_PAGE_SIZE = 20
+BOARD_MAX_PAGE_SIZE = 200
+
+# Always selected: cards are grouped by it
+_GROUP_COLUMN = "current_state_id"
+
+
+def _latest_assignment(column):
+    return (
+        select(column)
+        .where(RequestStateAssignment.request_id == IntakeRequest.id)
+        .order_by(RequestStateAssignment.assigned_at.desc(), RequestStateAssignment.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def refresh_current_states(session: Session, request_ids: Optional[Iterable[int]] = None) -> None:
+    """Recompute current_state_id / state_entered_at from the assignments, in one UPDATE.
+
+    Call after inserting or deleting assignments, before the commit. With no
+    ids every request is recomputed (backfill) without touching updated_at
+    or the change log.
+    """
+    statement = update(IntakeRequest).values(
+        current_state_id=_latest_assignment(RequestStateAssignment.state_id),
+        state_entered_at=_latest_assignment(RequestStateAssignment.assigned_at),
+    )
+    if request_ids is None:
+        session.execute(statement, execution_options={"synchronize_session": False})
+        return
+    ids = sorted(set(request_ids))
+    if not ids:
+        return
+    session.execute(
+        statement.values(updated_at=datetime.utcnow()).where(IntakeRequest.id.in_(ids)),
+        execution_options={"synchronize_session": False},
+    )
+    # Core UPDATE bypasses the flush hooks
+    record_changes(session, "intake_requests", ids, OP_UPSERT)
+    for request_id in ids:
+        invalidate(session, "intake_requests", request_id)
+
+
+def backfill_current_states() -> None:
+    """Fill in current states once for databases created before the columns existed."""
+    with Session(engine) as session:
+        stale = session.execute(
+            select(RequestStateAssignment.id)
+            .join(IntakeRequest, IntakeRequest.id == RequestStateAssignment.request_id)
+            .where(IntakeRequest.current_state_id.is_(None))
+            .limit(1)
+        ).first()
+        if stale is not None:
+            refresh_current_states(session)
+            session.commit()
+
+
+def _columns(names: Optional[List[str]]) -> List[str]:
+    names = names or column_names(IntakeRequest)
+    return names if _GROUP_COLUMN in names else names + [_GROUP_COLUMN]
+
+
+def _page(names: List[str], state_id: Optional[int], offset: int, limit: int):
+    table = IntakeRequest.__table__
+    in_column = table.c.current_state_id.is_(None) if state_id is None else table.c.current_state_id == state_id
+    return (
+        select(*[table.c[name] for name in names])
+        .where(in_column)
+        .order_by(table.c.updated_at.desc(), table.c.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+
+
+def load_column(session: Session, state_id: Optional[int], offset: int, limit: int,
+                names: Optional[List[str]] = None) -> List[dict]:
+    """One page of a column, newest first; state_id None is the unassigned column."""
+    names = _columns(names)
+    return rows_to_dicts(session.execute(_page(names, state_id, offset, limit)), names)
+
+
+def load_board(session: Session, states: List, limit: int, names: Optional[List[str]] = None) -> dict:
+    """Every state's count and first page, plus an unassigned column, in two statements."""
+    names = _columns(names)
+    counts: Dict[Optional[int], int] = dict(session.execute(
+        select(IntakeRequest.current_state_id, func.count()).group_by(IntakeRequest.current_state_id)
+    ).all())
+    state_ids = [state.id for state in states] + [None]
+
+    # Only non-empty columns are queried; SQLite needs each LIMITed branch wrapped in a subquery
+    pages = [_page(names, state_id, 0, limit).subquery() for state_id in state_ids if counts.get(state_id)]
+    cards: Dict[Optional[int], List[dict]] = {}
+    if pages:
+        rows = session.execute(union_all(*[select(*page.c) for page in pages]))
+        for card in rows_to_dicts(rows, names):
+            cards.setdefault(card[_GROUP_COLUMN], []).append(card)
+        # A compound SELECT doesn't promise to keep each branch's order
+        if "updated_at" in names:
+            for column in cards.values():
+                column.sort(key=lambda card: (card["updated_at"], card["id"]), reverse=True)
+
+    columns = []
+    for state in states:
+        columns.append({"state": {"id": state.id, "name": state.name, "color": state.color},
+                        "count": counts.get(state.id, 0), "requests": cards.get(state.id, [])})
+    columns.append({"state": None, "count": counts.get(None, 0), "requests": cards.get(None, [])})
+    return {"limit": limit, "total": sum(counts.values()), "columns": columns}
@@ -0,0 +1,331 @@
+"""
+Per-worker read cache with cross-worker invalidation.
+
+Each uvicorn worker keeps its own LocalCache of hot rows (accounts, request
+states). Write endpoints call `invalidate(session, table, key)` before they
+commit; once the transaction commits, the entry is evicted locally and a
+`table:key` message is published on the invalidation bus so every other
+worker evicts it too. A key of "*" clears the whole table.
+
+Bus backends (CACHE_BUS):
+    memory   - single process only; local runs and tests
+    unix     - Unix datagram sockets in CACHE_BUS_DIR; several local workers without Postgres
+    postgres - LISTEN/NOTIFY on the primary; NOTIFY is sent inside the writing
+               transaction, so it is delivered exactly when the commit lands
+    auto     - postgres when DATABASE_URL is Postgres, otherwise memory (default)
+
+Other modules can `bus.subscribe(handler)` to react to commits on any worker;
+handlers run on the committing thread or the bus listener thread.
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session as OrmSession
+
+from database import DATABASE_URL, engine
+
+CACHE_BUS = os.getenv("CACHE_BUS", "auto").lower()
+CACHE_BUS_DIR = os.getenv("CACHE_BUS_DIR", "/tmp/crm-cache-bus")
+CACHE_BUS_CHANNEL = os.getenv("CACHE_BUS_CHANNEL", "crm_cache_invalidation")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+
+ALL_KEYS = "*"
+_MISSING = object()
+
+
+class LocalCache:
+    """Thread-safe `table -> key -> value` cache with a TTL safety net."""
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._tables: Dict[str, Dict[str, Tuple[float, Any]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, table: str, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._tables.get(table, {}).get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def generation(self, table: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(table, 0)
+
+    def set(self, table: str, key: str, value: Any, generation: Optional[Tuple[int, int]] = None) -> None:
+        """Store a value. With `generation`, skip it if the table was invalidated since that generation was read."""
+        if not CACHE_ENABLED:
+            return
+        with self._lock:
+            if generation is not None and (self._epoch, self._generations.get(table, 0)) != generation:
+                return
+            self._tables.setdefault(table, {})[key] = (time.monotonic() + self.ttl_seconds, value)
+
+    def get_or_load(self, table: str, key: Any, loader: Callable[[], Any]) -> Any:
+        """Return the cached value or call `loader`, caching non-None results that weren't raced by a write."""
+        key = str(key)
+        value = self.get(table, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        generation = self.generation(table)
+        value = loader()
+        if value is not None:
+            self.set(table, key, value, generation)
+        return value
+
+    def invalidate(self, table: str, key: str = ALL_KEYS) -> None:
+        """Evict one key plus the table's collection entry ("*"), or the whole table when key is "*"."""
+        key = str(key)
+        with self._lock:
+            self._generations[table] = self._generations.get(table, 0) + 1
+            entries = self._tables.get(table)
+            if not entries:
+                return
+            if key == ALL_KEYS:
+                self.evictions += len(entries)
+                entries.clear()
+                return
+            for k in (key, ALL_KEYS):
+                if entries.pop(k, None) is not None:
+                    self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._tables.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables": {table: len(entries) for table, entries in self._tables.items()},
+                "evictions": self.evictions,
+            }
+
+
+def format_message(table: str, key: Any) -> str:
+    return f"{table}:{key}"
+
+
+def parse_message(message: str) -> Tuple[str, str]:
+    table, _, key = message.partition(":")
+    return table, key or ALL_KEYS
+
+
+class InvalidationBus:
+    """Delivers `table:key` messages to every worker. Subclasses implement the transport."""
+
+    name = "memory"
+    transactional = False
+
+    def __init__(self):
+        self.sender_id = uuid.uuid4().hex[:12]
+        self._handlers: List[Callable[[str, str], None]] = []
+
+    def subscribe(self, handler: Callable[[str, str], None]) -> None:
+        self._handlers.append(handler)
+
+    def unsubscribe(self, handler: Callable[[str, str], None]) -> None:
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def deliver(self, message: str) -> None:
+        table, key = parse_message(message)
+        for handler in self._handlers:
+            try:
+                handler(table, key)
+            except Exception as e:
+                print(f"Cache invalidation handler failed for {message}: {e}")
+
+    def publish(self, messages: List[str]) -> None:
+        """Send messages to other workers. The memory bus has none."""
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+
+class UnixSocketBus(InvalidationBus):
+    """Each worker binds a datagram socket in a shared directory; publishers send to all of them."""
+
+    name = "unix"
+
+    def __init__(self, directory: str = CACHE_BUS_DIR):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}-{self.sender_id}.sock")
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._thread = threading.Thread(target=self._listen, name="cache-bus-unix", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _listen(self) -> None:
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(65536)
+            except OSError:
+                return
+            for message in data.decode().split("\n"):
+                if message:
+                    self.deliver(message)
+
+    def publish(self, messages: List[str]) -> None:
+        if not messages:
+            return
+        payload = "\n".join(messages).encode()
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".sock") or path == self.path:
+                    continue
+                try:
+                    sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Socket left behind by a worker that exited without cleanup
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except OSError as e:
+                    print(f"Cache invalidation send to {name} failed: {e}")
+        finally:
+            sender.close()
+
+
+class PostgresBus(InvalidationBus):
+    """LISTEN/NOTIFY on the primary database. Notifications are emitted inside the writing transaction."""
+
+    name = "postgres"
+    transactional = True
+
+    def __init__(self, channel: str = CACHE_BUS_CHANNEL, target_engine=None):
+        super().__init__()
+        self.channel = channel
+        self.engine = target_engine or engine
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def notify_in_transaction(self, connection, messages: List[str]) -> None:
+        for message in messages:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.channel, "payload": f"{self.sender_id}|{message}"},
+            )
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="cache-bus-postgres", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _listen_forever(self) -> None:
+        import psycopg2
+
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        backoff = 1.0
+        while not self._stopping.is_set():
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                # Anything published while we were disconnected was missed
+                self.deliver(ALL_KEYS)
+                backoff = 1.0
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        sender, _, message = conn.notifies.pop(0).payload.partition("|")
+                        if sender != self.sender_id:
+                            self.deliver(message)
+                conn.close()
+            except Exception as e:
+                print(f"Cache invalidation listener error, reconnecting in {backoff:.0f}s: {e}")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+
+def create_bus(kind: str = CACHE_BUS) -> InvalidationBus:
+    if kind == "auto":
+        kind = "postgres" if DATABASE_URL.startswith("postgres") else "memory"
+    if kind == "postgres":
+        return PostgresBus()
+    if kind == "unix":
+        return UnixSocketBus()
+    if kind == "memory":
+        return InvalidationBus()
+    raise ValueError(f"Unknown CACHE_BUS: {kind!r} (expected auto, memory, unix or postgres)")
+
+
+cache = LocalCache()
+bus = create_bus()
+
+
+def _evict(table: str, key: str) -> None:
+    if table == ALL_KEYS:
+        cache.clear()
+    else:
+        cache.invalidate(table, key)
+
+
+bus.subscribe(_evict)
+
+
+def invalidate(session: OrmSession, table: str, key: Any = ALL_KEYS) -> None:
+    """Queue an invalidation that is applied and broadcast when `session` commits."""
+    session.info.setdefault("cache_invalidations", set()).add(format_message(table, key))
+
+
+@event.listens_for(OrmSession, "before_commit")
+def _notify_before_commit(session):
+    messages = session.info.get("cache_invalidations")
+    if messages and bus.transactional and session.get_bind().dialect.name == "postgresql":
+        bus.notify_in_transaction(session.connection(), sorted(messages))
+        session.info["cache_invalidations_sent"] = True
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_after_commit(session):
+    messages = session.info.pop("cache_invalidations", None)
+    sent = session.info.pop("cache_invalidations_sent", False)
+    if not messages:
+        return
+    for message in sorted(messages):
+        bus.deliver(message)
+    if not sent:
+        bus.publish(sorted(messages))
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop("cache_invalidations", None)
+    session.info.pop("cache_invalidations_sent", None)
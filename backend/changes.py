@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Change tracking for delta sync.
+
+Every insert, update and delete of a tracked model appends a row to
+`change_log` in the same transaction, via an ORM after_flush hook. Core
+bulk statements (which bypass the ORM) call `record_changes` themselves.
+`seq` is the sync cursor: clients call `GET /api/changes?since=<seq>` and
+get upserts (with the current row) and delete tombstones in seq order.
+
+Entries are collected while the transaction runs and inserted by a
+before_commit hook, after the session's last flush. On Postgres the hook
+first takes a transaction-scoped advisory lock, so sequence numbers become
+visible in commit order and a client can never skip past a change that
+commits late, while writers only contend for the lock for the length of
+their commit rather than their whole transaction. SQLite already
+serializes writers.
+
+The log is compacted by dropping entries superseded by a newer entry for
+the same row, which keeps it proportional to the number of rows (plus
+tombstones) without invalidating any client's cursor:
+
+    python changes.py compact
+"""
+
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Type
+
+from sqlalchemy import Integer, String, cast, event, func, insert, inspect, literal, text
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, SQLModel, delete, select
+
+from database import engine
+from models import (Account, UseCase, Update, Platform, PrimaryITPartner, IntakeRequest, RequestState,
+                    RequestStateAssignment, ChangeLogEntry)
+
+# Domain tables exposed through the change feed. Internal queues (intake_events,
+# outbox_messages) and the log itself are not tracked.
+TRACKED_MODELS: Dict[str, Type[SQLModel]] = {
+    model.__tablename__: model
+    for model in (Account, UseCase, Update, Platform, PrimaryITPartner, IntakeRequest, RequestState,
+                  RequestStateAssignment)
+}
+_TRACKED_CLASSES = tuple(TRACKED_MODELS.values())
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+CHANGE_LOG_LOCK_ID = 724_001
+
+_APPENDS = "change_log_appends"
+
+
+def primary_key_column(model: Type[SQLModel]):
+    return inspect(model).primary_key[0]
+
+
+def _row_key(obj) -> str:
+    # identity isn't assigned to new objects until after the flush completes; read the PK attribute
+    return str(inspect(obj).mapper.primary_key_from_instance(obj)[0])
+
+
+def lock_change_log(connection) -> None:
+    """Serialize appends until the transaction ends, so ids from the sequence become visible in commit order."""
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": CHANGE_LOG_LOCK_ID})
+
+
+def append_at_commit(session: Session, model: Type[SQLModel], rows: List[dict]) -> None:
+    """Insert `rows` into `model`'s table when `session` commits, under the change log lock."""
+    if rows:
+        session.info.setdefault(_APPENDS, {}).setdefault(model, []).extend(rows)
+
+
+def record_changes(session: Session, table_name: str, keys: Iterable, op: str) -> None:
+    """Append change log rows for writes made with Core statements that bypass the ORM."""
+    now = datetime.utcnow()
+    rows = [{"table_name": table_name, "row_key": str(key), "op": op, "changed_at": now} for key in keys]
+    append_at_commit(session, ChangeLogEntry, rows)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _track_flushed_changes(session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for obj in list(session.new) + [o for o in session.dirty if session.is_modified(o, include_collections=False)]:
+        if isinstance(obj, _TRACKED_CLASSES):
+            rows.append({"table_name": obj.__tablename__, "row_key": _row_key(obj),
+                         "op": OP_UPSERT, "changed_at": now})
+    for obj in session.deleted:
+        if isinstance(obj, _TRACKED_CLASSES):
+            rows.append({"table_name": obj.__tablename__, "row_key": _row_key(obj),
+                         "op": OP_DELETE, "changed_at": now})
+    append_at_commit(session, ChangeLogEntry, rows)
+
+
+@event.listens_for(OrmSession, "before_commit")
+def _append_before_commit(session):
+    # Commit flushes after this hook; flush first so the last changes are in this append
+    session.flush()
+    appends = session.info.pop(_APPENDS, None)
+    if appends:
+        connection = session.connection()
+        lock_change_log(connection)
+        for model, rows in appends.items():
+            connection.execute(insert(model), rows)
+
+
+@event.listens_for(OrmSession, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop(_APPENDS, None)
+
+
+def get_changes(session: Session, since: int, limit: int, tables: Optional[List[str]] = None) -> dict:
+    """One page of changes after cursor `since`, with current rows loaded in one query per table."""
+    query = select(ChangeLogEntry).where(ChangeLogEntry.seq > since)
+    if tables:
+        query = query.where(ChangeLogEntry.table_name.in_(tables))
+    entries = session.exec(query.order_by(ChangeLogEntry.seq).limit(limit + 1)).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Collapse repeated changes to the same row within the page to the latest one
+    latest: Dict[tuple, ChangeLogEntry] = {}
+    for entry in entries:
+        latest[(entry.table_name, entry.row_key)] = entry
+    ordered = sorted(latest.values(), key=lambda e: e.seq)
+
+    keys_by_table: Dict[str, List[str]] = {}
+    for entry in ordered:
+        if entry.op == OP_UPSERT:
+            keys_by_table.setdefault(entry.table_name, []).append(entry.row_key)
+
+    rows: Dict[tuple, dict] = {}
+    for table_name, keys in keys_by_table.items():
+        model = TRACKED_MODELS[table_name]
+        pk = primary_key_column(model)
+        typed_keys = [int(k) for k in keys] if isinstance(pk.type, Integer) else keys
+        for obj in session.exec(select(model).where(pk.in_(typed_keys))).all():
+            rows[(table_name, str(getattr(obj, pk.key)))] = obj.model_dump(mode="json")
+
+    changes = []
+    for entry in ordered:
+        change = {"seq": entry.seq, "table": entry.table_name, "key": entry.row_key, "op": entry.op,
+                  "changed_at": entry.changed_at.isoformat()}
+        if entry.op == OP_UPSERT:
+            data = rows.get((entry.table_name, entry.row_key))
+            if data is None:
+                # Deleted after this entry was written; its tombstone is later in the log
+                continue
+            change["data"] = data
+        changes.append(change)
+
+    next_cursor = entries[-1].seq if entries else since
+    return {"changes": changes, "next_cursor": next_cursor, "has_more": has_more}
+
+
+def backfill_change_log() -> None:
+    """Seed the log with an upsert for every existing row, once, so a sync from cursor 0 is complete."""
+    with Session(engine) as session:
+        if session.exec(select(ChangeLogEntry.seq).limit(1)).first() is not None:
+            return
+        connection = session.connection()
+        lock_change_log(connection)
+        now = datetime.utcnow()
+        for table_name, model in TRACKED_MODELS.items():
+            pk = primary_key_column(model)
+            connection.execute(
+                insert(ChangeLogEntry).from_select(
+                    ["table_name", "row_key", "op", "changed_at"],
+                    select(literal(table_name), cast(pk, String),
+                           literal(OP_UPSERT), literal(now)).order_by(pk),
+                )
+            )
+        session.commit()
+
+
+def compact_change_log() -> int:
+    """Delete entries superseded by a newer entry for the same row. Returns the number removed."""
+    latest = select(func.max(ChangeLogEntry.seq)).group_by(ChangeLogEntry.table_name, ChangeLogEntry.row_key)
+    with Session(engine) as session:
+        result = session.execute(delete(ChangeLogEntry).where(ChangeLogEntry.seq.not_in(latest)))
+        session.commit()
+        return result.rowcount
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["compact"]:
+        print(f"Removed {compact_change_log()} superseded change log entries")
+    else:
+        print("Usage: python changes.py compact")
+        sys.exit(1)
@@ -0,0 +1,269 @@
+"""
+Negotiated response compression for the CRM API.
+
+Compresses responses with brotli (when the `brotli` package is installed) or
+gzip, depending on the client's Accept-Encoding header. Small bodies are sent
+as-is. Buffered responses go through a small LRU cache keyed by a hash of the
+uncompressed body, so an unchanged account or intake list is only compressed
+once. Streaming responses are compressed chunk by chunk.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_CACHE_ENTRIES = int(os.getenv("COMPRESSION_CACHE_ENTRIES", "256"))
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Bodies at least this large are compressed in a worker thread instead of on the event loop
+THREAD_OFFLOAD_SIZE = 256 * 1024
+
+# Content types that are already compressed or must not be buffered/altered
+EXCLUDED_CONTENT_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip",
+                          "application/vnd.openxmlformats-officedocument.")
+
+
+def supported_encodings() -> List[str]:
+    """Encodings this server can produce, in order of preference."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best encoding from an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        pieces = part.strip().split(";")
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    best = None
+    best_q = 0.0
+    for coding in supported_encodings():
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = COMPRESSION_GZIP_LEVEL,
+             brotli_quality: int = COMPRESSION_BROTLI_QUALITY) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental compressor that flushes after every chunk so streamed data is not held back."""
+
+    def __init__(self, encoding: str, gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESSION_BROTLI_QUALITY):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressedBodyCache:
+    """Thread-safe LRU cache of compressed bodies keyed by (encoding, body digest)."""
+
+    def __init__(self, max_entries: int = COMPRESSION_CACHE_ENTRIES, max_bytes: int = COMPRESSION_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoding: str, body: bytes) -> Tuple[str, bytes]:
+        return encoding, hashlib.sha256(body).digest()
+
+    def get(self, key: Tuple[str, bytes]) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Tuple[str, bytes], value: bytes) -> None:
+        if self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = value
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+def _header(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _without(headers: List[Tuple[bytes, bytes]], *names: bytes) -> List[Tuple[bytes, bytes]]:
+    return [(k, v) for k, v in headers if k.lower() not in names]
+
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    vary = _header(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if b"accept-encoding" in vary.lower():
+        return headers
+    return _without(headers, b"vary") + [(b"vary", vary + b", Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """ASGI middleware that applies negotiated gzip/brotli compression to HTTP responses."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, gzip_level: int = COMPRESSION_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESSION_BROTLI_QUALITY, cache: Optional[CompressedBodyCache] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = cache if cache is not None else CompressedBodyCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder)
+
+    def compress_cached(self, body: bytes, encoding: str) -> bytes:
+        key = self.cache.key(encoding, body)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            self.cache.put(key, compressed)
+        return compressed
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message = None
+        self.passthrough = False
+        self.streamer: Optional[StreamCompressor] = None
+
+    async def __call__(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            headers = list(message.get("headers") or [])
+            content_type = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+            if _header(headers, b"content-encoding") is not None or content_type.startswith(EXCLUDED_CONTENT_TYPES):
+                self.passthrough = True
+                await self.send(message)
+                return
+            # Hold the start message until we see the first body chunk
+            self.start_message = message
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.streamer is not None:
+            chunk = self.streamer.compress(body) if body else b""
+            if not more_body:
+                chunk += self.streamer.finish()
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        headers = list(self.start_message.get("headers") or [])
+
+        if not more_body:
+            if len(body) < self.middleware.minimum_size:
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            if len(body) >= THREAD_OFFLOAD_SIZE:
+                compressed = await anyio.to_thread.run_sync(self.middleware.compress_cached, body, self.encoding)
+            else:
+                compressed = self.middleware.compress_cached(body, self.encoding)
+            headers = _add_vary(_without(headers, b"content-length"))
+            headers += [(b"content-encoding", self.encoding.encode()),
+                        (b"content-length", str(len(compressed)).encode())]
+            await self.send({**self.start_message, "headers": headers})
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": False})
+            return
+
+        # Streaming response: the final size is unknown, so always compress incrementally
+        self.streamer = StreamCompressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+        headers = _add_vary(_without(headers, b"content-length"))
+        headers.append((b"content-encoding", self.encoding.encode()))
+        await self.send({**self.start_message, "headers": headers})
+        await self.send({"type": "http.response.body", "body": self.streamer.compress(body), "more_body": True})
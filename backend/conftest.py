@@ -0,0 +1,165 @@
+"""
+Shared test fixtures.
+
+The API tests run against an in-memory SQLite database seeded once per test
+session (SEED_ACCOUNTS accounts with their use cases, updates, platforms and
+partners, plus intake requests with states). Every test runs inside a
+transaction that is rolled back afterwards, so tests can write freely and
+each one starts from the same seeded data. The `client` fixture routes the
+app's `get_session` dependency, and the ingest writer, into that transaction.
+
+`query_budget(max_queries, max_ms)` is a context manager that fails the test
+when the block issues more SQL statements than allowed; the statements are
+listed in the failure message. Wall-clock time depends on the machine and
+its load, so the latency budget is only checked when PERF_BUDGET_SCALE is
+set (1 for the budgets as written, higher on slow machines).
+"""
+
+import gc
+import os
+
+# Must be set before the app modules create their engines; an explicit DATABASE_URL still wins
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("DB_ECHO", "false")
+os.environ.setdefault("OUTBOX_WORKER_IN_APP", "false")
+
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import List
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from board import refresh_current_states
+from cache import cache
+from database import get_session
+from facets import facet_index
+from ingest import ingest_writer
+from similarity import similarity_index
+from main import app  # registers every module's table and flush hooks before the test database is created
+from models import (Account, IntakeRequest, Platform, PrimaryITPartner, ReportJob, RequestState,
+                    RequestStateAssignment, UseCase, Update)
+
+# Unset: latency budgets are not checked
+PERF_BUDGET_SCALE = float(os.environ["PERF_BUDGET_SCALE"]) if os.getenv("PERF_BUDGET_SCALE") else None
+
+SEED_ACCOUNTS = 200
+SEED_INTAKE_REQUESTS = 100
+
+# Transaction control, not queries an endpoint chose to run
+_TRANSACTION_STATEMENTS = ("BEGIN", "SAVEPOINT", "RELEASE", "ROLLBACK", "COMMIT")
+
+
+def seed(session: Session) -> None:
+    today = date.today()
+    for i in range(SEED_ACCOUNTS):
+        uid = f"ACC{i:04d}"
+        session.add(Account(
+            uid=uid, team=f"Team {i}", vp=f"VP {i % 7}", csm=f"CSM {i % 11}", health=("Green", "Yellow", "Red")[i % 3],
+            business_or_it=("Business", "IT")[i % 2], centerwell_or_insurance=("CenterWell", "Insurance")[i % 2],
+            month_onboarded_db=date(2022 + i % 3, i % 12 + 1, 1), notes=f"Notes for team {i} pipeline work",
+        ))
+        for j in range(3):
+            session.add(UseCase(account_uid=uid, problem=f"Problem {j}", solution="Solution", status="Active"))
+        for j in range(4):
+            session.add(Update(account_uid=uid, description=f"Update {j}", author="Author", date=today - timedelta(days=30 * j)))
+        session.add(Platform(account_uid=uid, platform_name="Databricks", onboarding_status="Completed"))
+        session.add(Platform(account_uid=uid, platform_name="Snowflake", onboarding_status="In Progress"))
+        session.add(PrimaryITPartner(account_uid=uid, primary_it_partner=f"Partner {i % 5}"))
+
+    states = [RequestState(name=name, created_at=datetime.utcnow()) for name in ("New", "In Review", "Completed")]
+    session.add_all(states)
+    session.flush()
+    for i in range(SEED_INTAKE_REQUESTS):
+        request = IntakeRequest(title=f"Request {i}", description="Need help", functional_area="IT")
+        session.add(request)
+        session.flush()
+        session.add(RequestStateAssignment(request_id=request.id, state_id=states[i % len(states)].id))
+    session.flush()
+    refresh_current_states(session)
+    session.add(ReportJob(format="csv"))
+    session.commit()
+
+
+@pytest.fixture(scope="session")
+def db_engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy emit BEGIN itself
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session)
+    # Keep the app and seed objects out of later collections; a full pass over them takes tens of
+    # milliseconds and would land inside whichever latency budget happened to trigger it
+    gc.collect()
+    gc.freeze()
+    return engine
+
+
+@pytest.fixture
+def db_session(db_engine):
+    connection = db_engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+        # Per-worker caches outlive the rolled-back transaction
+        cache.clear()
+        facet_index.clear()
+        similarity_index.clear()
+
+
+@pytest.fixture
+def client(db_session, monkeypatch):
+    def test_session():
+        yield db_session
+
+    app.dependency_overrides[get_session] = test_session
+    monkeypatch.setattr(ingest_writer, "bind", db_session.connection())
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+
+@pytest.fixture
+def query_budget(db_engine):
+    statements: List[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(_TRANSACTION_STATEMENTS):
+            statements.append(statement)
+
+    @contextmanager
+    def budget(max_queries: int, max_ms: float):
+        statements.clear()
+        event.listen(db_engine, "before_cursor_execute", record)
+        started = time.perf_counter()
+        try:
+            yield statements
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            event.remove(db_engine, "before_cursor_execute", record)
+        assert len(statements) <= max_queries, (
+            f"{len(statements)} SQL statements, budget is {max_queries}:\n" + "\n".join(statements))
+        if PERF_BUDGET_SCALE is not None:
+            assert elapsed_ms <= max_ms * PERF_BUDGET_SCALE, (
+                f"took {elapsed_ms:.1f} ms, budget is {max_ms * PERF_BUDGET_SCALE:.0f} ms")
+
+    return budget
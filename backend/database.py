@@ -1,27 +1,347 @@
 from sqlmodel import SQLModel, create_engine, Session
-from typing import Optional
+from sqlalchemy import UniqueConstraint, func, inspect, select, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool, StaticPool
+from admission import is_statement_timeout
+from fastapi import Request, Response
+from typing import Dict, List, Optional
+import itertools
 import os
+import threading
+import time
 
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
-connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+# Pool strategy:
+#   queue - SQLAlchemy QueuePool held by each worker (default)
+#   null  - no client-side pool; for PgBouncer / Azure's built-in pooler in transaction mode
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))   # Seconds to wait for a connection before a 503
+DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "false").lower() == "true"
+DB_ECHO = os.getenv("DB_ECHO", "true").lower() == "true"
 
-# Add connection pooling with pre-ping to handle dropped connections
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args=connect_args, 
-    echo=True,
-    pool_pre_ping=True,  # Test connections before using them
-    pool_recycle=3600,   # Recycle connections after 1 hour
-    pool_size=10,        # Connection pool size
-    max_overflow=20      # Allow up to 20 overflow connections
-)
+# Optional read replicas: comma-separated URLs. GET/HEAD requests are served from these.
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "10"))
+
+READ_ONLY_METHODS = ("GET", "HEAD", "OPTIONS")
+PRIMARY_PIN_COOKIE = "crm_primary_until"
+
+
+def engine_options(database_url: str, pool_mode: Optional[str] = None) -> dict:
+    """Build create_engine() keyword arguments for the configured pool strategy."""
+    pool_mode = (pool_mode or DB_POOL_MODE).lower()
+    url = make_url(database_url)
+    options = {"echo": DB_ECHO}
+    connect_args = {}
+
+    if url.get_backend_name() == "sqlite":
+        connect_args["check_same_thread"] = False
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases live inside one connection, so every session must share it
+            options["poolclass"] = StaticPool
+            options["connect_args"] = connect_args
+            return options
+
+    if pool_mode == "null":
+        options["poolclass"] = NullPool
+        # Transaction-mode poolers hand each transaction a different server connection,
+        # so server-side prepared statements must be disabled for drivers that use them
+        if url.get_driver_name() == "psycopg":
+            connect_args["prepare_threshold"] = None
+        elif url.get_driver_name() == "asyncpg":
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+    elif pool_mode == "queue":
+        options.update(
+            pool_pre_ping=DB_POOL_PRE_PING,  # Test connections before using them
+            pool_recycle=DB_POOL_RECYCLE,    # Recycle connections after this many seconds
+            pool_size=DB_POOL_SIZE,          # Connection pool size
+            max_overflow=DB_MAX_OVERFLOW,    # Extra connections allowed above pool_size
+            pool_timeout=DB_POOL_TIMEOUT,    # Fail fast instead of blocking on an exhausted pool
+            pool_use_lifo=DB_POOL_USE_LIFO,  # Reuse the most recent connection so idle ones can expire
+        )
+    else:
+        raise ValueError(f"Unknown DB_POOL_MODE: {pool_mode!r} (expected 'queue' or 'null')")
+
+    options["connect_args"] = connect_args
+    return options
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+
+class DatabaseRouter:
+    """
+    Routes sessions between the primary and optional read replicas.
+
+    Reads go round-robin across healthy replicas. Replicas are probed every
+    DB_REPLICA_HEALTH_INTERVAL by a background thread (`start()`), so routing
+    a request only reads the last result. A replica that fails a probe is
+    skipped until a probe succeeds; one that fails a query is skipped for an
+    interval. After a client writes, its reads are pinned to the primary for
+    read_your_writes_seconds so it never sees replication lag on its own changes.
+    """
+
+    def __init__(self, primary: Engine, replicas: List[Engine], read_your_writes_seconds: float = DB_READ_YOUR_WRITES_SECONDS,
+                 health_interval: float = DB_REPLICA_HEALTH_INTERVAL):
+        self.primary = primary
+        self.replicas = replicas
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self.health_interval = health_interval
+        self._cycle = itertools.cycle(range(len(replicas))) if replicas else None
+        self._down_until: Dict[int, float] = {}
+        self._pinned: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        """Start probing the replicas in the background."""
+        if self.replicas and (self._thread is None or not self._thread.is_alive()):
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self.probe()
+            self._stopping.wait(self.health_interval)
+
+    def probe(self) -> None:
+        """Check every replica with SELECT 1 and record the result for routing."""
+        for index, replica in enumerate(self.replicas):
+            try:
+                with replica.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            except Exception as e:
+                if self._is_healthy(index):
+                    print(f"Read replica {index} failed health check: {e}")
+                # Down until the next probe has had time to run and succeed
+                self._down_until[index] = time.time() + 2 * self.health_interval
+                continue
+            if self._down_until.pop(index, None) is not None:
+                print(f"Read replica {index} passed health check; routing reads to it again")
+
+    def record_write(self, client_key: Optional[str]) -> float:
+        """Pin a client to the primary and return the pin's expiry (epoch seconds)."""
+        until = time.time() + self.read_your_writes_seconds
+        if client_key:
+            with self._lock:
+                self._pinned[client_key] = until
+                if len(self._pinned) > 10000:
+                    now = time.time()
+                    self._pinned = {k: v for k, v in self._pinned.items() if v > now}
+        return until
+
+    def is_pinned(self, client_key: Optional[str], pinned_until: Optional[float] = None) -> bool:
+        now = time.time()
+        if pinned_until is not None and pinned_until > now:
+            return True
+        if client_key:
+            return self._pinned.get(client_key, 0) > now
+        return False
+
+    def read_engine(self, client_key: Optional[str] = None, pinned_until: Optional[float] = None) -> Engine:
+        if not self.replicas or self.is_pinned(client_key, pinned_until):
+            return self.primary
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                index = next(self._cycle)
+            if self._is_healthy(index):
+                return self.replicas[index]
+        return self.primary
+
+    def mark_unhealthy(self, target: Engine) -> None:
+        for index, replica in enumerate(self.replicas):
+            if replica is target:
+                self._down_until[index] = time.time() + self.health_interval
+
+    def _is_healthy(self, index: int) -> bool:
+        return self._down_until.get(index, 0) <= time.time()
+
+    def status(self) -> List[dict]:
+        now = time.time()
+        return [
+            {
+                "url": replica.url.render_as_string(hide_password=True),
+                "healthy": self._down_until.get(index, 0) <= now,
+                "pool": replica.pool.status(),
+            }
+            for index, replica in enumerate(self.replicas)
+        ]
+
+
+db_router = DatabaseRouter(engine, [create_engine(url, **engine_options(url)) for url in DATABASE_REPLICA_URLS])
+
+
+def client_key(request: Request) -> Optional[str]:
+    """Identify a client for read-your-writes pinning: explicit X-Client-ID, else remote address."""
+    explicit = request.headers.get("x-client-id")
+    if explicit:
+        return explicit
+    return request.client.host if request.client else None
+
+
+def pool_status(target_engine=None) -> dict:
+    """Snapshot of the connection pool for runtime inspection."""
+    target_engine = target_engine or engine
+    pool = target_engine.pool
+    status = {
+        "mode": DB_POOL_MODE,
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+    }
+    if hasattr(pool, "checkedout"):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=getattr(pool, "_max_overflow", None),
+            timeout=pool.timeout(),
+        )
+    if target_engine is engine and db_router.replicas:
+        status["replicas"] = db_router.status()
+    return status
+
+
+def insert_ignoring_conflicts(session: Session, model):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect (PostgreSQL or SQLite)."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT DO NOTHING is not supported for {dialect}")
+    return insert(model).on_conflict_do_nothing()
+
+
+def add_missing_columns(target_engine: Optional[Engine] = None) -> List[str]:
+    """Bring existing tables up to the models: add missing nullable columns, then missing indexes.
+
+    create_all only creates tables that don't exist, so a column added to a model
+    later would otherwise make every query on that table fail against an older
+    database. Returns the "table.column" names added.
+    """
+    target_engine = target_engine or engine
+    inspector = inspect(target_engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with target_engine.begin() as conn:
+        quote = conn.dialect.identifier_preparer.quote
+        tables = [table for table in SQLModel.metadata.sorted_tables if table.name in existing_tables]
+        for table in tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable:
+                    print(f"Cannot add NOT NULL column {table.name}.{column.name} automatically; migrate it by hand")
+                    continue
+                # Several workers may run startup at once
+                if_not_exists = "IF NOT EXISTS " if conn.dialect.name == "postgresql" else ""
+                ddl = (f"ALTER TABLE {quote(table.name)} ADD COLUMN {if_not_exists}{quote(column.name)} "
+                       f"{column.type.compile(conn.dialect)}")
+                for foreign_key in column.foreign_keys:
+                    ddl += f" REFERENCES {quote(foreign_key.column.table.name)} ({quote(foreign_key.column.name)})"
+                try:
+                    conn.exec_driver_sql(ddl)
+                except OperationalError as e:
+                    # Another worker added it first; SQLite has no ADD COLUMN IF NOT EXISTS
+                    if "duplicate column" not in str(e):
+                        raise
+                    continue
+                added.append(f"{table.name}.{column.name}")
+        for table in tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    if added:
+        print(f"Added columns to existing tables: {', '.join(added)}")
+    return added
+
+
+def add_missing_unique_constraints(session: Session) -> Dict[str, List]:
+    """Enforce model UniqueConstraints that existing tables lack, as unique indexes of the same name.
+
+    Rows that would violate one are deleted first, keeping the lowest primary key of
+    each group. Runs in the caller's transaction; returns the deleted keys per table.
+    """
+    connection = session.connection()
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    removed: Dict[str, List] = {}
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c["name"] for c in inspector.get_unique_constraints(table.name)}
+        present |= {i["name"] for i in inspector.get_indexes(table.name) if i["unique"]}
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint) or constraint.name in present:
+                continue
+            pk = list(table.primary_key.columns)[0]
+            columns = list(constraint.columns)
+            keep = select(func.min(pk)).group_by(*columns)
+            duplicates = connection.execute(select(pk).where(pk.not_in(keep))).scalars().all()
+            if duplicates:
+                connection.execute(table.delete().where(pk.in_(duplicates)))
+                removed.setdefault(table.name, []).extend(duplicates)
+                print(f"Removed {len(duplicates)} duplicate rows from {table.name} before adding {constraint.name}")
+            quote = connection.dialect.identifier_preparer.quote
+            connection.exec_driver_sql(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(constraint.name)} ON {quote(table.name)} "
+                f"({', '.join(quote(column.name) for column in columns)})")
+    return removed
 
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    add_missing_columns()
+    # changes imports this module
+    from changes import OP_DELETE, TRACKED_MODELS, record_changes
 
-
-def get_session():
     with Session(engine) as session:
-        yield session
+        for table_name, keys in add_missing_unique_constraints(session).items():
+            if table_name in TRACKED_MODELS:
+                record_changes(session, table_name, keys, OP_DELETE)
+        session.commit()
+
+
+def get_session(request: Request, response: Response):
+    if not db_router.replicas:
+        with Session(engine) as session:
+            yield session
+        return
+
+    key = client_key(request)
+    if request.method in READ_ONLY_METHODS:
+        try:
+            pinned_until = float(request.cookies.get(PRIMARY_PIN_COOKIE, ""))
+        except ValueError:
+            pinned_until = None
+        target = db_router.read_engine(key, pinned_until)
+    else:
+        target = engine
+        until = db_router.record_write(key)
+        # The cookie carries the pin to other workers, which don't share this process's memory
+        response.set_cookie(PRIMARY_PIN_COOKIE, f"{until:.3f}", max_age=int(db_router.read_your_writes_seconds) + 1,
+                            httponly=True, samesite="lax")
+
+    with Session(target) as session:
+        try:
+            yield session
+        except OperationalError as e:
+            # A statement timeout is the query's fault, not the replica's
+            if target is not engine and not is_statement_timeout(e):
+                db_router.mark_unhealthy(target)
+            raise
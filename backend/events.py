@@ -0,0 +1,204 @@
+"""
+Server-sent change feed for the intake triage board.
+
+Intake handlers call `record_event(session, ...)` before they commit, which
+writes an IntakeEvent row in the same transaction. The row id is a global,
+monotonic event id, so a client can reconnect to any worker and resume with
+Last-Event-ID. The row is inserted at commit together with the change log
+entries, under the change log's advisory lock on Postgres, so ids become
+visible in commit order and an `id > last_id` cursor never skips an event
+whose transaction commits late.
+
+Each worker runs one ChangeFeed task. The commit publishes an
+`intake_events:*` message on the cache invalidation bus, which wakes the feed
+on every worker; the feed then loads the new rows with a single query and fans
+them out to its subscribers. Subscribers are plain asyncio queues, so an idle
+connection costs one queue and one suspended generator.
+"""
+
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Deque, List, Optional, Set
+
+import anyio
+from sqlmodel import Session, delete, func, select
+
+from cache import ALL_KEYS, bus, invalidate
+from changes import append_at_commit
+from database import engine
+from models import IntakeEvent
+
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+EVENTS_POLL_SECONDS = float(os.getenv("EVENTS_POLL_SECONDS", "5"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "7"))
+EVENTS_SUBSCRIBER_QUEUE_SIZE = 256
+EVENTS_REPLAY_LIMIT = 1000
+
+REQUEST_CREATED = "intake_request.created"
+REQUEST_UPDATED = "intake_request.updated"
+REQUEST_DELETED = "intake_request.deleted"
+STATE_ASSIGNED = "intake_request.state_assigned"
+STATE_REMOVED = "intake_request.state_removed"
+
+
+def record_event(session: Session, event_type: str, request_id: int, state_id: Optional[int] = None,
+                 payload: Optional[dict] = None) -> None:
+    """Add an event to the session's transaction; subscribers are woken when it commits."""
+    append_at_commit(session, IntakeEvent, [{
+        "event_type": event_type,
+        "request_id": request_id,
+        "state_id": state_id,
+        "payload": json.dumps(payload, default=str) if payload is not None else None,
+        "created_at": datetime.utcnow(),
+    }])
+    invalidate(session, "intake_events")
+
+
+def format_sse(event: IntakeEvent) -> str:
+    data = {
+        "id": event.id,
+        "type": event.event_type,
+        "request_id": event.request_id,
+        "state_id": event.state_id,
+        "data": json.loads(event.payload) if event.payload else None,
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+    }
+    return f"id: {event.id}\nevent: {event.event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def fetch_events_since(last_id: int, limit: int = EVENTS_REPLAY_LIMIT) -> List[IntakeEvent]:
+    with Session(engine) as session:
+        return list(session.exec(
+            select(IntakeEvent).where(IntakeEvent.id > last_id).order_by(IntakeEvent.id).limit(limit)
+        ).all())
+
+
+def latest_event_id() -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.max(IntakeEvent.id))).one() or 0
+
+
+def prune_events(retention_days: int = EVENTS_RETENTION_DAYS) -> None:
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    with Session(engine) as session:
+        session.execute(delete(IntakeEvent).where(IntakeEvent.created_at < cutoff))
+        session.commit()
+
+
+class ChangeFeed:
+    def __init__(self, buffer_size: int = EVENTS_BUFFER_SIZE):
+        self.buffer: Deque[IntakeEvent] = deque(maxlen=buffer_size)
+        self.last_id = 0
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.last_id = await anyio.to_thread.run_sync(latest_event_id)
+        bus.subscribe(self._on_bus_message)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        bus.unsubscribe(self._on_bus_message)
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _on_bus_message(self, table: str, key: str) -> None:
+        # Called from whichever thread committed or received the notification
+        if table in ("intake_events", ALL_KEYS) and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _run(self) -> None:
+        last_prune = datetime.utcnow()
+        while True:
+            try:
+                # With subscribers, also poll in case a notification was lost
+                timeout = EVENTS_POLL_SECONDS if self.subscribers else None
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self._load_new_events()
+                if datetime.utcnow() - last_prune > timedelta(hours=1):
+                    last_prune = datetime.utcnow()
+                    await anyio.to_thread.run_sync(prune_events)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Change feed error: {e}")
+                await asyncio.sleep(1)
+
+    async def _load_new_events(self) -> None:
+        while True:
+            events = await anyio.to_thread.run_sync(fetch_events_since, self.last_id, EVENTS_REPLAY_LIMIT)
+            for event in events:
+                self.buffer.append(event)
+                self.last_id = event.id
+                self._fan_out(event)
+            if len(events) < EVENTS_REPLAY_LIMIT:
+                return
+
+    def _fan_out(self, event: IntakeEvent) -> None:
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow to keep up: end the stream; the client resumes with Last-Event-ID
+                self.subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _replay(self, last_event_id: int) -> AsyncIterator[IntakeEvent]:
+        """Every event after last_event_id up to where live delivery starts, from the buffer or the table."""
+        target = self.last_id
+        while last_event_id < target:
+            if self.buffer and self.buffer[0].id <= last_event_id + 1:
+                for event in [event for event in self.buffer if event.id > last_event_id]:
+                    yield event
+                return
+            # Further behind than the buffer: page through the table until caught up
+            events = await anyio.to_thread.run_sync(fetch_events_since, last_event_id, EVENTS_REPLAY_LIMIT)
+            for event in events:
+                yield event
+                last_event_id = event.id
+            if len(events) < EVENTS_REPLAY_LIMIT:
+                return
+
+    async def stream(self, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        try:
+            yield "retry: 3000\n\n"
+            sent_id = last_event_id if last_event_id is not None else self.last_id
+            if last_event_id is not None:
+                async for event in self._replay(last_event_id):
+                    yield format_sse(event)
+                    sent_id = event.id
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                if event.id <= sent_id:
+                    continue
+                yield format_sse(event)
+                sent_id = event.id
+        finally:
+            self.subscribers.discard(queue)
+
+
+feed = ChangeFeed()
@@ -0,0 +1,147 @@
+"""
+Faceted account search backed by an in-memory bitmap index.
+
+Each worker keeps one bitmap (a Python int used as a bitset) per facet
+value, with bit i set when the i-th account (ordered by team) has that value.
+A search is an AND across facets of the OR of the selected values, and each
+facet's counts are popcounts of that facet's value bitmaps against the
+filters on the *other* facets, so a selected value's siblings still show
+how many results they would add. At 100k accounts a search is a handful of
+big-int operations rather than a scan.
+
+The index is rebuilt lazily after any write to accounts or platforms_crm
+(the cache invalidation bus tells every worker), and at least every
+CACHE_TTL_SECONDS in case a notification was lost.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from cache import ALL_KEYS, CACHE_TTL_SECONDS, bus
+from models import Account, Platform
+
+# facet name -> Account column; "platform" comes from platforms_crm and is multi-valued
+ACCOUNT_FACETS = ["health", "csm", "vp", "business_or_it", "centerwell_or_insurance"]
+FACETS = ACCOUNT_FACETS + ["platform"]
+
+INDEXED_TABLES = ("accounts", "platforms_crm")
+
+
+class FacetIndex:
+    def __init__(self, uids: List[str], values: Dict[str, Dict[Optional[str], int]]):
+        self.uids = uids
+        self.values = values
+        self.all = (1 << len(uids)) - 1
+
+    @classmethod
+    def build(cls, accounts: Iterable[Account], platforms: Iterable[Tuple[str, Optional[str]]]) -> "FacetIndex":
+        accounts = sorted(accounts, key=lambda a: ((a.team or "").lower(), a.uid))
+        position = {account.uid: i for i, account in enumerate(accounts)}
+        positions: Dict[str, Dict[Optional[str], List[int]]] = {facet: {} for facet in FACETS}
+        for i, account in enumerate(accounts):
+            for facet in ACCOUNT_FACETS:
+                positions[facet].setdefault(getattr(account, facet), []).append(i)
+        for account_uid, platform_name in platforms:
+            if account_uid in position:
+                positions["platform"].setdefault(platform_name, []).append(position[account_uid])
+        size = len(accounts)
+        values = {facet: {value: _bitmap(bits, size) for value, bits in by_value.items()}
+                  for facet, by_value in positions.items()}
+        return cls([account.uid for account in accounts], values)
+
+    def _facet_mask(self, facet: str, selected: List[str]) -> int:
+        mask = 0
+        for value in selected:
+            mask |= self.values[facet].get(value, 0)
+        return mask
+
+    def search(self, filters: Dict[str, List[str]], offset: int = 0, limit: int = 50) -> dict:
+        """Matching uids for one page, the total, and per-facet value counts."""
+        masks = {facet: self._facet_mask(facet, selected) for facet, selected in filters.items() if selected}
+        matched = self.all
+        for mask in masks.values():
+            matched &= mask
+
+        facets = {}
+        for facet in FACETS:
+            # Disjunctive counts: ignore this facet's own filter
+            base = self.all
+            for other, mask in masks.items():
+                if other != facet:
+                    base &= mask
+            counts = [{"value": value, "count": (bitmap & base).bit_count()}
+                      for value, bitmap in self.values[facet].items()]
+            facets[facet] = sorted((c for c in counts if c["count"]),
+                                   key=lambda c: (-c["count"], c["value"] or ""))
+
+        return {
+            "total": matched.bit_count(),
+            "uids": self._page(matched, offset, limit),
+            "facets": facets,
+        }
+
+    def _page(self, mask: int, offset: int, limit: int) -> List[str]:
+        bits = bin(mask)[:1:-1]  # bit 0 first
+        page = []
+        index = -1
+        for _ in range(offset + limit):
+            index = bits.find("1", index + 1)
+            if index < 0:
+                break
+            page.append(index)
+        return [self.uids[i] for i in page[offset:]]
+
+
+def _bitmap(positions: List[int], size: int) -> int:
+    # Setting bits one at a time on a big int is quadratic; fill a byte buffer instead
+    buffer = bytearray((size + 7) // 8)
+    for i in positions:
+        buffer[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class FacetIndexHolder:
+    """Per-worker index, rebuilt on first use after an invalidation."""
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._index: Optional[FacetIndex] = None
+        self._built_at = 0.0
+        self._version = 0
+        self._built_version = 0
+        self._lock = threading.Lock()
+        bus.subscribe(self._on_bus_message)
+
+    def _on_bus_message(self, table: str, key: str) -> None:
+        if table in INDEXED_TABLES or table == ALL_KEYS:
+            self._version += 1
+
+    def get(self, loader: Callable[[], FacetIndex]) -> FacetIndex:
+        with self._lock:
+            if self._index is None or self._stale():
+                version = self._version
+                self._index = loader()
+                self._built_at = time.monotonic()
+                # A write that committed during the build leaves the index marked stale
+                self._built_version = version
+            return self._index
+
+    def _stale(self) -> bool:
+        return self._built_version != self._version or time.monotonic() - self._built_at > self.ttl_seconds
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = None
+
+
+def load_index(session: Session) -> FacetIndex:
+    account_columns = [Account.uid, Account.team] + [getattr(Account, facet) for facet in ACCOUNT_FACETS]
+    accounts = session.exec(select(*account_columns)).all()
+    platforms = session.exec(select(Platform.account_uid, Platform.platform_name).distinct()).all()
+    return FacetIndex.build(accounts, platforms)
+
+
+facet_index = FacetIndexHolder()
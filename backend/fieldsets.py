@@ -0,0 +1,52 @@
+"""
+Sparse fieldsets: `?fields=uid,team,health` on list and detail endpoints.
+
+The requested columns (plus the primary key, so rows can still be keyed)
+are the only ones selected from the database and the only ones serialized.
+Responses with a fieldset bypass the endpoint's response_model, which
+would otherwise fill every omitted field back in with its default.
+"""
+
+from typing import Iterable, List, Optional, Type
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlmodel import SQLModel
+
+
+def parse_fields(model: Type[SQLModel], fields: Optional[str]) -> Optional[List[str]]:
+    """Validated column names for a `fields=` value, primary key first. None means all columns."""
+    if not fields:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    columns = model.__table__.columns
+    unknown = [name for name in requested if name not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    primary_key = [column.name for column in model.__table__.primary_key.columns]
+    return list(dict.fromkeys(primary_key + requested))
+
+
+def column_names(model: Type[SQLModel]) -> List[str]:
+    """Every column of the model's table, in table order."""
+    return [column.name for column in model.__table__.columns]
+
+
+def select_fields(model: Type[SQLModel], names: List[str]):
+    """SELECT projecting only the named columns. Run it with session.execute() to get tuples back."""
+    return select(*[model.__table__.columns[name] for name in names])
+
+
+def rows_to_dicts(rows: Iterable, names: List[str]) -> List[dict]:
+    return [dict(zip(names, row)) for row in rows]
+
+
+def project(obj: SQLModel, names: List[str]) -> dict:
+    """Fieldset of an already-loaded object (cache hits, sample data)."""
+    return {name: getattr(obj, name) for name in names}
+
+
+def fieldset_response(data) -> JSONResponse:
+    return JSONResponse(jsonable_encoder(data))
@@ -0,0 +1,162 @@
+"""
+Binary list formats chosen by the Accept header, for clients that load lists into DataFrames.
+
+    application/json                    - the default, as before
+    application/vnd.apache.arrow.stream - Arrow IPC stream: one record batch per
+                                          STREAM_CHUNK_ROWS rows, typed from the
+                                          table's columns
+    application/msgpack                 - the same array of objects as the JSON,
+                                          in MessagePack (dates as ISO strings)
+
+Arrow batches are built column by column from the query's row tuples, with
+no ORM or Pydantic objects in between, and streamed as they are built, so
+`pyarrow.ipc.open_stream(body).read_all()` gives a table without parsing.
+MessagePack needs the item count up front, so it is sent buffered once every
+chunk has been packed.
+
+Both libraries are optional (listed in requirements.txt, like brotli): a
+format whose package isn't installed isn't offered. A client that accepts
+none of the formats (say `Accept: text/html`) still gets JSON; 406 is only
+for one that rules JSON out with q=0.
+"""
+
+import io
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Type
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel import SQLModel
+
+from fieldsets import rows_to_dicts
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional; Arrow responses are not offered without it
+    pa = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; MessagePack responses are not offered without it
+    msgpack = None
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+# Other names clients send for the same formats
+ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+def supported_media_types() -> List[str]:
+    """List formats this server can produce, in order of preference."""
+    return [JSON] + ([ARROW] if pa is not None else []) + ([MSGPACK] if msgpack is not None else [])
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """The list format for an Accept header: the highest q, explicit types before wildcards, JSON on ties.
+
+    When nothing acceptable is supported the answer is JSON anyway, unless JSON itself has q=0.
+    """
+    if not accept:
+        return JSON
+
+    weights: Dict[str, float] = {}
+    for part in accept.split(","):
+        pieces = part.strip().split(";")
+        media_type = pieces[0].strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[ALIASES.get(media_type, media_type)] = q
+
+    best, best_rank = None, (0.0, False)
+    for media_type in supported_media_types():
+        explicit = media_type in weights
+        q = weights[media_type] if explicit else weights.get("application/*", weights.get("*/*", 0.0))
+        if q > 0 and (q, explicit) > best_rank:
+            best, best_rank = media_type, (q, explicit)
+    if best is None:
+        if weights.get(JSON, weights.get("application/*", weights.get("*/*"))) != 0:
+            return JSON
+        raise HTTPException(status_code=406,
+                            detail=f"Not Acceptable: this endpoint can return {', '.join(supported_media_types())}")
+    return best
+
+
+_ARROW_TYPES = {
+    bool: lambda: pa.bool_(),
+    int: lambda: pa.int64(),
+    float: lambda: pa.float64(),
+    str: lambda: pa.string(),
+    date: lambda: pa.date32(),
+    datetime: lambda: pa.timestamp("us"),
+}
+
+
+def arrow_schema(model: Type[SQLModel], names: List[str]):
+    fields = []
+    for name in names:
+        try:
+            python_type = model.__table__.columns[name].type.python_type
+        except NotImplementedError:
+            python_type = str
+        fields.append(pa.field(name, _ARROW_TYPES.get(python_type, _ARROW_TYPES[str])()))
+    return pa.schema(fields)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def arrow_batches(schema, chunks: Iterable[list]) -> Iterator[bytes]:
+    """An Arrow IPC stream, one record batch per chunk of row tuples in schema order."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            yield _drain(sink)
+    yield _drain(sink)
+
+
+def _msgpack_default(value):
+    # The JSON encoder's representation, so both formats carry the same values
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def msgpack_array(chunks: Iterable[list], encode: Callable[[list], list]) -> bytes:
+    packer = msgpack.Packer(default=_msgpack_default)
+    count = 0
+    parts = []
+    for rows in chunks:
+        items = encode(rows)
+        count += len(items)
+        parts.append(b"".join(packer.pack(item) for item in items))
+    return packer.pack_array_header(count) + b"".join(parts)
+
+
+def binary_list_response(media_type: str, model: Type[SQLModel], names: List[str], chunks: Iterable[list],
+                         encode: Optional[Callable[[list], list]] = None) -> Response:
+    """Arrow or MessagePack for chunks of `select_fields(model, names)` rows.
+
+    `encode` turns a chunk into the items of the MessagePack array (default:
+    one map per row); Arrow always writes the selected columns.
+    """
+    if media_type == ARROW:
+        return StreamingResponse(arrow_batches(arrow_schema(model, names), chunks), media_type=ARROW)
+    encode = encode or (lambda rows: rows_to_dicts(rows, names))
+    return Response(msgpack_array(chunks, encode), media_type=MSGPACK)
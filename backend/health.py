@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Batch health scoring for every account.
+
+Each account gets a 0-100 score from five signals already in the schema,
+each scaled to 0..1 and weighted by HEALTH_WEIGHTS:
+
+    recency    - days since the latest update, hot or archived (0 at
+                 HEALTH_STALE_DAYS)
+    frequency  - updates in the last HEALTH_ACTIVITY_DAYS, against
+                 HEALTH_TARGET_UPDATES
+    use_cases  - mean progress of the account's use case statuses
+    platforms  - mean onboarding progress of its platforms
+    onboarding - whether and how long ago it onboarded (month_onboarded_db /
+                 month_onboarded_sf), ramping up over HEALTH_RAMP_DAYS
+
+The score maps to health (Green >= HEALTH_GREEN_SCORE, Yellow >=
+HEALTH_YELLOW_SCORE, else Red), and health_reason names the weakest signal.
+
+Signals are aggregated in SQL (GROUP BY account) and loaded as columns; the
+scoring is NumPy over whole arrays. An account is written only when its
+health or reason changes or its score moves by HEALTH_SCORE_MIN_CHANGE, so a
+daily run doesn't rewrite (and push through delta sync) every account just
+because a day has passed. Writes are executemany UPDATEs by primary key.
+Run it on demand with `POST /api/health-scores/run`, or on a schedule from
+cron:
+
+    python health.py
+"""
+
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import String, bindparam, case, func, type_coerce, union_all
+from sqlmodel import Session, select
+
+load_dotenv()
+
+from cache import invalidate
+from changes import OP_UPSERT, record_changes
+from database import engine
+from models import Account, Platform, UseCase, Update, UpdateArchive
+from search import index_documents
+
+HEALTH_STALE_DAYS = int(os.getenv("HEALTH_STALE_DAYS", "90"))
+HEALTH_ACTIVITY_DAYS = int(os.getenv("HEALTH_ACTIVITY_DAYS", "90"))
+HEALTH_TARGET_UPDATES = int(os.getenv("HEALTH_TARGET_UPDATES", "6"))
+HEALTH_RAMP_DAYS = int(os.getenv("HEALTH_RAMP_DAYS", "180"))
+HEALTH_GREEN_SCORE = float(os.getenv("HEALTH_GREEN_SCORE", "70"))
+HEALTH_YELLOW_SCORE = float(os.getenv("HEALTH_YELLOW_SCORE", "40"))
+HEALTH_SCORE_MIN_CHANGE = float(os.getenv("HEALTH_SCORE_MIN_CHANGE", "2"))
+
+SIGNALS = ["recency", "frequency", "use_cases", "platforms", "onboarding"]
+HEALTH_WEIGHTS = np.array([0.3, 0.2, 0.2, 0.2, 0.1])
+
+# Progress per status, matched case-insensitively; unlisted statuses count as NEUTRAL
+USE_CASE_STATUS_SCORES = {
+    "completed": 1.0, "done": 1.0, "live": 1.0, "in production": 1.0,
+    "active": 0.75, "in progress": 0.75,
+    "planning": 0.5, "not started": 0.3,
+    "on hold": 0.1, "blocked": 0.0, "cancelled": 0.0,
+}
+PLATFORM_STATUS_SCORES = {
+    "completed": 1.0, "onboarded": 1.0, "in progress": 0.6, "not started": 0.2,
+}
+NEUTRAL = 0.5
+STALLED = 0.2  # use cases and platforms at or below this count as stalled in the reason
+
+UPDATE_BATCH_SIZE = 5000
+
+
+def _status_scores(statuses: List[Optional[str]], scores: Dict[str, float]) -> np.ndarray:
+    """Score per row, looked up once per distinct status."""
+    if not statuses:
+        return np.zeros(0)
+    distinct, inverse = np.unique(np.array([(s or "").strip().lower() for s in statuses]), return_inverse=True)
+    return np.array([scores.get(s, NEUTRAL) for s in distinct])[inverse]
+
+
+def _positions(uids: np.ndarray, keys: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Index into the sorted `uids` array of each key that is in it, and a mask of those keys.
+
+    Rows for uids with no account (orphans left by a missing foreign key) are
+    dropped rather than credited to the neighbouring account.
+    """
+    if not uids.size:
+        return np.zeros(0, dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    # Not cast to uids.dtype: that truncates keys longer than the longest uid
+    keys = np.array(keys, dtype=str)
+    index = np.searchsorted(uids, keys)
+    found = uids[np.minimum(index, uids.size - 1)] == keys
+    return index[found], found
+
+
+def _grouped_mean(index: np.ndarray, scores: np.ndarray, counts: np.ndarray,
+                  size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-account count-weighted mean (NEUTRAL without rows), and the number of stalled rows."""
+    total = np.bincount(index, weights=counts, minlength=size)
+    weighted = np.bincount(index, weights=scores * counts, minlength=size)
+    stalled = np.bincount(index, weights=counts * (scores <= STALLED), minlength=size)
+    mean = np.divide(weighted, total, out=np.full(size, NEUTRAL), where=total > 0)
+    return mean, np.column_stack([total, stalled]).astype(np.int64)
+
+
+def _date_text(column):
+    # NumPy parses ISO dates far faster than SQLite's per-row date processor; Postgres still returns dates
+    return type_coerce(column, String)
+
+
+def load_signals(session: Session, as_of: date) -> dict:
+    """Raw per-account inputs as arrays aligned on `uids` (sorted)."""
+    # Core execution: plain tuples, no ORM row processing
+    connection = session.connection()
+    accounts = connection.execute(
+        select(Account.uid, _date_text(Account.month_onboarded_db), _date_text(Account.month_onboarded_sf),
+               Account.health, Account.health_reason, Account.health_score).order_by(Account.uid)
+    ).all()
+    uids = np.array([a[0] for a in accounts])
+    size = uids.size
+
+    since = as_of - timedelta(days=HEALTH_ACTIVITY_DAYS)
+    # Archived updates count too: an account whose notes were all archived still has a last update
+    dated = union_all(*[
+        select(model.account_uid, model.date).where(model.date.is_not(None), model.date <= as_of)
+        for model in (Update, UpdateArchive)
+    ]).subquery()
+    updates = connection.execute(
+        select(dated.c.account_uid, _date_text(func.max(dated.c.date)),
+               func.sum(case((dated.c.date >= since, 1), else_=0)))
+        .group_by(dated.c.account_uid)
+    ).all()
+    update_index, found = _positions(uids, [u[0] for u in updates])
+    last_update = np.full(size, np.datetime64("NaT"), dtype="datetime64[D]")
+    last_update[update_index] = np.array([u[1] for u in updates], dtype="datetime64[D]")[found]
+    recent_updates = np.zeros(size, dtype=np.int64)
+    recent_updates[update_index] = np.array([u[2] for u in updates], dtype=np.int64)[found]
+
+    use_cases = connection.execute(
+        select(UseCase.account_uid, UseCase.status, func.count()).group_by(UseCase.account_uid, UseCase.status)
+    ).all()
+    platforms = connection.execute(
+        select(Platform.account_uid, Platform.onboarding_status, func.count())
+        .group_by(Platform.account_uid, Platform.onboarding_status)
+    ).all()
+
+    def grouped(rows: list, scores: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        index, found = _positions(uids, [r[0] for r in rows])
+        return _grouped_mean(index, _status_scores([r[1] for r in rows], scores)[found],
+                             np.array([r[2] for r in rows], dtype=float)[found], size)
+
+    def onboarded(column: int) -> np.ndarray:
+        return np.array([a[column] for a in accounts], dtype="datetime64[D]")
+
+    return {
+        "uids": uids,
+        "current": [(a[3], a[4], a[5]) for a in accounts],
+        "last_update": last_update,
+        "recent_updates": recent_updates,
+        "use_cases": grouped(use_cases, USE_CASE_STATUS_SCORES),
+        "platforms": grouped(platforms, PLATFORM_STATUS_SCORES),
+        # Earliest onboarding across platforms; NaT when never onboarded
+        "onboarded": np.fmin(onboarded(1), onboarded(2)),
+    }
+
+
+def _days_since(today: np.datetime64, dates: np.ndarray) -> np.ndarray:
+    days = (today - dates).astype(np.float64)
+    days[np.isnat(dates)] = np.nan  # NaT doesn't become nan on its own
+    return days
+
+
+def score_signals(signals: dict, as_of: date) -> dict:
+    """Signal matrix (accounts x SIGNALS), scores and health bands, all vectorized."""
+    today = np.datetime64(as_of, "D")
+    days_since_update = _days_since(today, signals["last_update"])
+    days_onboarded = _days_since(today, signals["onboarded"])
+
+    recency = np.nan_to_num(np.clip(1 - days_since_update / HEALTH_STALE_DAYS, 0, 1), nan=0.0)
+    frequency = np.minimum(signals["recent_updates"] / HEALTH_TARGET_UPDATES, 1.0)
+    use_cases, _ = signals["use_cases"]
+    platforms, _ = signals["platforms"]
+    onboarding = np.where(np.isnan(days_onboarded), 0.0,
+                          0.5 + 0.5 * np.clip(np.nan_to_num(days_onboarded) / HEALTH_RAMP_DAYS, 0, 1))
+
+    matrix = np.column_stack([recency, frequency, use_cases, platforms, onboarding])
+    scores = np.round(matrix @ HEALTH_WEIGHTS * 100, 1)
+    health = np.where(scores >= HEALTH_GREEN_SCORE, "Green", np.where(scores >= HEALTH_YELLOW_SCORE, "Yellow", "Red"))
+    # The signal that costs the most points
+    weakest = np.argmax((1 - matrix) * HEALTH_WEIGHTS, axis=1)
+    return {"matrix": matrix, "scores": scores, "health": health, "weakest": weakest}
+
+
+def _reasons(signals: dict, scored: dict) -> np.ndarray:
+    """Every account's health_reason: one column of wordings per signal, picked by the weakest."""
+    # Worded with dates rather than day counts, so an unchanged account keeps the same reason between runs
+    def joined(*parts) -> np.ndarray:
+        out = parts[0]
+        for part in parts[1:]:
+            out = np.char.add(out, part)
+        return out
+
+    def dated(dates: np.ndarray, missing: str, prefix: str, suffix: str = "") -> np.ndarray:
+        return np.where(np.isnat(dates), missing, joined(prefix, dates.astype(str), suffix))
+
+    def statuses(signal: str, noun: str) -> np.ndarray:
+        total, stalled = signals[signal][1].T
+        return np.where(total == 0, f"No {noun} recorded",
+                        joined(stalled.astype(str), " of ", total.astype(str), f" {noun} stalled or not started"))
+
+    count = signals["recent_updates"]
+    wordings = {
+        "recency": dated(signals["last_update"], "No updates recorded", "No update since "),
+        "frequency": joined(count.astype(str), np.where(count == 1, " update", " updates"),
+                            f" in the last {HEALTH_ACTIVITY_DAYS} days"),
+        "use_cases": statuses("use_cases", "use cases"),
+        "platforms": statuses("platforms", "platforms"),
+        "onboarding": dated(signals["onboarded"], "Not onboarded to a platform", "Onboarded ", ", still ramping up"),
+    }
+    table = np.column_stack([wordings[signal] for signal in SIGNALS]).astype(object)
+    weakest = np.take_along_axis(table, scored["weakest"][:, None], axis=1)[:, 0]
+    return np.where(scored["health"] == "Green", "On track", weakest).astype(object)
+
+
+def score_accounts(session: Session, as_of: Optional[date] = None,
+                   min_change: float = HEALTH_SCORE_MIN_CHANGE) -> dict:
+    """Score every account and write back the ones that changed. Commits; returns a summary."""
+    started = time.perf_counter()
+    as_of = as_of or date.today()
+    signals = load_signals(session, as_of)
+    scored = score_signals(signals, as_of)
+
+    health = scored["health"].astype(object)
+    reasons = _reasons(signals, scored)
+    current = signals["current"]
+    current_score = np.array([c[2] for c in current], dtype=np.float64)  # None -> nan
+    reason_changed = reasons != np.array([c[1] for c in current], dtype=object)
+    changed = (health != np.array([c[0] for c in current], dtype=object)) | reason_changed | ~(
+        np.abs(scored["scores"] - current_score) < min_change)  # nan (never scored) counts as changed
+
+    now = datetime.utcnow()
+    table = Account.__table__
+    statement = table.update().where(table.c.uid == bindparam("key")).values(
+        health=bindparam("health"), health_reason=bindparam("reason"), health_score=bindparam("score"),
+        health_scored_at=now)
+    connection = session.connection()
+    indices = np.flatnonzero(changed)
+    for start in range(0, indices.size, UPDATE_BATCH_SIZE):
+        batch = indices[start:start + UPDATE_BATCH_SIZE]
+        uids = signals["uids"][batch].tolist()
+        # One executemany UPDATE by primary key; Core, so no ORM objects are loaded
+        connection.execute(statement, [
+            {"key": uid, "health": h, "reason": r, "score": float(sc)}
+            for uid, h, r, sc in zip(uids, health[batch], reasons[batch], scored["scores"][batch])
+        ])
+        record_changes(session, "accounts", uids, OP_UPSERT)
+        # health_reason is part of the account's search document
+        reindex = signals["uids"][batch[reason_changed[batch]]].tolist()
+        if reindex:
+            index_documents(session, session.exec(select(Account).where(Account.uid.in_(reindex))).all(),
+                            replace=True)
+    if indices.size:
+        invalidate(session, "accounts")
+    session.commit()
+
+    bands, counts = np.unique(scored["health"], return_counts=True)
+    return {
+        "as_of": as_of.isoformat(),
+        "accounts": int(signals["uids"].size),
+        "changed": int(indices.size),
+        "health": {str(b): int(c) for b, c in zip(bands, counts)},
+        "mean_score": round(float(scored["scores"].mean()), 1) if scored["scores"].size else None,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    with Session(engine) as session:
+        print(score_accounts(session))
@@ -0,0 +1,227 @@
+"""
+Group-commit ingestion for machine-generated account updates.
+
+`POST /api/updates/ingest` accepts one event or a batch (Azure DevOps work
+item changes, pipeline notifications, ...) and hands the rows to the
+worker's GroupCommitWriter instead of committing them itself. The writer
+thread collects everything submitted within INGEST_MAX_DELAY_MS (up to
+INGEST_MAX_BATCH events) and writes it with one multi-row INSERT and one
+commit, so throughput grows with batch size rather than with commits per
+second. When events pile up during a commit, the next group is flushed
+immediately without waiting.
+
+A submission is acknowledged once the commit that contains it returns, so
+an acknowledged event is durable. Each submission is all-or-nothing: one
+that references an unknown account is rejected on its own without failing
+the rest of the group. With `?wait=false` the accounts are checked with one
+IN query before the 202, and a failure after that can only be logged. When INGEST_QUEUE_SIZE events are already waiting,
+new submissions are refused (503 + Retry-After) instead of buffering
+without bound.
+
+Bulk inserts bypass the ORM flush hooks, so the writer appends the change
+log rows, search documents and cache invalidation itself.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from cache import invalidate
+from changes import OP_UPSERT, record_changes
+from database import engine
+from models import Account, Update
+from search import index_documents
+
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "1000"))
+INGEST_MAX_DELAY_MS = float(os.getenv("INGEST_MAX_DELAY_MS", "5"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "20000"))
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class UnknownAccountError(ValueError):
+    def __init__(self, account_uids: List[str]):
+        super().__init__(f"Unknown account_uid: {', '.join(account_uids)}")
+        self.account_uids = account_uids
+
+
+class _Submission:
+    __slots__ = ("rows", "on_done")
+
+    def __init__(self, rows: List[dict], on_done: Callable[[Optional[Exception]], None]):
+        self.rows = rows
+        self.on_done = on_done
+
+
+def unknown_accounts(session: Session, rows: List[dict]) -> List[str]:
+    uids = {row["account_uid"] for row in rows}
+    return sorted(uids - set(session.exec(select(Account.uid).where(Account.uid.in_(uids))).all()))
+
+
+def write_batch(session: Session, batch: List[_Submission]) -> List[Tuple[_Submission, Optional[Exception]]]:
+    """Insert every valid submission in one statement and commit. Returns each submission's outcome."""
+    uids = {row["account_uid"] for submission in batch for row in submission.rows}
+    known = set(session.exec(select(Account.uid).where(Account.uid.in_(uids))).all())
+    results: List[Tuple[_Submission, Optional[Exception]]] = []
+    accepted = []
+    for submission in batch:
+        missing = sorted({row["account_uid"] for row in submission.rows} - known)
+        if missing:
+            results.append((submission, UnknownAccountError(missing)))
+        else:
+            accepted.append(submission)
+
+    rows = [row for submission in accepted for row in submission.rows]
+    if rows:
+        written = session.scalars(insert(Update).returning(Update), rows).all()
+        record_changes(session, "updates", [update.id for update in written], OP_UPSERT)
+        index_documents(session, written)
+        invalidate(session, "updates")
+        session.commit()
+    return results + [(submission, None) for submission in accepted]
+
+
+class GroupCommitWriter:
+    """Single writer thread that turns many small submissions into few large commits."""
+
+    def __init__(self, bind=engine, max_batch: int = INGEST_MAX_BATCH, max_delay_ms: float = INGEST_MAX_DELAY_MS,
+                 queue_size: int = INGEST_QUEUE_SIZE):
+        self.bind = bind
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.queue_size = queue_size
+        self.queued = 0
+        self.batches = 0
+        self.events_written = 0
+        self.rejected = 0
+        self.last_batch_size = 0
+        self._pending: Deque[_Submission] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Flush what is queued, then stop the thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def submit(self, rows: List[dict], on_done: Callable[[Optional[Exception]], None]) -> None:
+        """Queue rows; `on_done(error)` is called from the writer thread after the commit."""
+        self.start()
+        with self._condition:
+            # A single oversized submission is still accepted into an empty queue
+            if self.queued and self.queued + len(rows) > self.queue_size:
+                self.rejected += 1
+                raise IngestQueueFull(f"Ingest queue is full ({self.queued} events waiting)")
+            self._pending.append(_Submission(rows, on_done))
+            self.queued += len(rows)
+            self._condition.notify_all()
+
+    async def write(self, rows: List[dict]) -> None:
+        """Queue rows and wait until they are committed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(error: Optional[Exception]) -> None:
+            if future.done():  # the client went away
+                return
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        def on_done(error: Optional[Exception]) -> None:
+            try:
+                loop.call_soon_threadsafe(resolve, error)
+            except RuntimeError:
+                pass  # loop already closed
+
+        self.submit(rows, on_done)
+        await future
+
+    def check_accounts(self, rows: List[dict]) -> None:
+        with Session(self.bind) as session:
+            missing = unknown_accounts(session, rows)
+        if missing:
+            raise UnknownAccountError(missing)
+
+    async def enqueue(self, rows: List[dict]) -> None:
+        """Queue rows without waiting for the commit, once their accounts are known to exist."""
+        await asyncio.to_thread(self.check_accounts, rows)
+
+        def on_done(error: Optional[Exception]) -> None:
+            if error is not None:  # nobody is waiting for the outcome
+                print(f"Queued ingest of {len(rows)} events failed: {error}")
+
+        self.submit(rows, on_done)
+
+    def _take(self) -> List[_Submission]:
+        batch = [self._pending.popleft()]
+        size = len(batch[0].rows)
+        while self._pending and size + len(self._pending[0].rows) <= self.max_batch:
+            submission = self._pending.popleft()
+            batch.append(submission)
+            size += len(submission.rows)
+        self.queued -= size
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                idle = not self._pending
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                if idle:
+                    # The first event after a quiet spell waits briefly so concurrent submitters share its commit
+                    deadline = time.monotonic() + self.max_delay
+                    while self.queued < self.max_batch and not self._stopping:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                batch = self._take()
+            self._flush(batch)
+
+    def _flush(self, batch: List[_Submission]) -> None:
+        try:
+            with Session(self.bind) as session:
+                results = write_batch(session, batch)
+        except Exception as e:
+            print(f"Ingest batch of {sum(len(s.rows) for s in batch)} events failed: {e}")
+            results = [(submission, e) for submission in batch]
+        written = sum(len(submission.rows) for submission, error in results if error is None)
+        self.batches += 1
+        self.events_written += written
+        self.last_batch_size = written
+        for submission, error in results:
+            submission.on_done(error)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queued, "queue_size": self.queue_size, "max_batch": self.max_batch,
+                "batches": self.batches, "events_written": self.events_written,
+                "last_batch_size": self.last_batch_size, "rejected": self.rejected}
+
+
+ingest_writer = GroupCommitWriter()
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Header, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlmodel import Session, select
-from typing import List, Optional
-from pydantic import BaseModel
+from sqlalchemy import delete, literal, true
+from typing import List, Optional, Union
+from pydantic import BaseModel, Field
 from datetime import date as date_type
 import os
 from dotenv import load_dotenv
@@ -10,8 +14,32 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from database import create_db_and_tables, get_session, engine
-from models import Account, UseCase, Update, Platform, PrimaryITPartner, IntakeRequest, RequestState, RequestStateAssignment
+from database import create_db_and_tables, get_session, engine, db_router, pool_status, insert_ignoring_conflicts, DB_POOL_TIMEOUT
+from compression import CompressionMiddleware
+from fieldsets import parse_fields, select_fields, rows_to_dicts, project, fieldset_response, column_names
+from facets import FacetIndex, facet_index, load_index
+from admission import AdmissionControlMiddleware, admission_stats, is_statement_timeout, ADMISSION_RETRY_AFTER
+from profiling import ProfilingMiddleware, continuous_profiler, is_authorized, PROFILING_ENABLED, PROFILING_TOKEN
+import tracing
+from cache import cache, bus, invalidate
+from outbox import OutboxWorker, check_sender_config, enqueue_email, intake_notification, OUTBOX_SENDER, OUTBOX_WORKER_IN_APP
+from changes import backfill_change_log, get_changes, record_changes, OP_UPSERT, OP_DELETE, TRACKED_MODELS
+from events import feed, record_event, REQUEST_CREATED, REQUEST_UPDATED, REQUEST_DELETED, STATE_ASSIGNED, STATE_REMOVED
+from archive import account_updates
+from search import ENTITY_TYPES, backfill_search_index, search
+from similarity import ENTITY_TYPES as MATCH_TYPES, find_matches
+from sideload import (INCLUDE_BATCH_SIZE, LATEST_UPDATE, PLATFORMS, PRIMARY_IT_PARTNER, USE_CASES, attach, group_rows,
+                      load_includes, parse_include)
+from board import (BOARD_MAX_PAGE_SIZE, BOARD_PAGE_SIZE, backfill_current_states, load_board, load_column,
+                   refresh_current_states)
+from streaming import fieldset_encoder, model_encoder, query_chunks, stream_list
+from formats import ARROW, JSON, binary_list_response, negotiate
+from analytics import INTERVALS, onboarding_analytics
+from health import score_accounts
+from reports import (MEDIA_TYPES, REPORT_FORMATS, STATUS_DONE, purge_expired_reports, read_report_file,
+                     report_filename, report_runner)
+from ingest import IngestQueueFull, UnknownAccountError, ingest_writer
+from models import Account, UseCase, Update, UpdateArchive, Platform, PrimaryITPartner, IntakeRequest, RequestState, RequestStateAssignment, ReportJob
 
 
 class AccountUpdate(BaseModel):
@@ -94,6 +122,12 @@ class IntakeRequestUpdate(BaseModel):
     additional_details: Optional[str] = None
 
 
+class BulkStateChange(BaseModel):
+    request_ids: List[int] = Field(min_length=1, max_length=1000)
+    assign_state_ids: List[int] = []
+    remove_state_ids: List[int] = []
+
+
 class RequestStateCreate(BaseModel):
     name: str
     color: Optional[str] = None
@@ -106,6 +140,18 @@ class RequestStateUpdate(BaseModel):
     description: Optional[str] = None
 
 
+class ReportCreate(BaseModel):
+    format: str = "csv"
+
+
+class UpdateEvent(BaseModel):
+    account_uid: str
+    description: Optional[str] = None
+    author: Optional[str] = None
+    platform: Optional[str] = None
+    date: Optional[date_type] = None
+
+
 from sample_data import (
     get_sample_accounts,
     get_sample_use_cases,
@@ -116,6 +162,10 @@ from sample_data import (
 
 app = FastAPI(title="CRM API", version="1.0.0")
 
+# Per-route-class concurrency limits and load shedding (see admission.py). Added first so
+# CORS headers are still applied to its 503 responses.
+app.add_middleware(AdmissionControlMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -124,9 +174,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated gzip/brotli compression for large list payloads (see compression.py)
+app.add_middleware(CompressionMiddleware)
+
+# Sampling profiler (see profiling.py); only installed when configured
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# Request/SQL/serialization spans (see tracing.py); outermost so queueing in admission control is included
+tracing.instrument(app)
+
 USE_SAMPLE_DATA = os.getenv("USE_SAMPLE_DATA", "false").lower() == "true"
 
 
+@app.exception_handler(PoolTimeoutError)
+def pool_timeout_handler(request, exc):
+    # Connection pool exhausted for DB_POOL_TIMEOUT seconds; shed the request instead of queueing
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database is busy, please retry"},
+        headers={"Retry-After": str(max(1, int(DB_POOL_TIMEOUT)))},
+    )
+
+
+@app.exception_handler(OperationalError)
+def statement_timeout_handler(request, exc):
+    # Statement ran past its route class's timeout; anything else is a real error
+    if not is_statement_timeout(exc):
+        raise exc
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Query took too long, please retry"},
+        headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+    )
+
+
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
@@ -166,32 +248,286 @@ def on_startup():
                 session.commit()
 
 
+@app.on_event("startup")
+def start_change_log():
+    backfill_change_log()
+
+
+@app.on_event("startup")
+def start_replica_health_checks():
+    db_router.start()
+
+
+@app.on_event("shutdown")
+def stop_replica_health_checks():
+    db_router.stop()
+
+
+@app.on_event("startup")
+def start_search_index():
+    backfill_search_index()
+
+
+@app.on_event("startup")
+def start_board():
+    backfill_current_states()
+
+
+@app.on_event("startup")
+def start_report_jobs():
+    report_runner.start()
+
+
+@app.on_event("shutdown")
+def stop_report_jobs():
+    report_runner.shutdown()
+
+
+@app.on_event("startup")
+def start_ingest_writer():
+    ingest_writer.start()
+
+
+@app.on_event("shutdown")
+def stop_ingest_writer():
+    ingest_writer.stop()
+
+
+@app.on_event("startup")
+def start_cache_bus():
+    bus.start()
+
+
+@app.on_event("shutdown")
+def stop_cache_bus():
+    bus.stop()
+
+
+@app.on_event("startup")
+async def start_change_feed():
+    await feed.start()
+
+
+@app.on_event("shutdown")
+async def stop_change_feed():
+    await feed.stop()
+
+
+outbox_worker = OutboxWorker() if OUTBOX_WORKER_IN_APP and OUTBOX_SENDER else None
+
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    check_sender_config()
+    if outbox_worker:
+        await outbox_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_outbox_worker():
+    if outbox_worker:
+        await outbox_worker.stop()
+
+
 @app.get("/")
 def read_root():
     return {"message": "CRM API is running", "use_sample_data": USE_SAMPLE_DATA}
 
 
+@app.get("/api/system/pool")
+def get_pool_status():
+    return pool_status()
+
+
+@app.get("/api/system/cache")
+def get_cache_status():
+    return {"bus": bus.name, **cache.stats()}
+
+
+@app.get("/api/system/admission")
+def get_admission_status():
+    return admission_stats()
+
+
+@app.get("/api/system/ingest")
+def get_ingest_status():
+    return ingest_writer.stats()
+
+
+@app.get("/api/system/tracing")
+def get_tracing_status():
+    return tracing.tracing_status()
+
+
+@app.get("/api/system/profile")
+def get_profile(format: str = "json", top: int = Query(default=20, ge=1, le=500),
+                x_profile: Optional[str] = Header(default=None)):
+    if continuous_profiler.hz <= 0:
+        raise HTTPException(status_code=404, detail="Continuous profiling is not enabled")
+    if PROFILING_TOKEN and not is_authorized(x_profile):
+        raise HTTPException(status_code=403, detail="X-Profile token required")
+    if format == "folded":
+        return PlainTextResponse(continuous_profiler.folded())
+    return continuous_profiler.report(top)
+
+
+@app.get("/api/changes")
+def get_changes_since(since: int = 0, limit: int = Query(default=500, ge=1, le=5000),
+                      tables: Optional[str] = None, session: Session = Depends(get_session)):
+    table_list = [t.strip() for t in tables.split(",") if t.strip()] if tables else None
+    unknown = [t for t in table_list or [] if t not in TRACKED_MODELS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown tables: {', '.join(unknown)}")
+    return get_changes(session, since, limit, table_list)
+
+
+@app.get("/api/search")
+def search_everything(q: str = Query(min_length=1, max_length=200), types: Optional[str] = None,
+                      offset: int = Query(default=0, ge=0), limit: int = Query(default=10, ge=1, le=50),
+                      session: Session = Depends(get_session)):
+    type_list = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    unknown = [t for t in type_list or [] if t not in ENTITY_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {', '.join(unknown)}")
+    return search(session, q, type_list, offset, limit)
+
+
+@app.get("/api/analytics/onboarding")
+def get_onboarding_analytics(interval: str = "month", start: Optional[date_type] = None,
+                             end: Optional[date_type] = None, account_uid: Optional[str] = None,
+                             session: Session = Depends(get_session)):
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unknown interval: {interval} (expected one of {', '.join(INTERVALS)})")
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must be on or before end")
+    return onboarding_analytics(session, interval, start, end, account_uid)
+
+
+def with_includes(rows: list, includes: List[str], session: Session) -> list:
+    """Account dicts with each included relation attached, one IN query per relation."""
+    rows = [row if isinstance(row, dict) else row.model_dump() for row in rows]
+    if USE_SAMPLE_DATA:
+        sample = {PLATFORMS: get_sample_platforms, USE_CASES: get_sample_use_cases,
+                  PRIMARY_IT_PARTNER: get_sample_primary_it_partners, LATEST_UPDATE: get_sample_updates}
+        loaded = {name: group_rows(name, sample[name]()) for name in includes}
+    else:
+        loaded = load_includes(session, [row["uid"] for row in rows], includes)
+    return attach(rows, loaded)
+
+
+def binary_list(media_type: str, model, names: List[str], chunks, includes: List[str], session: Session):
+    """Arrow or MessagePack for a list endpoint; chunks are rows of `names` in order."""
+    if includes and media_type == ARROW:
+        raise HTTPException(status_code=400, detail="include= is not supported for Arrow responses")
+    encode = None
+    if includes:
+        def encode(rows):
+            return jsonable_encoder(with_includes(rows_to_dicts(rows, names), includes, session))
+    return binary_list_response(media_type, model, names, chunks, encode)
+
+
 @app.get("/api/accounts", response_model=List[Account])
-def get_accounts(session: Session = Depends(get_session)):
+def get_accounts(fields: Optional[str] = None, include: Optional[str] = None,
+                 offset: int = Query(default=0, ge=0), limit: Optional[int] = Query(default=None, ge=1, le=INCLUDE_BATCH_SIZE),
+                 accept: Optional[str] = Header(default=None), session: Session = Depends(get_session)):
+    names = parse_fields(Account, fields)
+    includes = parse_include(include)
+    media_type = negotiate(accept)
+    paginated = limit is not None or offset > 0
     if USE_SAMPLE_DATA:
-        return get_sample_accounts()
-    accounts = session.exec(select(Account)).all()
-    return accounts
+        accounts = get_sample_accounts()
+        if paginated:
+            accounts = sorted(accounts, key=lambda a: a.uid)[offset:offset + limit if limit else None]
+        if media_type != JSON:
+            columns = names or column_names(Account)
+            return binary_list(media_type, Account, columns, [[tuple(getattr(a, c) for c in columns) for a in accounts]],
+                               includes, session)
+        if includes:
+            return fieldset_response(with_includes([project(a, names) for a in accounts] if names else accounts,
+                                                   includes, session))
+        return fieldset_response([project(a, names) for a in accounts]) if names else accounts
+    if media_type != JSON:
+        # Plain column tuples, whatever the fieldset; no ORM objects
+        columns = names or column_names(Account)
+        query = select_fields(Account, columns)
+        if paginated:
+            query = query.order_by(Account.uid).offset(offset).limit(limit)
+        return binary_list(media_type, Account, columns, query_chunks(session, query, scalars=False), includes, session)
+    query = select_fields(Account, names) if names else select(Account)
+    if not paginated:
+        # The whole table: streamed a chunk at a time, with includes loaded per chunk
+        chunks = query_chunks(session, query, scalars=not names)
+        if includes:
+            return stream_list(chunks, lambda rows: jsonable_encoder(
+                with_includes(rows_to_dicts(rows, names) if names else rows, includes, session)))
+        return stream_list(chunks, fieldset_encoder(names) if names else model_encoder(Account))
+    query = query.order_by(Account.uid).offset(offset).limit(limit)
+    if names:
+        rows = rows_to_dicts(session.execute(query), names)
+    else:
+        accounts = session.exec(query).all()
+        if not includes:
+            return accounts
+        rows = accounts
+    return fieldset_response(with_includes(rows, includes, session) if includes else rows)
+
+
+@app.post("/api/health-scores/run")
+def run_health_scoring(session: Session = Depends(get_session)):
+    """Rescore every account now (also run on a schedule with `python health.py`)."""
+    if USE_SAMPLE_DATA:
+        raise HTTPException(status_code=400, detail="Cannot score accounts in sample data mode")
+    return score_accounts(session)
+
+
+@app.get("/api/accounts/search")
+def search_accounts(health: List[str] = Query(default=[]), csm: List[str] = Query(default=[]),
+                    vp: List[str] = Query(default=[]), business_or_it: List[str] = Query(default=[]),
+                    centerwell_or_insurance: List[str] = Query(default=[]), platform: List[str] = Query(default=[]),
+                    offset: int = Query(default=0, ge=0), limit: int = Query(default=50, ge=1, le=500),
+                    fields: Optional[str] = None, include: Optional[str] = None,
+                    session: Session = Depends(get_session)):
+    names = parse_fields(Account, fields)
+    includes = parse_include(include)
+    filters = {"health": health, "csm": csm, "vp": vp, "business_or_it": business_or_it,
+               "centerwell_or_insurance": centerwell_or_insurance, "platform": platform}
+    if USE_SAMPLE_DATA:
+        accounts = {a.uid: a for a in get_sample_accounts()}
+        index = FacetIndex.build(accounts.values(), [(p.account_uid, p.platform_name) for p in get_sample_platforms()])
+        result = index.search(filters, offset, limit)
+        items = [accounts[uid] for uid in result["uids"]]
+        items = [project(a, names) for a in items] if names else items
+    else:
+        index = facet_index.get(lambda: load_index(session))
+        result = index.search(filters, offset, limit)
+        # One IN query for the page, returned in index (team) order
+        if names:
+            query = select_fields(Account, names).where(Account.uid.in_(result["uids"]))
+            by_uid = {row["uid"]: row for row in rows_to_dicts(session.execute(query), names)}
+        else:
+            by_uid = {a.uid: a for a in session.exec(select(Account).where(Account.uid.in_(result["uids"]))).all()}
+        items = [by_uid[uid] for uid in result["uids"] if uid in by_uid]
+    if includes:
+        items = with_includes(items, includes, session)
+    return fieldset_response({"total": result["total"], "offset": offset, "limit": limit,
+                              "items": items, "facets": result["facets"]})
 
 
 @app.get("/api/accounts/{uid}", response_model=Account)
-def get_account(uid: str, session: Session = Depends(get_session)):
+def get_account(uid: str, fields: Optional[str] = None, session: Session = Depends(get_session)):
+    names = parse_fields(Account, fields)
     if USE_SAMPLE_DATA:
         accounts = get_sample_accounts()
         account = next((a for a in accounts if a.uid == uid), None)
         if not account:
             raise HTTPException(status_code=404, detail="Account not found")
-        return account
+        return fieldset_response(project(account, names)) if names else account
     
-    account = session.get(Account, uid)
+    # Served from the read cache, so the fieldset is projected from the cached row
+    account = cache.get_or_load("accounts", uid, lambda: session.get(Account, uid))
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
-    return account
+    return fieldset_response(project(account, names)) if names else account
 
 
 @app.post("/api/accounts", response_model=Account)
@@ -200,6 +536,7 @@ def create_account(account: Account, session: Session = Depends(get_session)):
         raise HTTPException(status_code=400, detail="Cannot create accounts in sample data mode")
     
     session.add(account)
+    invalidate(session, "accounts", account.uid)
     session.commit()
     session.refresh(account)
     return account
@@ -219,6 +556,7 @@ def update_account(uid: str, account: AccountUpdate, session: Session = Depends(
         setattr(db_account, key, value)
     
     session.add(db_account)
+    invalidate(session, "accounts", uid)
     session.commit()
     session.refresh(db_account)
     return db_account
@@ -239,6 +577,7 @@ def delete_account(uid: str, session: Session = Depends(get_session)):
     
     for update in session.exec(select(Update).where(Update.account_uid == uid)):
         session.delete(update)
+    session.execute(delete(UpdateArchive).where(UpdateArchive.account_uid == uid))
     
     for platform in session.exec(select(Platform).where(Platform.account_uid == uid)):
         session.delete(platform)
@@ -247,16 +586,25 @@ def delete_account(uid: str, session: Session = Depends(get_session)):
         session.delete(partner)
     
     session.delete(account)
+    invalidate(session, "accounts", uid)
+    invalidate(session, "use_cases")
+    invalidate(session, "updates")
+    invalidate(session, "platforms_crm")
+    invalidate(session, "primary_it_partners")
     session.commit()
     return {"ok": True}
 
 
 @app.get("/api/accounts/{uid}/use-cases", response_model=List[UseCase])
-def get_account_use_cases(uid: str, session: Session = Depends(get_session)):
+def get_account_use_cases(uid: str, fields: Optional[str] = None, session: Session = Depends(get_session)):
+    names = parse_fields(UseCase, fields)
     if USE_SAMPLE_DATA:
-        use_cases = get_sample_use_cases()
-        return [uc for uc in use_cases if uc.account_uid == uid]
+        use_cases = [uc for uc in get_sample_use_cases() if uc.account_uid == uid]
+        return fieldset_response([project(uc, names) for uc in use_cases]) if names else use_cases
     
+    if names:
+        query = select_fields(UseCase, names).where(UseCase.account_uid == uid)
+        return fieldset_response(rows_to_dicts(session.execute(query), names))
     use_cases = session.exec(select(UseCase).where(UseCase.account_uid == uid)).all()
     return use_cases
 
@@ -267,6 +615,8 @@ def create_use_case(use_case: UseCase, session: Session = Depends(get_session)):
         raise HTTPException(status_code=400, detail="Cannot create use cases in sample data mode")
     
     session.add(use_case)
+    session.flush()
+    invalidate(session, "use_cases", use_case.id)
     session.commit()
     session.refresh(use_case)
     return use_case
@@ -286,6 +636,7 @@ def update_use_case(id: int, use_case: UseCaseUpdate, session: Session = Depends
         setattr(db_use_case, key, value)
     
     session.add(db_use_case)
+    invalidate(session, "use_cases", id)
     session.commit()
     session.refresh(db_use_case)
     return db_use_case
@@ -301,18 +652,22 @@ def delete_use_case(id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Use case not found")
     
     session.delete(use_case)
+    invalidate(session, "use_cases", id)
     session.commit()
     return {"ok": True}
 
 
 @app.get("/api/accounts/{uid}/updates", response_model=List[Update])
-def get_account_updates(uid: str, session: Session = Depends(get_session)):
+def get_account_updates(uid: str, include_archived: bool = False, fields: Optional[str] = None,
+                        session: Session = Depends(get_session)):
+    names = parse_fields(Update, fields)
     if USE_SAMPLE_DATA:
-        updates = get_sample_updates()
-        return [u for u in updates if u.account_uid == uid]
+        updates = [u for u in get_sample_updates() if u.account_uid == uid]
+        return fieldset_response([project(u, names) for u in updates]) if names else updates
     
-    updates = session.exec(select(Update).where(Update.account_uid == uid)).all()
-    return updates
+    # Recent window only, unless the archive is asked for (see archive.py)
+    updates = account_updates(session, uid, include_archived, names)
+    return fieldset_response(updates) if names else updates
 
 
 @app.post("/api/updates", response_model=Update)
@@ -321,11 +676,35 @@ def create_update(update: Update, session: Session = Depends(get_session)):
         raise HTTPException(status_code=400, detail="Cannot create updates in sample data mode")
     
     session.add(update)
+    session.flush()
+    invalidate(session, "updates", update.id)
     session.commit()
     session.refresh(update)
     return update
 
 
+@app.post("/api/updates/ingest")
+async def ingest_updates(events: Union[UpdateEvent, List[UpdateEvent]], wait: bool = True):
+    """Queue one event or a batch for the group-commit writer; acknowledges once committed unless wait=false."""
+    if USE_SAMPLE_DATA:
+        raise HTTPException(status_code=400, detail="Cannot create updates in sample data mode")
+    rows = [event.model_dump() for event in (events if isinstance(events, list) else [events])]
+    if not rows:
+        raise HTTPException(status_code=400, detail="No events")
+    if len(rows) > ingest_writer.queue_size:
+        raise HTTPException(status_code=413, detail=f"At most {ingest_writer.queue_size} events per request")
+    try:
+        if not wait:
+            await ingest_writer.enqueue(rows)
+            return JSONResponse(status_code=202, content={"queued": len(rows)})
+        await ingest_writer.write(rows)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(ADMISSION_RETRY_AFTER)})
+    except UnknownAccountError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"written": len(rows)}
+
+
 @app.put("/api/updates/{id}", response_model=Update)
 def update_update(id: int, update: UpdateUpdate, session: Session = Depends(get_session)):
     if USE_SAMPLE_DATA:
@@ -340,6 +719,7 @@ def update_update(id: int, update: UpdateUpdate, session: Session = Depends(get_
         setattr(db_update, key, value)
     
     session.add(db_update)
+    invalidate(session, "updates", id)
     session.commit()
     session.refresh(db_update)
     return db_update
@@ -355,6 +735,7 @@ def delete_update(id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Update not found")
     
     session.delete(update)
+    invalidate(session, "updates", id)
     session.commit()
     return {"ok": True}
 
@@ -375,6 +756,8 @@ def create_platform(platform: Platform, session: Session = Depends(get_session))
         raise HTTPException(status_code=400, detail="Cannot create platforms in sample data mode")
     
     session.add(platform)
+    session.flush()
+    invalidate(session, "platforms_crm", platform.id)
     session.commit()
     session.refresh(platform)
     return platform
@@ -394,6 +777,7 @@ def update_platform(id: int, platform: PlatformUpdate, session: Session = Depend
         setattr(db_platform, key, value)
     
     session.add(db_platform)
+    invalidate(session, "platforms_crm", id)
     session.commit()
     session.refresh(db_platform)
     return db_platform
@@ -409,6 +793,7 @@ def delete_platform(id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Platform not found")
     
     session.delete(platform)
+    invalidate(session, "platforms_crm", id)
     session.commit()
     return {"ok": True}
 
@@ -434,6 +819,8 @@ def create_primary_it_partner(partner: PrimaryITPartner, session: Session = Depe
         raise HTTPException(status_code=400, detail="Cannot create primary IT partners in sample data mode")
     
     session.add(partner)
+    session.flush()
+    invalidate(session, "primary_it_partners", partner.id)
     session.commit()
     session.refresh(partner)
     return partner
@@ -453,6 +840,7 @@ def update_primary_it_partner(id: int, partner: PrimaryITPartnerUpdate, session:
         setattr(db_partner, key, value)
     
     session.add(db_partner)
+    invalidate(session, "primary_it_partners", id)
     session.commit()
     session.refresh(db_partner)
     return db_partner
@@ -468,24 +856,90 @@ def delete_primary_it_partner(id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Primary IT Partner not found")
     
     session.delete(partner)
+    invalidate(session, "primary_it_partners", id)
     session.commit()
     return {"ok": True}
 
 
 @app.get("/api/intake-requests", response_model=List[IntakeRequest])
-def get_intake_requests(session: Session = Depends(get_session)):
-    requests = session.exec(select(IntakeRequest).order_by(IntakeRequest.created_at.desc())).all()
-    return requests
+def get_intake_requests(fields: Optional[str] = None, accept: Optional[str] = Header(default=None),
+                        session: Session = Depends(get_session)):
+    names = parse_fields(IntakeRequest, fields)
+    media_type = negotiate(accept)
+    if media_type != JSON:
+        columns = names or column_names(IntakeRequest)
+        query = select_fields(IntakeRequest, columns).order_by(IntakeRequest.created_at.desc())
+        return binary_list(media_type, IntakeRequest, columns, query_chunks(session, query, scalars=False), [], session)
+    if names:
+        query = select_fields(IntakeRequest, names).order_by(IntakeRequest.created_at.desc())
+        return stream_list(query_chunks(session, query, scalars=False), fieldset_encoder(names))
+    query = select(IntakeRequest).order_by(IntakeRequest.created_at.desc())
+    return stream_list(query_chunks(session, query), model_encoder(IntakeRequest))
+
+
+@app.get("/api/intake-requests/events")
+async def stream_intake_events(last_event_id: Optional[int] = None,
+                               last_event_id_header: Optional[str] = Header(default=None, alias="Last-Event-ID")):
+    # EventSource sends Last-Event-ID on reconnect; ?last_event_id= allows resuming from a stored cursor
+    if last_event_id is None and last_event_id_header and last_event_id_header.isdigit():
+        last_event_id = int(last_event_id_header)
+    return StreamingResponse(
+        feed.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/intake-requests/board")
+def get_intake_board(limit: int = Query(default=BOARD_PAGE_SIZE, ge=1, le=BOARD_MAX_PAGE_SIZE),
+                     fields: Optional[str] = None, session: Session = Depends(get_session)):
+    """One column per request state (plus unassigned): its count and its newest `limit` requests."""
+    names = parse_fields(IntakeRequest, fields)
+    states = cache.get_or_load("request_states", "*", lambda: session.exec(select(RequestState)).all())
+    states = sorted(states, key=lambda state: state.id)
+    return fieldset_response(load_board(session, states, limit, names))
+
+
+@app.get("/api/intake-requests/board/column")
+def get_intake_board_column(state_id: Optional[int] = None, offset: int = Query(default=0, ge=0),
+                            limit: int = Query(default=BOARD_PAGE_SIZE, ge=1, le=BOARD_MAX_PAGE_SIZE),
+                            fields: Optional[str] = None, session: Session = Depends(get_session)):
+    """Further pages of one board column; omit state_id for the unassigned column."""
+    names = parse_fields(IntakeRequest, fields)
+    if state_id is not None and not cache.get_or_load("request_states", state_id, lambda: session.get(RequestState, state_id)):
+        raise HTTPException(status_code=404, detail="Request state not found")
+    requests = load_column(session, state_id, offset, limit, names)
+    return fieldset_response({"state_id": state_id, "offset": offset, "limit": limit, "requests": requests})
 
 
 @app.get("/api/intake-requests/{id}", response_model=IntakeRequest)
-def get_intake_request(id: int, session: Session = Depends(get_session)):
+def get_intake_request(id: int, fields: Optional[str] = None, session: Session = Depends(get_session)):
+    names = parse_fields(IntakeRequest, fields)
+    if names:
+        row = session.execute(select_fields(IntakeRequest, names).where(IntakeRequest.id == id)).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Intake request not found")
+        return fieldset_response(rows_to_dicts([row], names)[0])
     request = session.get(IntakeRequest, id)
     if not request:
         raise HTTPException(status_code=404, detail="Intake request not found")
     return request
 
 
+@app.get("/api/intake-requests/{id}/matches")
+def get_intake_request_matches(id: int, k: int = Query(default=10, ge=1, le=50), types: Optional[str] = None,
+                               session: Session = Depends(get_session)):
+    """Existing accounts, use cases and past requests most similar to this request, by TF-IDF cosine."""
+    type_list = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    unknown = [t for t in type_list or [] if t not in MATCH_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {', '.join(unknown)}")
+    request = session.get(IntakeRequest, id)
+    if not request:
+        raise HTTPException(status_code=404, detail="Intake request not found")
+    return {"request_id": id, "matches": find_matches(session, request, k, type_list)}
+
+
 @app.post("/api/intake-requests", response_model=IntakeRequest)
 def create_intake_request(request: IntakeRequestCreate, session: Session = Depends(get_session)):
     from datetime import datetime
@@ -495,23 +949,17 @@ def create_intake_request(request: IntakeRequestCreate, session: Session = Depen
     db_request.updated_at = datetime.utcnow()
     
     session.add(db_request)
-    session.commit()
-    session.refresh(db_request)
+    session.flush()
+    invalidate(session, "intake_requests", db_request.id)
+    record_event(session, REQUEST_CREATED, db_request.id, payload=db_request.model_dump())
     
-    # TODO: Implement email notification using Azure Communication Services
-    # Set ADMIN_EMAIL and AZURE_COMMUNICATION_CONNECTION_STRING environment variables
+    # Admin notification is queued in the same transaction and sent by the outbox worker
     admin_email = os.getenv("ADMIN_EMAIL")
-    azure_comm_connection = os.getenv("AZURE_COMMUNICATION_CONNECTION_STRING")
-    
-    if admin_email and azure_comm_connection:
-        try:
-            # Email notification will be sent here using Azure Communication Services
-            # Example subject: f"New Intake Request: {db_request.title}"
-            # Example body: Request details with link to triage view
-            pass
-        except Exception as e:
-            print(f"Failed to send email notification: {e}")
+    if admin_email:
+        enqueue_email(session, "intake_notification", admin_email, **intake_notification(db_request))
     
+    session.commit()
+    session.refresh(db_request)
     return db_request
 
 
@@ -530,6 +978,8 @@ def update_intake_request(id: int, request: IntakeRequestUpdate, session: Sessio
     db_request.updated_at = datetime.utcnow()
     
     session.add(db_request)
+    invalidate(session, "intake_requests", id)
+    record_event(session, REQUEST_UPDATED, id, payload=db_request.model_dump())
     session.commit()
     session.refresh(db_request)
     return db_request
@@ -545,20 +995,23 @@ def delete_intake_request(id: int, session: Session = Depends(get_session)):
     for assignment in session.exec(select(RequestStateAssignment).where(RequestStateAssignment.request_id == id)):
         session.delete(assignment)
     
+    record_event(session, REQUEST_DELETED, id, payload=db_request.model_dump())
     session.delete(db_request)
+    invalidate(session, "intake_requests", id)
+    invalidate(session, "request_state_assignments")
     session.commit()
     return {"ok": True}
 
 
 @app.get("/api/request-states", response_model=List[RequestState])
 def get_request_states(session: Session = Depends(get_session)):
-    states = session.exec(select(RequestState)).all()
+    states = cache.get_or_load("request_states", "*", lambda: session.exec(select(RequestState)).all())
     return states
 
 
 @app.get("/api/request-states/{id}", response_model=RequestState)
 def get_request_state(id: int, session: Session = Depends(get_session)):
-    state = session.get(RequestState, id)
+    state = cache.get_or_load("request_states", id, lambda: session.get(RequestState, id))
     if not state:
         raise HTTPException(status_code=404, detail="Request state not found")
     return state
@@ -572,6 +1025,8 @@ def create_request_state(state: RequestStateCreate, session: Session = Depends(g
     db_state.created_at = datetime.utcnow()
     
     session.add(db_state)
+    session.flush()
+    invalidate(session, "request_states", db_state.id)
     session.commit()
     session.refresh(db_state)
     return db_state
@@ -588,6 +1043,7 @@ def update_request_state(id: int, state: RequestStateUpdate, session: Session =
         setattr(db_state, key, value)
     
     session.add(db_state)
+    invalidate(session, "request_states", id)
     session.commit()
     session.refresh(db_state)
     return db_state
@@ -599,14 +1055,65 @@ def delete_request_state(id: int, session: Session = Depends(get_session)):
     if not db_state:
         raise HTTPException(status_code=404, detail="Request state not found")
     
+    request_ids = []
     for assignment in session.exec(select(RequestStateAssignment).where(RequestStateAssignment.state_id == id)):
+        record_event(session, STATE_REMOVED, assignment.request_id, state_id=id)
         session.delete(assignment)
+        request_ids.append(assignment.request_id)
     
+    # Move the affected cards to their previous state before the state itself goes
+    session.flush()
+    refresh_current_states(session, request_ids)
     session.delete(db_state)
+    invalidate(session, "request_states", id)
+    invalidate(session, "request_state_assignments")
     session.commit()
     return {"ok": True}
 
 
+@app.post("/api/intake-requests/states/bulk")
+def bulk_change_request_states(change: BulkStateChange, session: Session = Depends(get_session)):
+    from datetime import datetime
+    
+    assigned = []
+    removed = []
+    
+    if change.assign_state_ids:
+        # Every (request, state) pair: an explicit cross join of the two id lists
+        pairs = select(IntakeRequest.id, RequestState.id, literal(datetime.utcnow())).join(RequestState, true()).where(
+            IntakeRequest.id.in_(change.request_ids),
+            RequestState.id.in_(change.assign_state_ids),
+        )
+        assigned = session.execute(
+            insert_ignoring_conflicts(session, RequestStateAssignment)
+            .from_select(["request_id", "state_id", "assigned_at"], pairs)
+            .returning(RequestStateAssignment.id, RequestStateAssignment.request_id, RequestStateAssignment.state_id)
+        ).all()
+    
+    if change.remove_state_ids:
+        removed = session.execute(
+            delete(RequestStateAssignment)
+            .where(
+                RequestStateAssignment.request_id.in_(change.request_ids),
+                RequestStateAssignment.state_id.in_(change.remove_state_ids),
+            )
+            .returning(RequestStateAssignment.id, RequestStateAssignment.request_id, RequestStateAssignment.state_id)
+        ).all()
+    
+    for _, request_id, state_id in assigned:
+        invalidate(session, "request_state_assignments", request_id)
+        record_event(session, STATE_ASSIGNED, request_id, state_id=state_id)
+    for _, request_id, state_id in removed:
+        invalidate(session, "request_state_assignments", request_id)
+        record_event(session, STATE_REMOVED, request_id, state_id=state_id)
+    record_changes(session, "request_state_assignments", [row[0] for row in assigned], OP_UPSERT)
+    record_changes(session, "request_state_assignments", [row[0] for row in removed], OP_DELETE)
+    refresh_current_states(session, [row[1] for row in assigned + removed])
+    
+    session.commit()
+    return {"ok": True, "assigned": len(assigned), "removed": len(removed)}
+
+
 @app.get("/api/intake-requests/{request_id}/states", response_model=List[RequestState])
 def get_request_states_for_intake(request_id: int, session: Session = Depends(get_session)):
     assignments = session.exec(
@@ -627,52 +1134,106 @@ def get_request_states_for_intake(request_id: int, session: Session = Depends(ge
 def assign_state_to_request(request_id: int, state_id: int, session: Session = Depends(get_session)):
     from datetime import datetime
     
-    db_request = session.get(IntakeRequest, request_id)
-    if not db_request:
-        raise HTTPException(status_code=404, detail="Intake request not found")
-    
-    db_state = session.get(RequestState, state_id)
-    if not db_state:
-        raise HTTPException(status_code=404, detail="Request state not found")
-    
-    existing = session.exec(
-        select(RequestStateAssignment).where(
-            RequestStateAssignment.request_id == request_id,
-            RequestStateAssignment.state_id == state_id
-        )
-    ).first()
-    
-    if existing:
-        return {"ok": True, "message": "State already assigned"}
-    
-    assignment = RequestStateAssignment(
-        request_id=request_id,
-        state_id=state_id,
-        assigned_at=datetime.utcnow()
+    # Single INSERT ... SELECT ... ON CONFLICT DO NOTHING: the unique constraint on
+    # (request_id, state_id) makes concurrent clicks safe without a read-then-insert race
+    both_exist = select(literal(request_id), literal(state_id), literal(datetime.utcnow())).where(
+        select(IntakeRequest.id).where(IntakeRequest.id == request_id).exists(),
+        select(RequestState.id).where(RequestState.id == state_id).exists(),
     )
+    inserted = session.execute(
+        insert_ignoring_conflicts(session, RequestStateAssignment)
+        .from_select(["request_id", "state_id", "assigned_at"], both_exist)
+        .returning(RequestStateAssignment.id)
+    ).scalars().all()
+    
+    if not inserted:
+        # Nothing inserted: work out why only on this slow path
+        if not session.get(IntakeRequest, request_id):
+            raise HTTPException(status_code=404, detail="Intake request not found")
+        if not session.get(RequestState, state_id):
+            raise HTTPException(status_code=404, detail="Request state not found")
+        return {"ok": True, "message": "State already assigned"}
     
-    session.add(assignment)
+    invalidate(session, "request_state_assignments", request_id)
+    record_event(session, STATE_ASSIGNED, request_id, state_id=state_id)
+    record_changes(session, "request_state_assignments", inserted, OP_UPSERT)
+    refresh_current_states(session, [request_id])
     session.commit()
     return {"ok": True}
 
 
 @app.delete("/api/intake-requests/{request_id}/states/{state_id}")
 def remove_state_from_request(request_id: int, state_id: int, session: Session = Depends(get_session)):
-    assignment = session.exec(
-        select(RequestStateAssignment).where(
+    deleted = session.execute(
+        delete(RequestStateAssignment).where(
             RequestStateAssignment.request_id == request_id,
             RequestStateAssignment.state_id == state_id
-        )
-    ).first()
+        ).returning(RequestStateAssignment.id)
+    ).scalars().all()
     
-    if not assignment:
+    if not deleted:
         raise HTTPException(status_code=404, detail="State assignment not found")
     
-    session.delete(assignment)
+    record_changes(session, "request_state_assignments", deleted, OP_DELETE)
+    invalidate(session, "request_state_assignments", request_id)
+    record_event(session, STATE_REMOVED, request_id, state_id=state_id)
+    refresh_current_states(session, [request_id])
     session.commit()
     return {"ok": True}
 
 
+def report_job_response(job: ReportJob) -> dict:
+    download_url = f"/api/reports/{job.id}/download" if job.status == STATUS_DONE else None
+    return {**job.model_dump(), "download_url": download_url}
+
+
+@app.post("/api/reports", status_code=202)
+def create_report(request: ReportCreate, session: Session = Depends(get_session)):
+    if request.format not in REPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {request.format} (expected one of {', '.join(REPORT_FORMATS)})")
+    from datetime import datetime
+    
+    purge_expired_reports(session)
+    job = ReportJob(format=request.format, owner=report_runner.owner, heartbeat_at=datetime.utcnow())
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    report_runner.submit(job.id)
+    return report_job_response(job)
+
+
+@app.get("/api/reports")
+def get_reports(limit: int = Query(default=20, ge=1, le=100), session: Session = Depends(get_session)):
+    jobs = session.exec(select(ReportJob).order_by(ReportJob.id.desc()).limit(limit)).all()
+    return [report_job_response(job) for job in jobs]
+
+
+@app.get("/api/reports/{id}")
+def get_report(id: int, session: Session = Depends(get_session)):
+    job = session.get(ReportJob, id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return report_job_response(job)
+
+
+@app.get("/api/reports/{id}/download")
+def download_report(id: int, session: Session = Depends(get_session)):
+    job = session.get(ReportJob, id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if job.status != STATUS_DONE:
+        raise HTTPException(status_code=409, detail=f"Report is {job.status}")
+    if job.file_size is None:
+        raise HTTPException(status_code=410, detail="Report file has expired")
+    # Served from the database, so any instance can answer, whichever one built the file
+    return StreamingResponse(
+        read_report_file(session, id),
+        media_type=MEDIA_TYPES[job.format],
+        headers={"Content-Disposition": f'attachment; filename="{report_filename(job)}"',
+                 "Content-Length": str(job.file_size)},
+    )
+
+
 @app.get("/api/functional-areas")
 def get_functional_areas():
     return [
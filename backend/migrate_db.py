@@ -41,11 +41,18 @@ def migrate_database():
             # Drop all tables in reverse dependency order
             print("\n🗑️  Dropping existing tables...")
             tables_to_drop = [
+                "report_file_chunks",
+                "report_jobs",
+                "search_documents",
+                "change_log",
+                "outbox_messages",
+                "intake_events",
                 "request_state_assignments",
                 "intake_requests", 
                 "request_states",
                 "primary_it_partners",
                 "platforms_crm",
+                "updates_archive",
                 "updates",
                 "use_cases",
                 "accounts"
@@ -82,7 +89,9 @@ def migrate_database():
                     notes TEXT,
                     csm VARCHAR,
                     health VARCHAR,
-                    health_reason VARCHAR
+                    health_reason VARCHAR,
+                    health_score DOUBLE PRECISION,
+                    health_scored_at TIMESTAMP
                 )
             """))
             conn.commit()
@@ -118,9 +127,27 @@ def migrate_database():
                     date DATE
                 )
             """))
+            conn.execute(text("CREATE INDEX ix_updates_account_uid_date ON updates (account_uid, date)"))
             conn.commit()
             print("✅ updates table created")
             
+            # Create updates_archive table (updates older than UPDATES_HOT_DAYS, see archive.py)
+            print("\n📋 Creating updates_archive table...")
+            conn.execute(text("""
+                CREATE TABLE updates_archive (
+                    id INTEGER PRIMARY KEY,
+                    account_uid VARCHAR NOT NULL REFERENCES accounts(uid) ON DELETE CASCADE,
+                    description TEXT,
+                    author VARCHAR,
+                    platform VARCHAR,
+                    date DATE,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_updates_archive_account_uid_date ON updates_archive (account_uid, date)"))
+            conn.commit()
+            print("✅ updates_archive table created")
+            
             # Create platforms_crm table with ALL columns from models.py
             print("\n📋 Creating platforms_crm table...")
             conn.execute(text("""
@@ -175,9 +202,14 @@ def migrate_database():
                     platform VARCHAR,
                     additional_details TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    current_state_id INTEGER REFERENCES request_states(id) ON DELETE SET NULL,
+                    state_entered_at TIMESTAMP
                 )
             """))
+            conn.execute(text(
+                "CREATE INDEX ix_intake_requests_current_state_updated ON intake_requests (current_state_id, updated_at)"
+            ))
             conn.commit()
             print("✅ intake_requests table created")
             
@@ -188,12 +220,124 @@ def migrate_database():
                     id SERIAL PRIMARY KEY,
                     request_id INTEGER NOT NULL REFERENCES intake_requests(id) ON DELETE CASCADE,
                     state_id INTEGER NOT NULL REFERENCES request_states(id) ON DELETE CASCADE,
-                    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    CONSTRAINT uq_request_state_assignments_request_state UNIQUE (request_id, state_id)
                 )
             """))
             conn.commit()
             print("✅ request_state_assignments table created")
             
+            # Create intake_events table (change feed for the triage board)
+            print("\n📋 Creating intake_events table...")
+            conn.execute(text("""
+                CREATE TABLE intake_events (
+                    id SERIAL PRIMARY KEY,
+                    event_type VARCHAR NOT NULL,
+                    request_id INTEGER NOT NULL,
+                    state_id INTEGER,
+                    payload TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_intake_events_request_id ON intake_events (request_id)"))
+            conn.commit()
+            print("✅ intake_events table created")
+            
+            # Create outbox_messages table (queued notification emails)
+            print("\n📋 Creating outbox_messages table...")
+            conn.execute(text("""
+                CREATE TABLE outbox_messages (
+                    id SERIAL PRIMARY KEY,
+                    kind VARCHAR NOT NULL,
+                    recipient VARCHAR NOT NULL,
+                    subject VARCHAR NOT NULL,
+                    body TEXT,
+                    status VARCHAR NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    lease_expires_at TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_outbox_messages_status ON outbox_messages (status)"))
+            conn.execute(text("CREATE INDEX ix_outbox_messages_next_attempt_at ON outbox_messages (next_attempt_at)"))
+            conn.commit()
+            print("✅ outbox_messages table created")
+            
+            # Create change_log table (delta sync cursor and delete tombstones)
+            print("\n📋 Creating change_log table...")
+            conn.execute(text("""
+                CREATE TABLE change_log (
+                    seq BIGSERIAL PRIMARY KEY,
+                    table_name VARCHAR NOT NULL,
+                    row_key VARCHAR NOT NULL,
+                    op VARCHAR NOT NULL,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_change_log_table_row ON change_log (table_name, row_key)"))
+            conn.commit()
+            print("✅ change_log table created")
+            
+            # Create search_documents table (full-text search index, kept current by search.py)
+            print("\n📋 Creating search_documents table...")
+            conn.execute(text("""
+                CREATE TABLE search_documents (
+                    id BIGSERIAL PRIMARY KEY,
+                    entity_type VARCHAR NOT NULL,
+                    entity_id VARCHAR NOT NULL,
+                    account_uid VARCHAR,
+                    title TEXT,
+                    body TEXT,
+                    tsv tsvector GENERATED ALWAYS AS (
+                        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                        setweight(to_tsvector('english', coalesce(body, '')), 'B')
+                    ) STORED
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_search_documents_tsv ON search_documents USING GIN (tsv)"))
+            conn.execute(text("CREATE UNIQUE INDEX ix_search_documents_entity ON search_documents (entity_type, entity_id)"))
+            conn.execute(text("CREATE INDEX ix_search_documents_account_uid ON search_documents (account_uid)"))
+            conn.commit()
+            print("✅ search_documents table created")
+            
+            # Create report_jobs table (queued portfolio report builds)
+            print("\n📋 Creating report_jobs table...")
+            conn.execute(text("""
+                CREATE TABLE report_jobs (
+                    id SERIAL PRIMARY KEY,
+                    format VARCHAR NOT NULL,
+                    status VARCHAR NOT NULL DEFAULT 'queued',
+                    row_count INTEGER,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP,
+                    owner VARCHAR,
+                    heartbeat_at TIMESTAMP,
+                    file_size BIGINT
+                )
+            """))
+            conn.execute(text("CREATE INDEX ix_report_jobs_status ON report_jobs (status)"))
+            conn.commit()
+            print("✅ report_jobs table created")
+            
+            # Create report_file_chunks table (finished report files, readable from every instance)
+            print("\n📋 Creating report_file_chunks table...")
+            conn.execute(text("""
+                CREATE TABLE report_file_chunks (
+                    id SERIAL PRIMARY KEY,
+                    job_id INTEGER NOT NULL REFERENCES report_jobs(id) ON DELETE CASCADE,
+                    seq INTEGER NOT NULL,
+                    data BYTEA NOT NULL,
+                    CONSTRAINT uq_report_file_chunks_job_seq UNIQUE (job_id, seq)
+                )
+            """))
+            conn.commit()
+            print("✅ report_file_chunks table created")
+            
             # Insert default request states
             print("\n📝 Inserting default request states...")
             conn.execute(text("""
@@ -216,11 +360,18 @@ def migrate_database():
             print("  ✓ accounts")
             print("  ✓ use_cases")
             print("  ✓ updates")
+            print("  ✓ updates_archive")
             print("  ✓ platforms_crm")
             print("  ✓ primary_it_partners")
             print("  ✓ request_states (with 7 default states)")
             print("  ✓ intake_requests")
             print("  ✓ request_state_assignments")
+            print("  ✓ intake_events")
+            print("  ✓ outbox_messages")
+            print("  ✓ change_log")
+            print("  ✓ search_documents")
+            print("  ✓ report_jobs")
+            print("  ✓ report_file_chunks")
             print("\n📊 Next step: Run 'python seed_azure_db.py' to add sample data")
             print("=" * 60)
             
@@ -1,4 +1,5 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index, UniqueConstraint
 from typing import Optional
 from datetime import date as date_type, datetime
 
@@ -30,6 +31,8 @@ class Account(SQLModel, table=True):
     csm: Optional[str] = None
     health: Optional[str] = None
     health_reason: Optional[str] = None
+    health_score: Optional[float] = None  # set by health.py
+    health_scored_at: Optional[datetime] = None
 
 
 class UseCase(SQLModel, table=True):
@@ -48,6 +51,7 @@ class UseCase(SQLModel, table=True):
 
 class Update(SQLModel, table=True):
     __tablename__ = "updates"
+    __table_args__ = (Index("ix_updates_account_uid_date", "account_uid", "date"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     account_uid: str = Field(foreign_key="accounts.uid")
@@ -57,6 +61,20 @@ class Update(SQLModel, table=True):
     date: Optional[date_type] = None
 
 
+class UpdateArchive(SQLModel, table=True):
+    """Updates older than the hot window, moved out of `updates` by archive.py. Ids are kept."""
+    __tablename__ = "updates_archive"
+    __table_args__ = (Index("ix_updates_archive_account_uid_date", "account_uid", "date"),)
+    
+    id: int = Field(primary_key=True)
+    account_uid: str = Field(foreign_key="accounts.uid")
+    description: Optional[str] = None
+    author: Optional[str] = None
+    platform: Optional[str] = None
+    date: Optional[date_type] = None
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class Platform(SQLModel, table=True):
     __tablename__ = "platforms_crm"
     
@@ -76,6 +94,8 @@ class PrimaryITPartner(SQLModel, table=True):
 
 class IntakeRequest(SQLModel, table=True):
     __tablename__ = "intake_requests"
+    # Serves the triage board: one index range per column, newest first
+    __table_args__ = (Index("ix_intake_requests_current_state_updated", "current_state_id", "updated_at"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
@@ -89,6 +109,9 @@ class IntakeRequest(SQLModel, table=True):
     additional_details: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Denormalized from request_state_assignments (the most recently assigned state) by board.py
+    current_state_id: Optional[int] = Field(default=None, foreign_key="request_states.id")
+    state_entered_at: Optional[datetime] = None
 
 
 class RequestState(SQLModel, table=True):
@@ -103,8 +126,75 @@ class RequestState(SQLModel, table=True):
 
 class RequestStateAssignment(SQLModel, table=True):
     __tablename__ = "request_state_assignments"
+    __table_args__ = (UniqueConstraint("request_id", "state_id", name="uq_request_state_assignments_request_state"),)
     
     id: Optional[int] = Field(default=None, primary_key=True)
     request_id: int = Field(foreign_key="intake_requests.id")
     state_id: int = Field(foreign_key="request_states.id")
     assigned_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class IntakeEvent(SQLModel, table=True):
+    __tablename__ = "intake_events"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_type: str
+    request_id: int = Field(index=True)
+    state_id: Optional[int] = None
+    payload: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class OutboxMessage(SQLModel, table=True):
+    __tablename__ = "outbox_messages"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    recipient: str
+    subject: str
+    body: Optional[str] = None
+    status: str = Field(default="pending", index=True)
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    lease_expires_at: Optional[datetime] = None  # While status is "sending"; claimed again once it passes
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+
+class ChangeLogEntry(SQLModel, table=True):
+    __tablename__ = "change_log"
+    
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str
+    row_key: str
+    op: str
+    changed_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ReportJob(SQLModel, table=True):
+    __tablename__ = "report_jobs"
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    format: str
+    status: str = Field(default="queued", index=True)
+    row_count: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # "host:pid:boot id" of the API process whose pool runs the job, refreshed every heartbeat
+    owner: Optional[str] = None
+    heartbeat_at: Optional[datetime] = None
+    file_size: Optional[int] = None
+
+
+class ReportFileChunk(SQLModel, table=True):
+    """A finished report file, stored in the database so every instance can serve the download."""
+    __tablename__ = "report_file_chunks"
+    __table_args__ = (UniqueConstraint("job_id", "seq", name="uq_report_file_chunks_job_seq"),)
+    
+    id: Optional[int] = Field(default=None, primary_key=True)
+    job_id: int = Field(foreign_key="report_jobs.id")
+    seq: int
+    data: bytes
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Transactional outbox for notification emails.
+
+`enqueue_email(session, ...)` adds an OutboxMessage row in the caller's
+transaction, so an intake request and its notification commit (or roll back)
+together and the request path never waits on the email API. OutboxWorker
+drains pending rows in batches, retries failures with exponential backoff,
+and coalesces bursts for the same recipient into a single digest email.
+
+A batch is claimed in a short transaction (status `sending` plus a lease that
+expires after OUTBOX_LEASE_SECONDS) and committed before anything is sent, so
+no row locks are held across the email API. Each delivery's outcome is then
+recorded in its own transaction. Rows whose lease expires while still
+`sending` (the worker died mid-batch) are claimed again, so delivery is at
+least once. On Postgres several workers drain in parallel with SKIP LOCKED;
+SQLite has no row locks, so there only the process holding an exclusive lock
+on OUTBOX_LOCK_FILE (default: next to the database file) drains.
+
+The worker runs inside the API process when OUTBOX_WORKER_IN_APP=true, or
+standalone:
+
+    python outbox.py
+
+Senders (OUTBOX_SENDER):
+    file  - writes .eml files to OUTBOX_FILE_DIR (for offline testing)
+    smtp  - plain SMTP to OUTBOX_SMTP_HOST:OUTBOX_SMTP_PORT, e.g. a local sink
+            started with `python -m aiosmtpd -n -l localhost:1025`
+    azure - Azure Communication Services (needs azure-communication-email and
+            AZURE_COMMUNICATION_CONNECTION_STRING)
+
+Without OUTBOX_SENDER the sender follows the credentials: azure when
+AZURE_COMMUNICATION_CONNECTION_STRING is set, else smtp when OUTBOX_SMTP_HOST
+is set. `check_sender_config` fails startup when ADMIN_EMAIL is set but
+neither is, rather than queueing notifications that nothing will deliver.
+"""
+
+import asyncio
+import os
+import smtplib
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+import anyio
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+load_dotenv()
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from cache import ALL_KEYS, bus, invalidate
+from database import engine
+from models import OutboxMessage
+
+
+def default_sender() -> Optional[str]:
+    """The sender implied by the configured credentials, or None when no provider is configured."""
+    if os.getenv("AZURE_COMMUNICATION_CONNECTION_STRING"):
+        return "azure"
+    if os.getenv("OUTBOX_SMTP_HOST"):
+        return "smtp"
+    return None
+
+
+OUTBOX_SENDER = os.getenv("OUTBOX_SENDER", "").lower() or default_sender()
+OUTBOX_FILE_DIR = os.getenv("OUTBOX_FILE_DIR", "./outbox_mail")
+OUTBOX_SMTP_HOST = os.getenv("OUTBOX_SMTP_HOST", "localhost")
+OUTBOX_SMTP_PORT = int(os.getenv("OUTBOX_SMTP_PORT", "1025"))
+OUTBOX_FROM = os.getenv("OUTBOX_FROM", "crm-notifications@localhost")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "10"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_DIGEST_THRESHOLD = int(os.getenv("OUTBOX_DIGEST_THRESHOLD", "3"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_LOCK_FILE = os.getenv("OUTBOX_LOCK_FILE", "")
+OUTBOX_WORKER_IN_APP = os.getenv("OUTBOX_WORKER_IN_APP", "true").lower() == "true"
+TRIAGE_URL = os.getenv("TRIAGE_URL", "http://localhost:5000/admin/intake-triage")
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+
+def enqueue_email(session: Session, kind: str, recipient: str, subject: str, body: str) -> OutboxMessage:
+    """Queue an email in the caller's transaction. Nothing is sent until the transaction commits."""
+    message = OutboxMessage(kind=kind, recipient=recipient, subject=subject, body=body,
+                            created_at=datetime.utcnow(), next_attempt_at=datetime.utcnow())
+    session.add(message)
+    invalidate(session, "outbox_messages")
+    return message
+
+
+def intake_notification(request) -> Dict[str, str]:
+    """Subject and body for a new intake request notification."""
+    lines = [
+        f"A new intake request has been submitted: {request.title}",
+        "",
+        f"Submitted for: {request.submitted_for or '-'}",
+        f"DRI contact: {request.dri_contact or '-'}",
+        f"Functional area: {request.functional_area or '-'}",
+        f"Platform: {request.platform or '-'}",
+        f"Help needed: {request.help_types or '-'}",
+        "",
+        request.description or "",
+        "",
+        f"Triage: {TRIAGE_URL}",
+    ]
+    return {"subject": f"New Intake Request: {request.title}", "body": "\n".join(lines)}
+
+
+class FileSender:
+    """Writes each email as an .eml file. Stand-in for a real provider when working offline."""
+
+    def __init__(self, directory: str = OUTBOX_FILE_DIR):
+        self.directory = directory
+
+    def send(self, message: EmailMessage) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{message['To'].replace('@', '_at_')}.eml"
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(bytes(message))
+
+
+class SmtpSender:
+    def __init__(self, host: str = OUTBOX_SMTP_HOST, port: int = OUTBOX_SMTP_PORT):
+        self.host = host
+        self.port = port
+
+    def send(self, message: EmailMessage) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+class AzureCommunicationSender:
+    def __init__(self, connection_string: Optional[str] = None):
+        from azure.communication.email import EmailClient
+
+        connection_string = connection_string or os.getenv("AZURE_COMMUNICATION_CONNECTION_STRING")
+        if not connection_string:
+            raise ValueError("OUTBOX_SENDER=azure needs AZURE_COMMUNICATION_CONNECTION_STRING")
+        self.client = EmailClient.from_connection_string(connection_string)
+
+    def send(self, message: EmailMessage) -> None:
+        poller = self.client.begin_send({
+            "senderAddress": message["From"],
+            "recipients": {"to": [{"address": message["To"]}]},
+            "content": {"subject": message["Subject"], "plainText": message.get_content()},
+        })
+        poller.result()
+
+
+def create_sender(kind: Optional[str] = OUTBOX_SENDER):
+    if kind == "file":
+        return FileSender()
+    if kind == "smtp":
+        return SmtpSender()
+    if kind == "azure":
+        return AzureCommunicationSender()
+    if kind is None:
+        raise ValueError("No email sender configured: set AZURE_COMMUNICATION_CONNECTION_STRING, "
+                         "OUTBOX_SMTP_HOST or OUTBOX_SENDER")
+    raise ValueError(f"Unknown OUTBOX_SENDER: {kind!r} (expected file, smtp or azure)")
+
+
+def check_sender_config(kind: Optional[str] = OUTBOX_SENDER, admin_email: Optional[str] = None) -> None:
+    """Fail at startup if notifications would be queued but could never be sent."""
+    admin_email = admin_email if admin_email is not None else os.getenv("ADMIN_EMAIL")
+    if kind not in (None, "file", "smtp", "azure"):
+        raise ValueError(f"Unknown OUTBOX_SENDER: {kind!r} (expected file, smtp or azure)")
+    if kind == "azure" and not os.getenv("AZURE_COMMUNICATION_CONNECTION_STRING"):
+        raise ValueError("OUTBOX_SENDER=azure needs AZURE_COMMUNICATION_CONNECTION_STRING")
+    if admin_email and kind is None:
+        raise ValueError("ADMIN_EMAIL is set but no email sender is configured: set "
+                         "AZURE_COMMUNICATION_CONNECTION_STRING, OUTBOX_SMTP_HOST, or OUTBOX_SENDER=file "
+                         "to write .eml files")
+
+
+def build_email(recipient: str, subject: str, body: str) -> EmailMessage:
+    email = EmailMessage()
+    email["From"] = OUTBOX_FROM
+    email["To"] = recipient
+    email["Subject"] = subject
+    email.set_content(body)
+    return email
+
+
+def build_digest(recipient: str, messages: List[OutboxMessage]) -> EmailMessage:
+    parts = [f"{len(messages)} notifications were queued in the last few moments:", ""]
+    for message in messages:
+        parts += [f"- {message.subject}", ""]
+    parts += ["=" * 60, ""]
+    for message in messages:
+        parts += [message.subject, "-" * len(message.subject), message.body or "", ""]
+    return build_email(recipient, f"{len(messages)} new notifications", "\n".join(parts))
+
+
+def backoff_delay(attempts: int, base: float = OUTBOX_BACKOFF_SECONDS) -> timedelta:
+    return timedelta(seconds=min(base * (2 ** (attempts - 1)), 6 * 3600))
+
+
+def _try_lock_file(path: str):
+    """Open `path` and take an exclusive lock on it without waiting. Returns the open file, or None if it is held."""
+    handle = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+class OutboxWorker:
+    def __init__(self, sender=None, batch_size: int = OUTBOX_BATCH_SIZE,
+                 digest_threshold: int = OUTBOX_DIGEST_THRESHOLD, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS, bind=None, lock_file: str = OUTBOX_LOCK_FILE):
+        self.sender = sender or create_sender()
+        self.batch_size = batch_size
+        self.digest_threshold = digest_threshold
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.engine = bind or engine
+        self.lock_file = lock_file
+        self._lock = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_drainer(self) -> bool:
+        """Whether this process may drain. Always on Postgres; on a SQLite file, only the holder of the lock file.
+
+        Checked before every drain, so another process takes over if the drainer exits.
+        """
+        url = self.engine.url
+        if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+            return True
+        if self._lock is None:
+            self._lock = _try_lock_file(self.lock_file or f"{url.database}.outbox.lock")
+        return self._lock is not None
+
+    def claim(self) -> List[OutboxMessage]:
+        """Lease a batch of due messages to this worker and commit, so no locks are held while sending."""
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=self.lease_seconds)
+        with Session(self.engine, expire_on_commit=False) as session:
+            # SKIP LOCKED lets several workers claim in parallel on Postgres; it is a no-op on SQLite
+            batch = session.exec(
+                select(OutboxMessage)
+                .where(or_(
+                    and_(OutboxMessage.status == STATUS_PENDING, OutboxMessage.next_attempt_at <= now),
+                    and_(OutboxMessage.status == STATUS_SENDING, OutboxMessage.lease_expires_at <= now),
+                ))
+                .order_by(OutboxMessage.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            for message in batch:
+                message.status = STATUS_SENDING
+                message.lease_expires_at = lease
+            session.commit()
+            return batch
+
+    def drain_once(self) -> int:
+        """Claim and deliver one batch of due messages. Returns the number of rows processed."""
+        batch = self.claim()
+        if not batch:
+            return 0
+
+        by_recipient: Dict[str, List[OutboxMessage]] = {}
+        for message in batch:
+            by_recipient.setdefault(message.recipient, []).append(message)
+
+        for recipient, messages in by_recipient.items():
+            if len(messages) >= self.digest_threshold:
+                self._deliver(build_digest(recipient, messages), messages)
+            else:
+                for message in messages:
+                    self._deliver(build_email(recipient, message.subject, message.body or ""), [message])
+        return len(batch)
+
+    def _deliver(self, email: EmailMessage, messages: List[OutboxMessage]) -> None:
+        try:
+            self.sender.send(email)
+        except Exception as e:
+            print(f"Outbox delivery to {email['To']} failed: {e}")
+            self._record(messages, error=str(e)[:1000])
+            return
+        self._record(messages)
+
+    def _record(self, messages: List[OutboxMessage], error: Optional[str] = None) -> None:
+        """Store one delivery's outcome, skipping rows whose lease has since been claimed by another worker."""
+        now = datetime.utcnow()
+        with Session(self.engine) as session:
+            rows = session.exec(
+                select(OutboxMessage).where(
+                    OutboxMessage.id.in_([message.id for message in messages]),
+                    OutboxMessage.status == STATUS_SENDING,
+                    OutboxMessage.lease_expires_at == messages[0].lease_expires_at,
+                )
+            ).all()
+            for message in rows:
+                message.attempts += 1
+                message.lease_expires_at = None
+                if error is None:
+                    message.status = STATUS_SENT
+                    message.sent_at = now
+                    message.last_error = None
+                    continue
+                message.last_error = error
+                if message.attempts >= self.max_attempts:
+                    message.status = STATUS_FAILED
+                else:
+                    message.status = STATUS_PENDING
+                    message.next_attempt_at = now + backoff_delay(message.attempts)
+            session.commit()
+
+    def drain(self) -> int:
+        total = 0
+        while True:
+            processed = self.drain_once()
+            total += processed
+            if processed < self.batch_size:
+                return total
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        bus.subscribe(self._on_bus_message)
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        bus.unsubscribe(self._on_bus_message)
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _on_bus_message(self, table: str, key: str) -> None:
+        if table in ("outbox_messages", ALL_KEYS) and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if self.is_drainer():
+                    await anyio.to_thread.run_sync(self.drain)
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+            if self._wake is None:
+                await asyncio.sleep(OUTBOX_POLL_SECONDS)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_SECONDS)
+                # Let a burst of submissions accumulate so it can go out as one digest
+                await asyncio.sleep(1)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+if __name__ == "__main__":
+    check_sender_config()
+    print(f"Outbox worker started (sender={OUTBOX_SENDER}, batch={OUTBOX_BATCH_SIZE})")
+    worker = OutboxWorker()
+    while True:
+        try:
+            sent = worker.drain() if worker.is_drainer() else 0
+            if sent:
+                print(f"Processed {sent} outbox messages")
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+        time.sleep(OUTBOX_POLL_SECONDS)
@@ -0,0 +1,318 @@
+"""
+Opt-in sampling profiler for API requests.
+
+Two modes, both off unless configured (main.py only installs the middleware
+when one is enabled, so there is no overhead otherwise):
+
+On-demand - send `X-Profile: <PROFILING_TOKEN>` (or `?profile=<token>`) and
+that one request is sampled every PROFILING_INTERVAL_MS. A speedscope file
+(open at https://www.speedscope.app) is written to PROFILING_DIR, named in
+the X-Profile-File response header.
+
+Continuous - with PROFILING_CONTINUOUS_HZ > 0 all threads are sampled at
+that low rate and stacks are aggregated per route. Hot stacks are served by
+`GET /api/system/profile` (JSON, or `?format=folded` for flamegraph.pl and
+speedscope).
+
+Samples come from sys._current_frames(). A stack belongs to a request when
+it runs inside that request's middleware coroutine (event loop thread) or
+inside the contextvars Context the request was dispatched with (threadpool
+workers running sync endpoints, SQLAlchemy and serialization). A worker
+frame holding a `context` is only inside it while its direct callee is the
+`func` it was handed (anyio's `context.run(func, *args)`); between jobs it
+keeps both locals but calls something else. Stacks are trimmed to start at
+that point.
+
+Profiles are written from a worker thread, under a name with millisecond
+resolution and a random suffix, so concurrent profiles of one route don't
+overwrite each other.
+"""
+
+import contextvars
+import functools
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import anyio
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "./profiles")
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "1"))
+PROFILING_CONTINUOUS_HZ = float(os.getenv("PROFILING_CONTINUOUS_HZ", "0"))
+PROFILING_MAX_STACKS_PER_ROUTE = int(os.getenv("PROFILING_MAX_STACKS_PER_ROUTE", "500"))
+
+PROFILING_ENABLED = bool(PROFILING_TOKEN) or PROFILING_CONTINUOUS_HZ > 0
+
+# (filename, function, first line) from the request's entry point down to the leaf
+Stack = Tuple[Tuple[str, str, int], ...]
+
+
+class RequestMarker:
+    """Identifies one in-flight request to the samplers."""
+
+    def __init__(self, scope: dict, profile: Optional["RequestProfile"] = None):
+        self.scope = scope
+        self.profile = profile
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched endpoint in the (shared) scope once routing is done
+        endpoint = self.scope.get("endpoint")
+        name = getattr(endpoint, "__name__", None) or self.scope.get("path", "?")
+        return f"{self.scope.get('method', '')} {name}"
+
+
+_current_marker: contextvars.ContextVar[Optional[RequestMarker]] = contextvars.ContextVar(
+    "profiling_request", default=None
+)
+
+
+def _entry_code(func):
+    """Code object of the frame `func(...)` starts in: through partials, bound methods and callable instances."""
+    while isinstance(func, functools.partial):
+        func = func.func
+    func = getattr(func, "__func__", func)
+    code = getattr(func, "__code__", None)
+    if code is None:
+        call = getattr(type(func), "__call__", None)
+        code = getattr(getattr(call, "__func__", call), "__code__", None)
+    return code
+
+
+def _is_running_context(frame, callee) -> bool:
+    # A worker keeps `context` and `func` after the call returns; it is inside context.run(func) only
+    # while its direct callee is func's frame
+    return callee is not None and callee.f_code is _entry_code(frame.f_locals.get("func"))
+
+
+def request_stack(frame) -> Tuple[Optional[RequestMarker], Stack]:
+    """The request a thread's current stack belongs to, and the stack trimmed to that request."""
+    frames = []
+    marker = None
+    while frame is not None:
+        frames.append(frame)
+        code = frame.f_code
+        if code is _MIDDLEWARE_CODE:
+            marker = frame.f_locals.get("marker")
+            break
+        if ("context" in code.co_varnames and len(frames) > 1
+                and _is_running_context(frame, frames[-2])):
+            context = frame.f_locals.get("context")
+            if isinstance(context, contextvars.Context):
+                marker = context.get(_current_marker)
+                if marker is not None:
+                    break
+        frame = frame.f_back
+    if marker is None:
+        return None, ()
+    stack = tuple((f.f_code.co_filename, f.f_code.co_name, f.f_code.co_firstlineno) for f in reversed(frames))
+    return marker, stack
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval: float, on_sample):
+        super().__init__(daemon=True, name="profiling-sampler")
+        self.interval = interval
+        self.on_sample = on_sample
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                marker, stack = request_stack(frame)
+                if marker is not None:
+                    self.on_sample(marker, thread_id, stack)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+
+class RequestProfile:
+    def __init__(self, name: str, interval: float = PROFILING_INTERVAL_MS / 1000):
+        self.name = name
+        self.interval = interval
+        self.samples: List[Tuple[int, Stack]] = []
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self._sampler = Sampler(interval, self._on_sample)
+
+    def _on_sample(self, marker: RequestMarker, thread_id: int, stack: Stack) -> None:
+        if marker.profile is self:
+            self.samples.append((thread_id, stack))
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._sampler.stop()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+    def to_speedscope(self) -> dict:
+        frames: List[dict] = []
+        frame_index: Dict[Tuple[str, str, int], int] = {}
+        by_thread: Dict[int, List[List[int]]] = {}
+        for thread_id, stack in self.samples:
+            indices = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({"name": key[1], "file": key[0], "line": key[2]})
+                indices.append(frame_index[key])
+            by_thread.setdefault(thread_id, []).append(indices)
+        profiles = [
+            {
+                "type": "sampled",
+                "name": f"{self.name} (thread {thread_id})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": len(samples) * self.interval,
+                "samples": samples,
+                "weights": [self.interval] * len(samples),
+            }
+            for thread_id, samples in by_thread.items()
+        ]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.name} ({self.duration * 1000:.1f} ms)",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def finish(self, path: str) -> None:
+        """Stop sampling and write the speedscope file. Blocking; run it off the event loop."""
+        self.stop()
+        self.save(path)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_speedscope(), f)
+
+
+def _frame_label(key: Tuple[str, str, int]) -> str:
+    module = os.path.splitext(os.path.basename(key[0]))[0]
+    return f"{module}.{key[1]}"
+
+
+class ContinuousProfiler:
+    """Low-rate sampling of every request, aggregated into folded stacks per route."""
+
+    def __init__(self, hz: float = PROFILING_CONTINUOUS_HZ, max_stacks: int = PROFILING_MAX_STACKS_PER_ROUTE):
+        self.hz = hz
+        self.max_stacks = max_stacks
+        self.stacks: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[Sampler] = None
+
+    def ensure_started(self) -> None:
+        if self._sampler is None and self.hz > 0:
+            with self._lock:
+                if self._sampler is None:
+                    self._sampler = Sampler(1 / self.hz, self._on_sample)
+                    self._sampler.start()
+
+    def _on_sample(self, marker: RequestMarker, thread_id: int, stack: Stack) -> None:
+        folded = ";".join(_frame_label(key) for key in stack)
+        with self._lock:
+            counter = self.stacks.setdefault(marker.route, Counter())
+            if folded not in counter and len(counter) >= self.max_stacks:
+                folded = "(other)"
+            counter[folded] += 1
+
+    def report(self, top: int = 20) -> dict:
+        with self._lock:
+            return {
+                route: {
+                    "samples": sum(counter.values()),
+                    "top": [{"stack": stack, "count": count} for stack, count in counter.most_common(top)],
+                }
+                for route, counter in self.stacks.items()
+            }
+
+    def folded(self) -> str:
+        with self._lock:
+            return "\n".join(f"{route.replace(' ', '_')};{stack} {count}"
+                             for route, counter in self.stacks.items() for stack, count in counter.items())
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks.clear()
+
+
+continuous_profiler = ContinuousProfiler()
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return bool(PROFILING_TOKEN) and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def _requested_token(scope: dict) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile")
+    return values[0] if values else None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profile_dir: str = PROFILING_DIR, continuous: ContinuousProfiler = continuous_profiler):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.continuous = continuous
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        if is_authorized(_requested_token(scope)):
+            name = f"{scope['method']} {scope['path']}"
+            profile = RequestProfile(name)
+        elif self.continuous.hz <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        self.continuous.ensure_started()
+        # `marker` is read from this frame by the samplers; don't rename it
+        marker = RequestMarker(scope, profile)
+        token = _current_marker.set(marker)
+        if profile is None:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current_marker.reset(token)
+            return
+
+        slug = scope["path"].strip("/").replace("/", "_") or "root"
+        started = datetime.now().strftime("%Y%m%dT%H%M%S.%f")[:-3]
+        filename = f"{started}-{uuid.uuid4().hex[:8]}-{scope['method']}-{slug}.speedscope.json"
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-profile-file", filename.encode())]}
+            await send(message)
+
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            _current_marker.reset(token)
+            await anyio.to_thread.run_sync(profile.finish, os.path.join(self.profile_dir, filename))
+
+
+_MIDDLEWARE_CODE = ProfilingMiddleware.__call__.__code__
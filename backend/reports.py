@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Portfolio report jobs.
+
+A portfolio report has one row per account: its health, primary IT partner,
+use cases, platform onboarding and latest updates. Reports are built off the
+request path:
+
+    POST /api/reports {"format": "xlsx"}  -> 202 with a queued job
+    GET  /api/reports/{id}                -> queued / running / done / failed
+    GET  /api/reports/{id}/download       -> the file, once done
+
+Jobs are ReportJob rows, so any API worker can answer status polls. Each API
+process runs jobs in a ProcessPoolExecutor of REPORTS_MAX_WORKERS (spawned
+processes, since the API process is multithreaded), which keeps rendering off
+the event loop and the request threadpool and lets several reports use
+separate cores. A worker streams accounts in batches of REPORTS_BATCH_SIZE
+and loads each batch's related rows with one IN query per table, so memory
+stays flat however many accounts there are. The file is built in REPORTS_DIR
+(local scratch space) and then copied into `report_file_chunks`, so any
+instance can serve the download, not just the one that built it.
+
+Every job records its owner (host, pid and a per-process boot id) and the
+owning process refreshes `heartbeat_at` on its queued and running jobs every
+REPORTS_HEARTBEAT_SECONDS. Each process also fails other owners' jobs once
+they are orphaned: the owner is a previous incarnation of this process, a
+dead pid on this host, or hasn't heartbeated for REPORTS_STALE_SECONDS. Jobs
+of live workers on other instances or in other processes are left alone.
+
+Reports can also be built from the command line:
+
+    python reports.py csv portfolio.csv
+
+Formats: csv, xlsx (written directly as Office Open XML, no extra packages),
+html, and arrow (an Arrow IPC stream, offered when pyarrow is installed).
+Workers open their own database connections, so an in-memory SQLite
+DATABASE_URL can't be used with report jobs.
+"""
+
+import csv
+import html
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import uuid
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, insert, or_, update
+from sqlmodel import Session, select
+
+load_dotenv()
+
+from database import engine
+from formats import ARROW as ARROW_MEDIA_TYPE, arrow_batches, pa
+from models import Account, Platform, PrimaryITPartner, ReportFileChunk, ReportJob, UseCase, Update
+
+REPORTS_DIR = os.getenv("REPORTS_DIR", "./reports")
+REPORTS_MAX_WORKERS = int(os.getenv("REPORTS_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+REPORTS_BATCH_SIZE = int(os.getenv("REPORTS_BATCH_SIZE", "500"))
+REPORTS_LATEST_UPDATES = int(os.getenv("REPORTS_LATEST_UPDATES", "3"))
+REPORTS_RETENTION_HOURS = float(os.getenv("REPORTS_RETENTION_HOURS", "24"))
+REPORTS_HEARTBEAT_SECONDS = float(os.getenv("REPORTS_HEARTBEAT_SECONDS", "15"))
+REPORTS_STALE_SECONDS = float(os.getenv("REPORTS_STALE_SECONDS", "90"))
+
+# Finished files are stored in pieces of this size, and downloads stream them one at a time
+REPORT_CHUNK_BYTES = 1024 * 1024
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+CSV = "csv"
+XLSX = "xlsx"
+HTML = "html"
+MEDIA_TYPES = {
+    CSV: "text/csv",
+    XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    HTML: "text/html",
+}
+ARROW = "arrow"
+if pa is not None:
+    MEDIA_TYPES[ARROW] = ARROW_MEDIA_TYPE
+REPORT_FORMATS = list(MEDIA_TYPES)
+
+COLUMNS = [
+    "uid", "team", "business_it_area", "vp", "csm", "health", "health_reason", "primary_it_partner",
+    "use_case_count", "use_cases", "platforms", "latest_update_date", "latest_updates",
+]
+
+
+def report_rows(session: Session, batch_size: int = REPORTS_BATCH_SIZE) -> Iterator[list]:
+    """One row per account, in COLUMNS order. Accounts are streamed in batches."""
+    accounts = session.exec(select(Account).order_by(Account.uid).execution_options(yield_per=batch_size))
+    for batch in accounts.partitions(batch_size):
+        uids = [account.uid for account in batch]
+        use_cases = _by_account(session.exec(
+            select(UseCase).where(UseCase.account_uid.in_(uids)).order_by(UseCase.account_uid, UseCase.id)))
+        platforms = _by_account(session.exec(
+            select(Platform).where(Platform.account_uid.in_(uids)).order_by(Platform.account_uid, Platform.id)))
+        partners = _by_account(session.exec(
+            select(PrimaryITPartner).where(PrimaryITPartner.account_uid.in_(uids))
+            .order_by(PrimaryITPartner.account_uid, PrimaryITPartner.id)))
+        updates = _latest_updates(session, uids)
+        for account in batch:
+            account_use_cases = use_cases.get(account.uid, [])
+            account_updates = updates.get(account.uid, [])
+            yield [
+                account.uid, account.team, account.business_it_area, account.vp, account.csm,
+                account.health, account.health_reason,
+                "; ".join(p.primary_it_partner for p in partners.get(account.uid, []) if p.primary_it_partner),
+                len(account_use_cases),
+                "; ".join(_use_case_label(u) for u in account_use_cases),
+                "; ".join(f"{p.platform_name}: {p.onboarding_status or '-'}" for p in platforms.get(account.uid, [])),
+                account_updates[0].date.isoformat() if account_updates and account_updates[0].date else None,
+                "\n".join(_update_label(u) for u in account_updates),
+            ]
+
+
+def _by_account(rows: Iterable) -> Dict[str, list]:
+    return {uid: list(group) for uid, group in groupby(rows, key=lambda row: row.account_uid)}
+
+
+def _latest_updates(session: Session, uids: List[str]) -> Dict[str, List[Update]]:
+    ranked = select(
+        Update.id,
+        func.row_number().over(
+            partition_by=Update.account_uid, order_by=(Update.date.desc().nulls_last(), Update.id.desc())
+        ).label("rn"),
+    ).where(Update.account_uid.in_(uids)).subquery()
+    latest = session.exec(
+        select(Update).join(ranked, ranked.c.id == Update.id).where(ranked.c.rn <= REPORTS_LATEST_UPDATES)
+        .order_by(Update.account_uid, ranked.c.rn)
+    )
+    return _by_account(latest)
+
+
+def _use_case_label(use_case: UseCase) -> str:
+    label = use_case.problem or "(untitled)"
+    return f"{label} [{use_case.status}]" if use_case.status else label
+
+
+def _update_label(update: Update) -> str:
+    day = update.date.isoformat() if update.date else "undated"
+    return f"{day} {update.author or '-'}: {update.description or ''}"
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value)
+
+
+def write_csv(rows: Iterable[list], path: str) -> int:
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow([_cell(value) for value in row])
+            count += 1
+    return count
+
+
+def write_html(rows: Iterable[list], path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Portfolio report</title>"
+                "<style>table{border-collapse:collapse;font:13px sans-serif}"
+                "td,th{border:1px solid #ccc;padding:4px;vertical-align:top;white-space:pre-line}</style>"
+                f"</head><body><h1>Portfolio report</h1><p>Generated {datetime.utcnow():%Y-%m-%d %H:%M} UTC</p>\n"
+                "<table><thead><tr>")
+        f.write("".join(f"<th>{column}</th>" for column in COLUMNS))
+        f.write("</tr></thead><tbody>\n")
+        for row in rows:
+            f.write("<tr>" + "".join(f"<td>{html.escape(_cell(value))}</td>" for value in row) + "</tr>\n")
+            count += 1
+        f.write("</tbody></table></body></html>\n")
+    return count
+
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Portfolio" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+# Characters XML 1.0 doesn't allow, which Excel refuses to open
+_XML_INVALID = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+
+
+def _xlsx_row(values: list) -> str:
+    cells = []
+    for value in values:
+        if isinstance(value, int) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        elif value is not None:
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">'
+                         f'{escape(str(value).translate(_XML_INVALID))}</t></is></c>')
+        else:
+            cells.append("<c/>")
+    return "<row>" + "".join(cells) + "</row>"
+
+
+def write_xlsx(rows: Iterable[list], path: str) -> int:
+    """A single-sheet workbook with inline strings, streamed into the zip row by row."""
+    count = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        with workbook.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            sheet.write(_xlsx_row(COLUMNS).encode())
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode())
+                count += 1
+            sheet.write(b"</sheetData></worksheet>")
+    return count
+
+
+def write_arrow(rows: Iterable[list], path: str, batch_size: int = REPORTS_BATCH_SIZE) -> int:
+    """An Arrow IPC stream of COLUMNS, one record batch per batch_size accounts."""
+    schema = pa.schema([pa.field(column, pa.int64() if column == "use_case_count" else pa.string())
+                        for column in COLUMNS])
+    rows = iter(rows)
+    count = 0
+
+    def batches():
+        nonlocal count
+        while batch := list(islice(rows, batch_size)):
+            count += len(batch)
+            yield batch
+
+    with open(path, "wb") as f:
+        for data in arrow_batches(schema, batches()):
+            f.write(data)
+    return count
+
+
+WRITERS = {CSV: write_csv, XLSX: write_xlsx, HTML: write_html, ARROW: write_arrow}
+
+
+def write_report(session: Session, format: str, path: str) -> int:
+    """Write the portfolio report to `path` (via a temporary file). Returns the number of accounts."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.partial"
+    try:
+        count = WRITERS[format](report_rows(session), partial)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return count
+
+
+def report_filename(job: ReportJob) -> str:
+    return f"portfolio-report-{job.id}.{job.format}"
+
+
+def report_path(job: ReportJob, reports_dir: str = REPORTS_DIR) -> str:
+    """Where a worker builds the file before it is stored."""
+    return os.path.join(reports_dir, report_filename(job))
+
+
+def store_report_file(session: Session, job_id: int, path: str) -> int:
+    """Copy a built file into report_file_chunks. Returns its size; the caller commits."""
+    size = 0
+    with open(path, "rb") as f:
+        for seq, data in enumerate(iter(lambda: f.read(REPORT_CHUNK_BYTES), b"")):
+            session.execute(insert(ReportFileChunk).values(job_id=job_id, seq=seq, data=data))
+            size += len(data)
+    return size
+
+
+def read_report_file(session: Session, job_id: int) -> Iterator[bytes]:
+    """The stored file, one chunk in memory at a time."""
+    chunks = session.execute(
+        select(ReportFileChunk.data).where(ReportFileChunk.job_id == job_id).order_by(ReportFileChunk.seq)
+        .execution_options(yield_per=1)
+    )
+    for (data,) in chunks:
+        yield data
+
+
+def run_report_job(job_id: int, reports_dir: str = REPORTS_DIR) -> str:
+    """Build one queued job's file. Runs in a pool worker process; returns the final status."""
+    with Session(engine) as session:
+        job = session.get(ReportJob, job_id)
+        job.status = STATUS_RUNNING
+        job.started_at = datetime.utcnow()
+        session.commit()
+        path = report_path(job, reports_dir)
+        try:
+            with Session(engine) as read_session:
+                job.row_count = write_report(read_session, job.format, path)
+            job.file_size = store_report_file(session, job.id, path)
+            job.status = STATUS_DONE
+        except Exception as exc:
+            session.rollback()
+            job.status = STATUS_FAILED
+            job.error = f"{type(exc).__name__}: {exc}"[:1000]
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        job.finished_at = datetime.utcnow()
+        session.commit()
+        return job.status
+
+
+def _init_worker() -> None:
+    # Spawned workers import `database` afresh, but be safe if a fork context is ever used
+    engine.dispose(close=False)
+
+
+def process_owner() -> str:
+    # The boot id tells a restarted process apart from its previous incarnation, which may have had the same pid
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _parse_owner(owner: str) -> Tuple[str, int, str]:
+    host, pid, boot_id = owner.rsplit(":", 2)
+    return host, int(pid), boot_id
+
+
+class ReportRunner:
+    """Runs report jobs in a lazily started process pool owned by this API process."""
+
+    def __init__(self, max_workers: int = REPORTS_MAX_WORKERS, reports_dir: str = REPORTS_DIR,
+                 heartbeat_seconds: float = REPORTS_HEARTBEAT_SECONDS):
+        self.max_workers = max_workers
+        self.reports_dir = reports_dir
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owner = process_owner()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        """Start heartbeating this process's jobs and recovering orphaned ones."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="report-heartbeat", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                with Session(engine) as session:
+                    heartbeat(session, self.owner)
+                    recover_report_jobs(session, self.owner)
+                    session.commit()
+            except Exception as e:
+                print(f"Report job heartbeat failed: {e}")
+            self._stopping.wait(self.heartbeat_seconds)
+
+    def submit(self, job_id: int) -> Future:
+        self.start()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        future = self._executor.submit(run_report_job, job_id, self.reports_dir)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return future
+
+    def _on_done(self, job_id: int, future: Future) -> None:
+        # The worker records its own outcome; this only catches crashed or unstartable workers
+        if future.cancelled() or future.exception() is not None:
+            error = "Cancelled" if future.cancelled() else f"Worker failed: {future.exception()!r}"
+            _fail_jobs([job_id], error)
+
+    def shutdown(self) -> None:
+        self._stopping.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+report_runner = ReportRunner()
+
+
+def _fail_jobs(job_ids: List[int], error: str) -> None:
+    with Session(engine) as session:
+        for job in session.exec(select(ReportJob).where(ReportJob.id.in_(job_ids))):
+            if job.status in (STATUS_QUEUED, STATUS_RUNNING):
+                job.status = STATUS_FAILED
+                job.error = error
+                job.finished_at = datetime.utcnow()
+        session.commit()
+
+
+def _owner_is_gone(owner: Optional[str], current_owner: str) -> bool:
+    """Whether the owner is known to have exited; owners on other hosts are judged by heartbeat alone."""
+    if not owner:
+        return False
+    try:
+        host, pid, _ = _parse_owner(owner)
+        current_host, current_pid, _ = _parse_owner(current_owner)
+    except ValueError:
+        return False
+    if host != current_host:
+        return False
+    if pid == current_pid:
+        return owner != current_owner
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:  # exists, but belongs to another user
+        return False
+    return False
+
+
+def heartbeat(session: Session, owner: str) -> None:
+    session.execute(
+        update(ReportJob)
+        .where(ReportJob.owner == owner, ReportJob.status.in_([STATUS_QUEUED, STATUS_RUNNING]))
+        .values(heartbeat_at=datetime.utcnow())
+    )
+
+
+def recover_report_jobs(session: Session, owner: str, now: Optional[datetime] = None) -> List[int]:
+    """Fail other owners' queued and running jobs once their owner is gone or stopped heartbeating.
+
+    Returns the failed job ids; the caller commits.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=REPORTS_STALE_SECONDS)
+    candidates = session.exec(select(ReportJob).where(
+        ReportJob.status.in_([STATUS_QUEUED, STATUS_RUNNING]),
+        or_(ReportJob.owner.is_(None), ReportJob.owner != owner),
+    )).all()
+    orphaned = [job for job in candidates
+                if _owner_is_gone(job.owner, owner) or (job.heartbeat_at or job.created_at) < cutoff]
+    for job in orphaned:
+        job.status = STATUS_FAILED
+        job.error = "Interrupted: the server process running it stopped"
+        job.finished_at = datetime.utcnow()
+    return [job.id for job in orphaned]
+
+
+def purge_expired_reports(session: Session) -> int:
+    """Delete finished jobs older than REPORTS_RETENTION_HOURS, and their files."""
+    cutoff = datetime.utcnow() - timedelta(hours=REPORTS_RETENTION_HOURS)
+    expired = session.exec(select(ReportJob).where(
+        ReportJob.status.in_([STATUS_DONE, STATUS_FAILED]), ReportJob.finished_at < cutoff)).all()
+    if expired:
+        session.execute(delete(ReportFileChunk).where(ReportFileChunk.job_id.in_([job.id for job in expired])))
+    for job in expired:
+        session.delete(job)
+    return len(expired)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in REPORT_FORMATS:
+        print(f"Usage: python reports.py {{{','.join(REPORT_FORMATS)}}} <output path>")
+        sys.exit(1)
+    with Session(engine) as session:
+        count = write_report(session, sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} accounts to {sys.argv[2]}")
@@ -0,0 +1,275 @@
+"""
+Global full-text search over accounts, use cases, updates and intake requests.
+
+Every searchable row has one document in `search_documents`, keyed by
+(entity_type, entity_id):
+
+    Postgres - a weighted, generated `tsvector` column with a GIN index;
+               ranked with ts_rank_cd, snippets from ts_headline
+    SQLite   - an external-content FTS5 table `search_index` (porter
+               tokenizer) kept in sync by triggers; ranked with bm25,
+               snippets from snippet()
+
+Documents are written in the same transaction as the row, from an ORM
+after_flush hook (as the change log is), so the index is always current.
+Deleting an account also drops the documents of its archived updates.
+
+A search runs one ranking query (a per-type window over the matches, so each
+entity type is paginated independently and counted) and then builds
+snippets only for the rows on the page, from the title or body, whichever
+matches. Snippets are HTML: the document text is escaped and only the match
+markers become SNIPPET_START / SNIPPET_END tags, so stored text can't inject
+markup.
+"""
+
+import html
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, SQLModel, select
+
+from database import engine
+from models import Account, IntakeRequest, UseCase, Update, UpdateArchive
+
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+# Private-use characters delimit matches in the raw snippet until it has been escaped
+_MATCH_START = "\ue000"
+_MATCH_END = "\ue001"
+
+ACCOUNT = "account"
+USE_CASE = "use_case"
+UPDATE = "update"
+INTAKE_REQUEST = "intake_request"
+ENTITY_TYPES = [ACCOUNT, USE_CASE, UPDATE, INTAKE_REQUEST]
+
+
+def _join(*parts) -> str:
+    return "\n".join(str(p) for p in parts if p)
+
+
+def document_for(obj) -> Optional[dict]:
+    """Index document for a model instance, or None if the model is not searchable."""
+    if isinstance(obj, Account):
+        return {"entity_type": ACCOUNT, "entity_id": obj.uid, "account_uid": obj.uid, "title": obj.team,
+                "body": _join(obj.notes, obj.use_case, obj.business_it_area, obj.north_star_domain,
+                              obj.current_tech_stack, obj.health_reason)}
+    if isinstance(obj, UseCase):
+        return {"entity_type": USE_CASE, "entity_id": str(obj.id), "account_uid": obj.account_uid,
+                "title": obj.problem, "body": _join(obj.solution, obj.value, obj.leader, obj.platform)}
+    if isinstance(obj, (Update, UpdateArchive)):
+        return {"entity_type": UPDATE, "entity_id": str(obj.id), "account_uid": obj.account_uid,
+                "title": _join(obj.author, obj.platform), "body": obj.description}
+    if isinstance(obj, IntakeRequest):
+        return {"entity_type": INTAKE_REQUEST, "entity_id": str(obj.id), "account_uid": None,
+                "title": obj.title, "body": _join(obj.description, obj.additional_details, obj.submitted_for,
+                                                  obj.functional_area)}
+    return None
+
+
+def _is_postgres(connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+
+def create_search_index(connection) -> None:
+    if _is_postgres(connection):
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS search_documents (
+                id BIGSERIAL PRIMARY KEY,
+                entity_type VARCHAR NOT NULL,
+                entity_id VARCHAR NOT NULL,
+                account_uid VARCHAR,
+                title TEXT,
+                body TEXT,
+                tsv tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                    setweight(to_tsvector('english', coalesce(body, '')), 'B')
+                ) STORED
+            )
+        """))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_search_documents_tsv ON search_documents USING GIN (tsv)"))
+    else:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS search_documents (
+                id INTEGER PRIMARY KEY,
+                entity_type VARCHAR NOT NULL,
+                entity_id VARCHAR NOT NULL,
+                account_uid VARCHAR,
+                title TEXT,
+                body TEXT
+            )
+        """))
+        # External-content FTS5 index over search_documents, kept in sync by triggers
+        connection.execute(text("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                entity_type UNINDEXED, entity_id UNINDEXED, account_uid UNINDEXED, title, body,
+                content = 'search_documents', content_rowid = 'id', tokenize = 'porter unicode61'
+            )
+        """))
+        connection.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+                INSERT INTO search_index (rowid, entity_type, entity_id, account_uid, title, body)
+                VALUES (new.id, new.entity_type, new.entity_id, new.account_uid, new.title, new.body);
+            END
+        """))
+        connection.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+                INSERT INTO search_index (search_index, rowid, entity_type, entity_id, account_uid, title, body)
+                VALUES ('delete', old.id, old.entity_type, old.entity_id, old.account_uid, old.title, old.body);
+            END
+        """))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_search_documents_entity ON search_documents (entity_type, entity_id)"
+    ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_search_documents_account_uid ON search_documents (account_uid)"))
+
+
+@event.listens_for(SQLModel.metadata, "after_create")
+def _create_with_tables(target, connection, **kw):
+    # create_all() runs at startup and in tests; the index has to exist before anything is flushed
+    create_search_index(connection)
+
+
+DELETE_DOCUMENT = text("DELETE FROM search_documents WHERE entity_type = :entity_type AND entity_id = :entity_id")
+INSERT_DOCUMENT = text(
+    "INSERT INTO search_documents (entity_type, entity_id, account_uid, title, body) "
+    "VALUES (:entity_type, :entity_id, :account_uid, :title, :body)"
+)
+
+
+def _write_documents(connection, documents: List[dict], replace: bool = True) -> None:
+    if replace:
+        connection.execute(DELETE_DOCUMENT, documents)
+    connection.execute(INSERT_DOCUMENT, documents)
+
+
+def _delete_documents(connection, documents: List[dict]) -> None:
+    connection.execute(DELETE_DOCUMENT, documents)
+    accounts = [{"account_uid": d["entity_id"]} for d in documents if d["entity_type"] == ACCOUNT]
+    if accounts:
+        # Children deleted outside the ORM (archived updates) leave no flush events behind
+        connection.execute(text("DELETE FROM search_documents WHERE account_uid = :account_uid"), accounts)
+
+
+def index_documents(session: Session, objects, replace: bool = False) -> None:
+    """Index rows written with bulk statements, which the flush hook doesn't see."""
+    documents = [d for d in (document_for(obj) for obj in objects) if d is not None]
+    if documents:
+        _write_documents(session.connection(), documents, replace=replace)
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _index_flushed_changes(session, flush_context):
+    changed = [document_for(obj) for obj in list(session.new) + list(session.dirty)
+               if obj in session.new or session.is_modified(obj, include_collections=False)]
+    deleted = [document_for(obj) for obj in session.deleted]
+    changed = [d for d in changed if d is not None]
+    deleted = [d for d in deleted if d is not None]
+    if changed or deleted:
+        connection = session.connection()
+        if deleted:
+            _delete_documents(connection, deleted)
+        if changed:
+            _write_documents(connection, changed)
+
+
+def backfill_search_index() -> None:
+    """Create the index if needed and, when it is empty, index every existing row."""
+    with Session(engine) as session:
+        connection = session.connection()
+        create_search_index(connection)
+        if connection.execute(text("SELECT 1 FROM search_documents LIMIT 1")).first() is None:
+            for model in (Account, UseCase, Update, UpdateArchive, IntakeRequest):
+                documents = [document_for(obj) for obj in session.exec(select(model))]
+                if documents:
+                    _write_documents(connection, documents, replace=False)
+        session.commit()
+
+
+def fts5_query(q: str) -> str:
+    """Quote each term so user input can't inject FTS5 syntax; the last term matches as a prefix."""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _snippet_html(snippet: Optional[str]) -> Optional[str]:
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(_MATCH_START, SNIPPET_START).replace(_MATCH_END, SNIPPET_END)
+
+
+def search(session: Session, q: str, types: Optional[List[str]] = None, offset: int = 0, limit: int = 10) -> dict:
+    """Ranked matches grouped by entity type; each group is paginated with offset/limit."""
+    types = types or ENTITY_TYPES
+    connection = session.connection()
+    params = {"offset": offset, "end": offset + limit, **{f"type_{i}": t for i, t in enumerate(types)}}
+    type_list = ", ".join(f":type_{i}" for i in range(len(types)))
+
+    if _is_postgres(connection):
+        params["q"] = q
+        ranked = connection.execute(text(f"""
+            SELECT id, entity_type, entity_id, account_uid, title, score, total FROM (
+                SELECT d.id, d.entity_type, d.entity_id, d.account_uid, d.title,
+                       ts_rank_cd(d.tsv, query) AS score,
+                       row_number() OVER (PARTITION BY d.entity_type ORDER BY ts_rank_cd(d.tsv, query) DESC) AS rn,
+                       count(*) OVER (PARTITION BY d.entity_type) AS total
+                FROM search_documents d, websearch_to_tsquery('english', :q) query
+                WHERE d.tsv @@ query AND d.entity_type IN ({type_list})
+            ) ranked
+            WHERE rn > :offset AND rn <= :end
+            ORDER BY entity_type, score DESC
+        """), params).mappings().all()
+        snippets = {}
+        if ranked:
+            ids = {f"id_{i}": row["id"] for i, row in enumerate(ranked)}
+            options = f"StartSel={_MATCH_START}, StopSel={_MATCH_END}, MaxWords=30, MinWords=10"
+            snippets = dict(connection.execute(text(f"""
+                SELECT id, ts_headline('english', concat_ws(E'\\n', title, body), websearch_to_tsquery('english', :q),
+                                       :options)
+                FROM search_documents WHERE id IN ({", ".join(":" + k for k in ids)})
+            """), {"q": q, "options": options, **ids}).all())
+    else:
+        params["q"] = fts5_query(q)
+        if not params["q"]:
+            return {"q": q, "total": 0, "groups": {}}
+        ranked = connection.execute(text(f"""
+            SELECT id, entity_type, entity_id, account_uid, title, score, total FROM (
+                SELECT rowid AS id, entity_type, entity_id, account_uid, title, rank AS score,
+                       row_number() OVER (PARTITION BY entity_type ORDER BY rank) AS rn,
+                       count(*) OVER (PARTITION BY entity_type) AS total
+                FROM search_index
+                WHERE search_index MATCH :q AND entity_type IN ({type_list})
+            )
+            WHERE rn > :offset AND rn <= :end
+            ORDER BY entity_type, score
+        """), params).mappings().all()
+        snippets = {}
+        if ranked:
+            ids = {f"id_{i}": row["id"] for i, row in enumerate(ranked)}
+            # Column -1: the snippet comes from whichever of title and body matches best
+            snippets = dict(connection.execute(text(f"""
+                SELECT rowid, snippet(search_index, -1, :start, :end, '…', 16)
+                FROM search_index
+                WHERE search_index MATCH :q AND rowid IN ({", ".join(":" + k for k in ids)})
+            """), {"q": params["q"], "start": _MATCH_START, "end": _MATCH_END, **ids}).all())
+
+    groups: Dict[str, dict] = {}
+    for row in ranked:
+        group = groups.setdefault(row["entity_type"], {"total": row["total"], "results": []})
+        group["results"].append({
+            "type": row["entity_type"],
+            "id": row["entity_id"],
+            "account_uid": row["account_uid"],
+            "title": row["title"],
+            "snippet": _snippet_html(snippets.get(row["id"])),
+            # bm25 is lower-is-better; flip it so larger is better on both backends. Its magnitudes
+            # are tiny on small tables, so keep significant figures rather than decimal places.
+            "score": float(f"{float(row['score']) if _is_postgres(connection) else -float(row['score']):.4g}"),
+        })
+    return {"q": q, "total": sum(group["total"] for group in groups.values()), "groups": groups}
@@ -0,0 +1,98 @@
+"""
+Sideloading child collections on account list endpoints: `?include=platforms,latest_update`.
+
+Each included relation is loaded for the whole page of accounts with one
+`account_uid IN (...)` query, however many accounts the page has, and
+attached to every account under the relation's name:
+
+    platforms          - list of Platform
+    use_cases          - list of UseCase
+    primary_it_partner - the account's PrimaryITPartner, or null
+    latest_update      - the newest Update in the hot window (as for an account's
+                         update list), or null
+
+Includes compose with `fields=` and with offset/limit pagination, since they
+only ever look at the uids of the rows being returned. An unpaginated list
+is loaded INCLUDE_BATCH_SIZE accounts per query.
+"""
+
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, or_
+from sqlmodel import Session, select
+
+from archive import hot_cutoff
+from models import Platform, PrimaryITPartner, UseCase, Update
+
+PLATFORMS = "platforms"
+USE_CASES = "use_cases"
+PRIMARY_IT_PARTNER = "primary_it_partner"
+LATEST_UPDATE = "latest_update"
+INCLUDES = [PLATFORMS, USE_CASES, PRIMARY_IT_PARTNER, LATEST_UPDATE]
+
+# Relations that attach one object (or null) rather than a list
+SINGLE = {PRIMARY_IT_PARTNER, LATEST_UPDATE}
+
+# The largest page size; unpaginated lists are loaded in chunks of this many uids
+INCLUDE_BATCH_SIZE = 5000
+
+
+def parse_include(include: Optional[str]) -> List[str]:
+    """Validated relation names for an `include=` value."""
+    if not include:
+        return []
+    requested = list(dict.fromkeys(name.strip() for name in include.split(",") if name.strip()))
+    unknown = [name for name in requested if name not in INCLUDES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(unknown)}")
+    return requested
+
+
+def _children(model, uids: List[str]):
+    return select(model).where(model.account_uid.in_(uids)).order_by(model.account_uid, model.id)
+
+
+def _latest_updates(uids: List[str]):
+    ranked = select(
+        Update.id,
+        func.row_number().over(
+            partition_by=Update.account_uid, order_by=(Update.date.desc().nulls_last(), Update.id.desc())
+        ).label("rn"),
+    ).where(Update.account_uid.in_(uids), or_(Update.date >= hot_cutoff(), Update.date.is_(None))).subquery()
+    return select(Update).join(ranked, ranked.c.id == Update.id).where(ranked.c.rn == 1)
+
+
+QUERIES = {
+    PLATFORMS: lambda uids: _children(Platform, uids),
+    USE_CASES: lambda uids: _children(UseCase, uids),
+    PRIMARY_IT_PARTNER: lambda uids: _children(PrimaryITPartner, uids),
+    LATEST_UPDATE: _latest_updates,
+}
+
+
+def group_rows(name: str, rows: Iterable) -> Dict[str, Any]:
+    """Rows of one relation keyed by account uid: a list, or the single row for SINGLE relations."""
+    if name == LATEST_UPDATE:
+        rows = sorted(rows, key=lambda u: (u.account_uid, u.date is not None, u.date or 0, u.id), reverse=True)
+    else:
+        rows = sorted(rows, key=lambda row: (row.account_uid, row.id))
+    grouped = {uid: list(group) for uid, group in groupby(rows, key=lambda row: row.account_uid)}
+    if name in SINGLE:
+        return {uid: group[0] for uid, group in grouped.items()}
+    return grouped
+
+
+def load_includes(session: Session, uids: List[str], includes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """One IN query per relation for the given page of accounts."""
+    chunks = [uids[i:i + INCLUDE_BATCH_SIZE] for i in range(0, len(uids), INCLUDE_BATCH_SIZE)]
+    return {name: group_rows(name, [row for chunk in chunks for row in session.exec(QUERIES[name](chunk)).all()])
+            for name in includes}
+
+
+def attach(accounts: List[dict], loaded: Dict[str, Dict[str, Any]]) -> List[dict]:
+    for account in accounts:
+        for name, by_uid in loaded.items():
+            account[name] = by_uid.get(account["uid"], None if name in SINGLE else [])
+    return accounts
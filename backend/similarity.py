@@ -0,0 +1,277 @@
+"""
+TF-IDF similarity index for triaging intake requests.
+
+Matches a new intake request against what the team already has:
+
+    account        - Account.use_case + notes
+    use_case       - UseCase.problem + solution
+    intake_request - past requests' title + description + additional_details
+
+Documents are sublinear-tf x idf vectors, L2-normalised, so a match score is
+cosine similarity. The bulk of the corpus is a term-major (CSC) sparse matrix
+in NumPy arrays; scoring a query is one sparse matrix-vector product, i.e. a
+`bincount` over the posting lists of the query's terms, and top-k is an
+argpartition. Everything runs in-process, with no model service.
+
+Writes are applied incrementally: the cache invalidation bus reports the
+changed rows, and the next query reloads just those rows, tombstones their
+old vectors and keeps the new ones in a small delta segment. The matrix is
+rebuilt from the database when the delta outgrows SIMILARITY_MAX_DELTA (or a
+tenth of the corpus), when a whole table is invalidated, and at least every
+SIMILARITY_REBUILD_SECONDS so idf values don't drift.
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from sqlmodel import Session, select
+
+from cache import ALL_KEYS, bus
+from models import Account, IntakeRequest, UseCase
+
+SIMILARITY_MAX_DELTA = int(os.getenv("SIMILARITY_MAX_DELTA", "1000"))
+SIMILARITY_REBUILD_SECONDS = float(os.getenv("SIMILARITY_REBUILD_SECONDS", "3600"))
+
+ACCOUNT = "account"
+USE_CASE = "use_case"
+INTAKE_REQUEST = "intake_request"
+ENTITY_TYPES = [ACCOUNT, USE_CASE, INTAKE_REQUEST]
+
+SOURCE_TABLES = {"accounts": ACCOUNT, "use_cases": USE_CASE, "intake_requests": INTAKE_REQUEST}
+
+TOKEN = re.compile(r"[^\W_]{2,}")
+STOPWORDS = frozenset("""
+    a about above after all also an and any are as at be been being but by can could did do does doing for
+    from had has have having he her here hers him his how i if in into is it its just me more most my need
+    needs no not now of off on once only or other our out over own same she should so some such than that
+    the their them then there these they this those through to too under until up us very was we were what
+    when where which while who whom why will with would you your
+""".split())
+
+Key = Tuple[str, str]  # (entity type, entity id)
+
+
+class Document(NamedTuple):
+    entity_type: str
+    entity_id: str
+    account_uid: Optional[str]
+    title: Optional[str]
+    terms: Counter
+
+
+def tokenize(*parts: Optional[str]) -> Counter:
+    return Counter(t for part in parts if part for t in TOKEN.findall(part.lower())
+                   if t not in STOPWORDS and not t.isdigit())
+
+
+def account_document(account: Account) -> Document:
+    return Document(ACCOUNT, account.uid, account.uid, account.team, tokenize(account.use_case, account.notes))
+
+
+def use_case_document(use_case: UseCase) -> Document:
+    return Document(USE_CASE, str(use_case.id), use_case.account_uid, use_case.problem,
+                    tokenize(use_case.problem, use_case.solution))
+
+
+def intake_request_document(request: IntakeRequest) -> Document:
+    return Document(INTAKE_REQUEST, str(request.id), None, request.title,
+                    tokenize(request.title, request.description, request.additional_details))
+
+
+class SimilarityIndex:
+    def __init__(self, documents: List[Document]):
+        documents = [d for d in documents if d.terms]
+        self.keys: List[Key] = [(d.entity_type, d.entity_id) for d in documents]
+        self.row_of: Dict[Key, int] = {key: row for row, key in enumerate(self.keys)}
+        self.meta: List[Tuple[Optional[str], Optional[str]]] = [(d.account_uid, d.title) for d in documents]
+        self.types = np.array([ENTITY_TYPES.index(d.entity_type) for d in documents], dtype=np.int8)
+        self.live = np.ones(len(documents), dtype=bool)
+        self.delta: Dict[Key, Tuple[Document, Dict[str, float]]] = {}
+
+        df = Counter(term for d in documents for term in d.terms)
+        self.vocab: Dict[str, int] = {term: col for col, term in enumerate(df)}
+        size = len(documents)
+        self.idf = np.array([math.log((1 + size) / (1 + df[term])) + 1 for term in self.vocab])
+        self.unseen_idf = math.log(1 + size) + 1
+
+        # Triplets (term, row, tf) sorted by term give the CSC layout; weighting is vectorized
+        cols, rows, tfs = [], [], []
+        for row, document in enumerate(documents):
+            cols.extend(self.vocab[t] for t in document.terms)
+            rows.extend([row] * len(document.terms))
+            tfs.extend(document.terms.values())
+        cols = np.array(cols, dtype=np.int64)
+        rows = np.array(rows, dtype=np.int64)
+        weights = (1 + np.log(np.array(tfs, dtype=np.float64))) * self.idf[cols] if cols.size else np.zeros(0)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=size))
+        order = np.argsort(cols, kind="stable")
+        self.indices = rows[order]
+        self.data = (weights / norms[rows])[order] if cols.size else weights
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(cols, minlength=len(self.vocab)))])
+
+    def __len__(self) -> int:
+        return int(self.live.sum()) + len(self.delta)
+
+    def vectorize(self, terms: Counter) -> Dict[str, float]:
+        """Unit-length tf-idf vector, using this index's idf (unseen terms get the maximum)."""
+        vector = {t: (1 + math.log(tf)) * (self.idf[self.vocab[t]] if t in self.vocab else self.unseen_idf)
+                  for t, tf in terms.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {t: w / norm for t, w in vector.items()}
+
+    def upsert(self, document: Document) -> None:
+        key = (document.entity_type, document.entity_id)
+        self.delete(key)
+        if document.terms:
+            self.delta[key] = (document, self.vectorize(document.terms))
+
+    def delete(self, key: Key) -> None:
+        row = self.row_of.get(key)
+        if row is not None:
+            self.live[row] = False
+        self.delta.pop(key, None)
+
+    def delete_account(self, uid: str) -> None:
+        """Drop an account's document and its use cases'."""
+        for row, (account_uid, _) in enumerate(self.meta):
+            if account_uid == uid:
+                self.live[row] = False
+        for key in [k for k, (d, _) in self.delta.items() if d.account_uid == uid]:
+            del self.delta[key]
+
+    def query(self, terms: Counter, k: int = 10, types: Optional[List[str]] = None,
+              exclude: Optional[Key] = None) -> List[dict]:
+        vector = self.vectorize(terms)
+        matches: List[Tuple[float, Key, Optional[str], Optional[str], List[str]]] = []
+
+        # Main segment: scores = A @ q over the posting lists of the query terms
+        query_cols = [(self.vocab[t], w) for t, w in vector.items() if t in self.vocab]
+        if query_cols and self.keys:
+            starts = self.indptr[[c for c, _ in query_cols]]
+            ends = self.indptr[[c + 1 for c, _ in query_cols]]
+            rows = np.concatenate([self.indices[s:e] for s, e in zip(starts, ends)])
+            weights = np.concatenate([self.data[s:e] * w for (s, e), (_, w) in zip(zip(starts, ends), query_cols)])
+            scores = np.bincount(rows, weights=weights, minlength=len(self.keys))
+            scores[~self.live] = 0
+            if types:
+                scores[~np.isin(self.types, [ENTITY_TYPES.index(t) for t in types])] = 0
+            if exclude in self.row_of:
+                scores[self.row_of[exclude]] = 0
+            top = np.flatnonzero(scores)
+            if top.size > k:
+                top = top[np.argpartition(-scores[top], k - 1)[:k]]
+            shared = self._shared_terms(top, vector, query_cols)
+            for row in top.tolist():
+                account_uid, title = self.meta[row]
+                matches.append((float(scores[row]), self.keys[row], account_uid, title, shared[row]))
+
+        # Delta segment: few documents, plain dot products
+        for key, (document, doc_vector) in self.delta.items():
+            if key == exclude or (types and document.entity_type not in types):
+                continue
+            common = [t for t in vector if t in doc_vector]
+            if common:
+                score = sum(vector[t] * doc_vector[t] for t in common)
+                top_terms = sorted(common, key=lambda t: -vector[t] * doc_vector[t])
+                matches.append((score, key, document.account_uid, document.title, top_terms))
+
+        matches.sort(key=lambda m: -m[0])
+        return [{"entity_type": key[0], "entity_id": key[1], "account_uid": account_uid, "title": title,
+                 "score": round(score, 4), "terms": terms[:5]}
+                for score, key, account_uid, title, terms in matches[:k]]
+
+    def _shared_terms(self, top: np.ndarray, vector: Dict[str, float],
+                      query_cols: List[Tuple[int, float]]) -> Dict[int, List[str]]:
+        """Query terms present in each top row, strongest first."""
+        shared: Dict[int, List[Tuple[float, str]]] = {row: [] for row in top.tolist()}
+        terms = {col: t for t, col in ((t, self.vocab[t]) for t in vector if t in self.vocab)}
+        for col, w in query_cols:
+            start, end = self.indptr[col], self.indptr[col + 1]
+            hits = np.isin(self.indices[start:end], top)
+            for row, weight in zip(self.indices[start:end][hits].tolist(), self.data[start:end][hits].tolist()):
+                shared[row].append((w * weight, terms[col]))
+        return {row: [t for _, t in sorted(pairs, reverse=True)] for row, pairs in shared.items()}
+
+
+def load_documents(session: Session) -> List[Document]:
+    return ([account_document(a) for a in session.exec(select(Account)).all()]
+            + [use_case_document(u) for u in session.exec(select(UseCase)).all()]
+            + [intake_request_document(r) for r in session.exec(select(IntakeRequest)).all()])
+
+
+class SimilarityIndexHolder:
+    """Per-worker index; writes reported on the bus are applied on the next query."""
+
+    def __init__(self, max_delta: int = SIMILARITY_MAX_DELTA, rebuild_seconds: float = SIMILARITY_REBUILD_SECONDS):
+        self.max_delta = max_delta
+        self.rebuild_seconds = rebuild_seconds
+        self._index: Optional[SimilarityIndex] = None
+        self._built_at = 0.0
+        self._dirty: Dict[str, Set[str]] = {table: set() for table in SOURCE_TABLES}
+        self._rebuild = False
+        self._lock = threading.Lock()
+        bus.subscribe(self._on_bus_message)
+
+    def _on_bus_message(self, table: str, key: str) -> None:
+        if table == ALL_KEYS or (table in SOURCE_TABLES and key == ALL_KEYS):
+            self._rebuild = True
+        elif table in SOURCE_TABLES:
+            self._dirty[table].add(key)
+
+    def get(self, session: Session) -> SimilarityIndex:
+        with self._lock:
+            index = self._index
+            if (index is None or self._rebuild or time.monotonic() - self._built_at > self.rebuild_seconds
+                    or len(index.delta) > max(self.max_delta, len(index.keys) // 10)):
+                self._rebuild = False
+                self._take_dirty()
+                self._index = SimilarityIndex(load_documents(session))
+                self._built_at = time.monotonic()
+            elif any(self._dirty.values()):
+                self._apply_dirty(session, index)
+            return self._index
+
+    def _take_dirty(self) -> Dict[str, Set[str]]:
+        dirty, self._dirty = self._dirty, {table: set() for table in SOURCE_TABLES}
+        return dirty
+
+    def _apply_dirty(self, session: Session, index: SimilarityIndex) -> None:
+        dirty = self._take_dirty()
+        if dirty["accounts"]:
+            found = session.exec(select(Account).where(Account.uid.in_(dirty["accounts"]))).all()
+            for account in found:
+                index.upsert(account_document(account))
+            for uid in dirty["accounts"] - {a.uid for a in found}:
+                index.delete_account(uid)
+        for table, model, to_document in (("use_cases", UseCase, use_case_document),
+                                          ("intake_requests", IntakeRequest, intake_request_document)):
+            ids = {int(key) for key in dirty[table] if key.isdigit()}
+            if not ids:
+                continue
+            found = session.exec(select(model).where(model.id.in_(ids))).all()
+            for row in found:
+                index.upsert(to_document(row))
+            for missing in ids - {row.id for row in found}:
+                index.delete((SOURCE_TABLES[table], str(missing)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = None
+
+
+def find_matches(session: Session, request: IntakeRequest, k: int = 10,
+                 types: Optional[Iterable[str]] = None) -> List[dict]:
+    """Top-k accounts, use cases and past requests most similar to `request`."""
+    index = similarity_index.get(session)
+    document = intake_request_document(request)
+    return index.query(document.terms, k, list(types) if types else None,
+                       exclude=(INTAKE_REQUEST, document.entity_id))
+
+
+similarity_index = SimilarityIndexHolder()
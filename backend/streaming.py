@@ -0,0 +1,86 @@
+"""
+Streaming JSON for whole-table list endpoints (`GET /api/accounts`, `GET /api/intake-requests`).
+
+Building the whole response at once holds every ORM object, every validated
+model, the encoded list and the JSON string in memory together, so one
+request for a large table spikes worker memory by the size of the table
+several times over. Instead the query runs with `yield_per` (a server-side
+cursor on Postgres) and the array is written STREAM_CHUNK_ROWS rows at a
+time: each chunk is validated, encoded and sent before the next one is
+fetched, so memory is bounded by the chunk size and the first bytes leave
+as soon as the first chunk is encoded.
+
+Each chunk goes through the same steps FastAPI applies to a response_model
+(validate from attributes, dump in JSON mode, json.dumps as JSONResponse
+renders it), so the bytes are identical to a buffered response. A result
+that fits in the first chunk is sent buffered, with a Content-Length, and
+still benefits from the compressed-body cache.
+
+The generator runs after the endpoint returns and uses the request's
+session; that relies on FastAPI closing yield dependencies only after the
+response has been sent, as the pinned 0.104 does.
+"""
+
+import json
+import os
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+from sqlmodel import Session, SQLModel
+
+from admission import restart_statement_deadline
+from fieldsets import rows_to_dicts
+
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+
+MEDIA_TYPE = "application/json"
+
+
+def _dumps(content) -> bytes:
+    # Exactly JSONResponse.render
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+@lru_cache(maxsize=None)
+def model_encoder(model: Type[SQLModel]) -> Callable[[list], list]:
+    """Encode a chunk of ORM objects the way `response_model=List[model]` does."""
+    adapter = TypeAdapter(List[model])
+    return lambda rows: adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json",
+                                            by_alias=True)
+
+
+def fieldset_encoder(names: List[str]) -> Callable[[list], list]:
+    """Encode a chunk of `select_fields` rows the way `fieldset_response` does."""
+    return lambda rows: jsonable_encoder(rows_to_dicts(rows, names))
+
+
+def query_chunks(session: Session, query, scalars: bool = True, chunk_rows: Optional[int] = None) -> Iterator[list]:
+    """Lists of at most chunk_rows rows, fetched from one cursor as they are consumed."""
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    query = query.execution_options(yield_per=chunk_rows)
+    result = session.exec(query) if scalars else session.execute(query)
+    connection = session.connection()
+    for partition in result.partitions(chunk_rows):
+        yield partition
+        # Time spent waiting on the client doesn't count against the statement timeout
+        restart_statement_deadline(connection)
+
+
+def _array(first: list, rest: Iterable[list], encode: Callable[[list], list]) -> Iterator[bytes]:
+    yield b"[" + _dumps(encode(first))[1:-1]
+    for chunk in rest:
+        yield b"," + _dumps(encode(chunk))[1:-1]
+    yield b"]"
+
+
+def stream_list(chunks: Iterator[list], encode: Callable[[list], list] = jsonable_encoder,
+                chunk_rows: Optional[int] = None) -> Response:
+    """A JSON array of every row in `chunks`, each chunk turned into JSON-able items by `encode`."""
+    chunks = iter(chunks)
+    first = next(chunks, [])
+    if len(first) < (chunk_rows or STREAM_CHUNK_ROWS):
+        return Response(_dumps(encode(first)), media_type=MEDIA_TYPE)
+    return StreamingResponse(_array(first, chunks, encode), media_type=MEDIA_TYPE)
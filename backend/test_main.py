@@ -1,16 +1,933 @@
+import pytest
 from fastapi.testclient import TestClient
-from main import app
 
-client = TestClient(app)
 
-
-def test_read_root():
+def test_read_root(client):
     response = client.get("/")
     assert response.status_code == 200
     assert "message" in response.json()
 
 
-def test_get_accounts():
+def test_get_accounts(client):
     response = client.get("/api/accounts")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
+
+
+def test_compression_negotiation():
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+    from compression import CompressionMiddleware
+
+    compressed_app = FastAPI()
+    compressed_app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @compressed_app.get("/large")
+    def large():
+        return PlainTextResponse("x" * 5000)
+
+    @compressed_app.get("/small")
+    def small():
+        return PlainTextResponse("x")
+
+    @compressed_app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"a" * 300, b"b" * 300]), media_type="text/plain")
+
+    compressed_client = TestClient(compressed_app)
+
+    response = compressed_client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == "x" * 5000
+
+    response = compressed_client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+    response = compressed_client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "a" * 300 + "b" * 300
+
+
+def test_pool_status_and_null_pool_options(client):
+    from database import engine_options
+
+    response = client.get("/api/system/pool")
+    assert response.status_code == 200
+    assert "pool_class" in response.json()
+
+    options = engine_options("postgresql+psycopg://user@localhost/crm", pool_mode="null")
+    assert options["poolclass"].__name__ == "NullPool"
+    assert options["connect_args"]["prepare_threshold"] is None
+
+
+def test_replica_routing_with_read_your_writes(tmp_path):
+    from sqlmodel import create_engine as make_engine
+    from database import DatabaseRouter
+
+    primary = make_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = make_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    db_router = DatabaseRouter(primary, [replica], read_your_writes_seconds=60)
+
+    assert db_router.read_engine("client-a") is replica
+    db_router.record_write("client-a")
+    assert db_router.read_engine("client-a") is primary
+    assert db_router.read_engine("client-b") is replica
+
+    db_router.mark_unhealthy(replica)
+    assert db_router.read_engine("client-b") is primary
+
+
+def test_get_session_routes_reads_to_healthy_replicas(tmp_path, monkeypatch):
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session as DbSession, create_engine as make_engine
+    import database
+    from database import DatabaseRouter, get_session
+
+    primary = make_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = make_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    router = DatabaseRouter(primary, [replica], read_your_writes_seconds=60, health_interval=60)
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "db_router", router)
+
+    app = FastAPI()
+
+    @app.get("/bind")
+    @app.post("/bind")
+    def bind(session: DbSession = Depends(get_session)):
+        return session.get_bind() is replica and "replica" or "primary"
+
+    reader = TestClient(app, headers={"X-Client-ID": "reader"})
+    writer = TestClient(app, headers={"X-Client-ID": "writer"})
+    assert reader.get("/bind").json() == "replica"
+    assert writer.post("/bind").json() == "primary"
+    # Pinned to the primary after writing, by client id and by cookie
+    assert writer.get("/bind").json() == "primary"
+    assert TestClient(app, cookies=dict(writer.cookies)).get("/bind").json() == "primary"
+    assert reader.get("/bind").json() == "replica"
+
+    # Probing happens off the request path; requests only read the result
+    router.replicas[0] = broken = make_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    replica = broken
+    router.probe()
+    assert reader.get("/bind").json() == "primary"
+    assert router.status()[0]["healthy"] is False
+
+
+def test_startup_adds_columns_missing_from_existing_tables(tmp_path):
+    from sqlalchemy import inspect, text
+    from sqlmodel import Session as DbSession, create_engine as make_engine, select
+    from database import add_missing_columns
+    from models import IntakeRequest
+
+    # intake_requests as created before the triage board columns existed
+    old = make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with old.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE intake_requests (
+                id INTEGER PRIMARY KEY, title VARCHAR NOT NULL, description VARCHAR,
+                has_it_partner BOOLEAN NOT NULL, dri_contact VARCHAR, submitted_for VARCHAR,
+                functional_area VARCHAR, help_types VARCHAR, platform VARCHAR, additional_details VARCHAR,
+                created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)
+        """))
+        conn.execute(text("INSERT INTO intake_requests (title, has_it_partner, created_at, updated_at) "
+                          "VALUES ('Old request', 0, '2024-01-01', '2024-01-01')"))
+
+    assert add_missing_columns(old) == ["intake_requests.current_state_id", "intake_requests.state_entered_at"]
+    indexes = {index["name"] for index in inspect(old).get_indexes("intake_requests")}
+    assert "ix_intake_requests_current_state_updated" in indexes
+    with DbSession(old) as session:
+        request = session.exec(select(IntakeRequest)).one()
+        assert request.title == "Old request" and request.current_state_id is None
+    assert add_missing_columns(old) == []
+
+
+def test_startup_enforces_unique_state_assignments_on_existing_tables(tmp_path, monkeypatch):
+    from sqlalchemy import text
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine, select
+    import database
+    from database import create_db_and_tables, get_session
+    from main import app
+    from models import RequestStateAssignment
+
+    # request_state_assignments as created before the unique constraint, already holding a duplicate
+    old = make_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    SQLModel.metadata.create_all(old, tables=[t for t in SQLModel.metadata.sorted_tables
+                                              if t.name != "request_state_assignments"])
+    with old.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE request_state_assignments (
+                id INTEGER PRIMARY KEY, request_id INTEGER NOT NULL REFERENCES intake_requests (id),
+                state_id INTEGER NOT NULL REFERENCES request_states (id), assigned_at DATETIME NOT NULL)
+        """))
+        conn.execute(text("INSERT INTO request_states (id, name, created_at) VALUES (1, 'New', '2024-01-01'), "
+                          "(2, 'Done', '2024-01-01')"))
+        conn.execute(text("INSERT INTO intake_requests (id, title, has_it_partner, created_at, updated_at) "
+                          "VALUES (1, 'Old request', 0, '2024-01-01', '2024-01-01')"))
+        conn.execute(text("INSERT INTO request_state_assignments (request_id, state_id, assigned_at) "
+                          "VALUES (1, 1, '2024-01-01'), (1, 1, '2024-01-02')"))
+
+    monkeypatch.setattr(database, "engine", old)
+    create_db_and_tables()
+    create_db_and_tables()
+
+    def old_session():
+        with DbSession(old) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = old_session
+    try:
+        client = TestClient(app)
+        for _ in range(2):
+            assert client.post("/api/intake-requests/1/states/2").status_code == 200
+    finally:
+        app.dependency_overrides.pop(get_session, None)
+
+    with DbSession(old) as session:
+        pairs = [(a.request_id, a.state_id) for a in session.exec(select(RequestStateAssignment)).all()]
+    assert sorted(pairs) == [(1, 1), (1, 2)]
+
+
+def test_cache_evicted_on_commit():
+    from sqlmodel import Session as DbSession, create_engine as make_engine
+    from cache import cache, invalidate
+
+    cache.set("accounts", "ACC-1", "cached")
+    cache.set("accounts", "*", ["cached"])
+    with DbSession(make_engine("sqlite://")) as session:
+        invalidate(session, "accounts", "ACC-1")
+        assert cache.get("accounts", "ACC-1") == "cached"
+        session.commit()
+    assert cache.get("accounts", "ACC-1") is None
+    assert cache.get("accounts", "*") is None
+
+
+def test_change_feed_event_format():
+    import json
+    from datetime import datetime
+    from events import format_sse, STATE_ASSIGNED
+    from models import IntakeEvent
+
+    event = IntakeEvent(id=42, event_type=STATE_ASSIGNED, request_id=7, state_id=2, created_at=datetime(2025, 1, 1))
+    lines = format_sse(event).split("\n")
+    assert lines[0] == "id: 42"
+    assert lines[1] == "event: intake_request.state_assigned"
+    data = json.loads(lines[2][len("data: "):])
+    assert data["request_id"] == 7 and data["state_id"] == 2
+
+
+def test_change_feed_replays_past_the_page_limit_before_going_live(monkeypatch):
+    import asyncio
+    from datetime import datetime
+    import events
+    from events import ChangeFeed, STATE_ASSIGNED
+    from models import IntakeEvent
+
+    table = [IntakeEvent(id=i, event_type=STATE_ASSIGNED, request_id=1, created_at=datetime(2025, 1, 1))
+             for i in range(1, 11)]
+    monkeypatch.setattr(events, "EVENTS_REPLAY_LIMIT", 3)
+    monkeypatch.setattr(events, "fetch_events_since",
+                        lambda last_id, limit: [e for e in table if e.id > last_id][:limit])
+
+    async def replayed_ids():
+        feed = ChangeFeed(buffer_size=2)
+        feed.last_id = 10
+        feed.buffer.extend(table[-2:])
+        stream = feed.stream(last_event_id=0)
+        chunks = [await stream.__anext__() for _ in range(11)]
+        await stream.aclose()
+        return [int(chunk.split("\n")[0][len("id: "):]) for chunk in chunks[1:]]
+
+    assert asyncio.run(replayed_ids()) == list(range(1, 11))
+
+
+def test_outbox_digest_and_backoff():
+    from outbox import backoff_delay, build_digest
+    from models import OutboxMessage
+
+    messages = [OutboxMessage(kind="intake_notification", recipient="admin@example.com",
+                              subject=f"New Intake Request: {i}", body="details") for i in range(3)]
+    digest = build_digest("admin@example.com", messages)
+    assert digest["Subject"] == "3 new notifications"
+    assert "New Intake Request: 2" in digest.get_content()
+
+    assert backoff_delay(1, base=30).total_seconds() == 30
+    assert backoff_delay(3, base=30).total_seconds() == 120
+
+
+def test_outbox_sends_outside_a_transaction_and_reclaims_expired_leases(tmp_path):
+    from datetime import datetime, timedelta
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine, select
+    from models import OutboxMessage
+    from outbox import OutboxWorker, STATUS_PENDING, STATUS_SENDING, STATUS_SENT
+
+    bind = make_engine(f"sqlite:///{tmp_path / 'outbox.db'}", connect_args={"timeout": 0.1})
+    SQLModel.metadata.create_all(bind, tables=[OutboxMessage.__table__])
+    with DbSession(bind) as session:
+        session.add(OutboxMessage(kind="k", recipient="a@example.com", subject="fresh", body=""))
+        # Claimed by a worker that died before recording the outcome
+        session.add(OutboxMessage(kind="k", recipient="b@example.com", subject="orphan", body="",
+                                  status=STATUS_SENDING, lease_expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        session.commit()
+
+    sent = []
+
+    class Sender:
+        def send(self, email):
+            # Another writer gets through while the batch is being sent
+            with DbSession(bind) as other:
+                other.add(OutboxMessage(kind="k", recipient="c@example.com", subject="late", body="",
+                                        next_attempt_at=datetime.utcnow() + timedelta(hours=1)))
+                other.commit()
+            sent.append(email["Subject"])
+
+    worker = OutboxWorker(sender=Sender(), bind=bind, digest_threshold=10)
+    assert worker.drain_once() == 2
+    assert sorted(sent) == ["fresh", "orphan"]
+    with DbSession(bind) as session:
+        statuses = {m.subject: (m.status, m.lease_expires_at) for m in session.exec(select(OutboxMessage)).all()}
+    assert statuses["fresh"] == (STATUS_SENT, None) and statuses["orphan"] == (STATUS_SENT, None)
+    assert statuses["late"][0] == STATUS_PENDING
+
+    # Only one process drains a SQLite file
+    assert worker.is_drainer()
+    assert not OutboxWorker(sender=Sender(), bind=bind).is_drainer()
+
+
+def test_outbox_sender_follows_credentials_and_fails_without_one(monkeypatch):
+    from outbox import check_sender_config, default_sender
+
+    monkeypatch.delenv("AZURE_COMMUNICATION_CONNECTION_STRING", raising=False)
+    monkeypatch.delenv("OUTBOX_SMTP_HOST", raising=False)
+    assert default_sender() is None
+    with pytest.raises(ValueError, match="ADMIN_EMAIL"):
+        check_sender_config(None, admin_email="admin@example.com")
+    check_sender_config(None, admin_email="")
+    check_sender_config("file", admin_email="admin@example.com")
+    with pytest.raises(ValueError, match="AZURE_COMMUNICATION_CONNECTION_STRING"):
+        check_sender_config("azure", admin_email="admin@example.com")
+
+    monkeypatch.setenv("OUTBOX_SMTP_HOST", "relay.example.com")
+    assert default_sender() == "smtp"
+    monkeypatch.setenv("AZURE_COMMUNICATION_CONNECTION_STRING", "endpoint=https://example/;accesskey=x")
+    assert default_sender() == "azure"
+    check_sender_config("azure", admin_email="admin@example.com")
+
+
+def test_request_state_assignment_is_unique():
+    from models import RequestStateAssignment
+
+    constraints = {tuple(c.columns.keys()) for c in RequestStateAssignment.__table__.constraints
+                   if c.__class__.__name__ == "UniqueConstraint"}
+    assert ("request_id", "state_id") in constraints
+
+
+def test_change_log_tracks_upserts_and_tombstones():
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from changes import get_changes
+    from models import Account, UseCase
+
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        account = Account(uid="ACC-1", team="Before")
+        use_case = UseCase(account_uid="ACC-1", problem="p")
+        session.add(account)
+        session.add(use_case)
+        session.commit()
+        cursor = get_changes(session, 0, 100)["next_cursor"]
+
+        account.team = "After"
+        session.delete(use_case)
+        session.commit()
+
+        page = get_changes(session, cursor, 100)
+        assert [(c["table"], c["op"]) for c in page["changes"]] == [("accounts", "upsert"), ("use_cases", "delete")]
+        assert page["changes"][0]["data"]["team"] == "After"
+        assert page["has_more"] is False
+
+        # Entries are appended at commit, so a rolled-back write leaves none behind
+        account.team = "Discarded"
+        session.flush()
+        assert get_changes(session, page["next_cursor"], 100)["changes"] == []
+        session.rollback()
+        session.commit()
+        assert get_changes(session, page["next_cursor"], 100)["changes"] == []
+
+
+def test_admission_control_sheds_load_and_times_out_statements():
+    import asyncio
+    from sqlalchemy import create_engine as make_engine, text
+    from sqlalchemy.exc import OperationalError
+    from admission import (AdmissionControlMiddleware, classify, current_statement_timeout_ms,
+                           is_statement_timeout, LIST, READ, WRITE)
+
+    assert classify("GET", "/api/accounts") == LIST
+    assert classify("GET", "/api/accounts/ACC-1") == READ
+    assert classify("POST", "/api/accounts") == WRITE
+    assert classify("GET", "/api/system/pool") is None
+    assert classify("GET", "/api/search") == LIST
+    assert classify("GET", "/api/analytics/onboarding") == LIST
+    assert classify("GET", "/api/intake-requests/7/matches") == LIST
+
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.2)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def run():
+        middleware = AdmissionControlMiddleware(slow_app, settings={READ: (1, 1, 1000)}, queue_timeout=5)
+        statuses = []
+
+        async def call():
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+            await middleware({"type": "http", "method": "GET", "path": "/api/accounts/ACC-1"}, None, send)
+
+        await asyncio.gather(call(), call(), call())
+        return statuses
+
+    # One running, one queued, the third rejected immediately
+    assert sorted(asyncio.run(run())) == [200, 200, 503]
+
+    test_engine = make_engine("sqlite://")
+    token = current_statement_timeout_ms.set(50)
+    try:
+        with test_engine.connect() as conn:
+            conn.execute(text(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n"
+            ))
+        raise AssertionError("statement was not interrupted")
+    except OperationalError as e:
+        assert is_statement_timeout(e)
+    finally:
+        current_statement_timeout_ms.reset(token)
+
+    # A streamed statement's deadline restarts per chunk, so a slow reader isn't cut off mid-stream
+    from sqlmodel import Session as DbSession
+    from streaming import query_chunks
+    import time
+
+    token = current_statement_timeout_ms.set(200)
+    try:
+        with DbSession(test_engine) as session:
+            total = 0
+            for chunk in query_chunks(session, text(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 200000) SELECT i FROM n"
+            ), scalars=False, chunk_rows=50000):
+                total += len(chunk)
+                time.sleep(0.3)
+        assert total == 200000
+    finally:
+        current_statement_timeout_ms.reset(token)
+
+
+def test_sparse_fieldsets_project_requested_columns():
+    from fastapi import HTTPException
+    from fieldsets import parse_fields, select_fields
+    from models import Account
+
+    names = parse_fields(Account, "team, health")
+    assert names == ["uid", "team", "health"]
+    sql = str(select_fields(Account, names))
+    assert "accounts.team" in sql and "accounts.notes" not in sql
+    assert parse_fields(Account, None) is None
+    try:
+        parse_fields(Account, "team,bogus")
+        raise AssertionError("unknown field accepted")
+    except HTTPException as e:
+        assert e.status_code == 400
+
+
+def test_facet_index_counts_and_filters():
+    from facets import FacetIndex
+    from models import Account
+
+    accounts = [
+        Account(uid="A1", team="Alpha", health="Green", csm="Kim"),
+        Account(uid="A2", team="Beta", health="Red", csm="Kim"),
+        Account(uid="A3", team="Gamma", health="Green", csm="Lee"),
+    ]
+    index = FacetIndex.build(accounts, [("A1", "Databricks"), ("A3", "Databricks"), ("A3", "Snowflake")])
+
+    result = index.search({"health": ["Green"], "platform": ["Databricks"]})
+    assert result["total"] == 2
+    assert result["uids"] == ["A1", "A3"]
+    # Counts for a facet ignore that facet's own selection
+    assert {c["value"]: c["count"] for c in result["facets"]["health"]} == {"Green": 2}
+    assert {c["value"]: c["count"] for c in result["facets"]["csm"]} == {"Kim": 1, "Lee": 1}
+    assert index.search({}, offset=1, limit=1)["uids"] == ["A2"]
+
+
+def test_profiler_attributes_worker_thread_stacks_to_request():
+    import asyncio
+    import sys
+    import threading
+    import anyio
+    from profiling import ContinuousProfiler, RequestMarker, _current_marker, request_stack
+
+    marker = RequestMarker({"method": "GET", "path": "/api/accounts"})
+    started, release = threading.Event(), threading.Event()
+    worker_ids = []
+
+    def slow_endpoint():
+        worker_ids.append(threading.get_ident())
+        started.set()
+        release.wait(5)
+
+    async def request():
+        # Dispatched the way FastAPI runs sync endpoints
+        _current_marker.set(marker)
+        await anyio.to_thread.run_sync(slow_endpoint)
+        # The idle worker still holds the request's context; it no longer counts as the request
+        found_after, _ = request_stack(sys._current_frames()[worker_ids[0]])
+        return found_after
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(asyncio.run(request())))
+    thread.start()
+    started.wait(5)
+    found, stack = request_stack(sys._current_frames()[worker_ids[0]])
+    release.set()
+    thread.join()
+
+    assert found is marker
+    # Trimmed to the worker's run loop, which called the endpoint
+    assert [name for _, name, _ in stack][:2] == ["run", "slow_endpoint"]
+    assert results == [None]
+
+    profiler = ContinuousProfiler(hz=0)
+    profiler._on_sample(found, worker_ids[0], stack)
+    assert profiler.report()["GET /api/accounts"]["samples"] == 1
+
+
+def test_on_demand_profiles_get_unique_files(tmp_path, monkeypatch):
+    import asyncio
+    import profiling
+    from profiling import ProfilingMiddleware, ContinuousProfiler
+
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "secret")
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def run():
+        middleware = ProfilingMiddleware(app, profile_dir=str(tmp_path), continuous=ContinuousProfiler(hz=0))
+        names = []
+
+        async def call():
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    names.append(dict(message["headers"])[b"x-profile-file"].decode())
+            await middleware({"type": "http", "method": "GET", "path": "/api/accounts",
+                              "headers": [(b"x-profile", b"secret")]}, None, send)
+
+        await asyncio.gather(call(), call())
+        return names
+
+    names = asyncio.run(run())
+    assert len(set(names)) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(names)
+
+
+def test_profile_query_token_is_url_decoded():
+    from profiling import _requested_token
+
+    assert _requested_token({"headers": [], "query_string": b"a=1&profile=s%2Bcr%20t%3D"}) == "s+cr t="
+    assert _requested_token({"headers": [], "query_string": b"profiles=x"}) is None
+
+
+def test_tracing_propagates_traceparent_and_exports_otlp_spans():
+    from tracing import BatchSpanProcessor, Tracer, current_span, _statement_name
+
+    exported = []
+
+    class Capture:
+        def export(self, spans):
+            exported.extend(span.to_otlp() for span in spans)
+
+    tracer = Tracer(BatchSpanProcessor([Capture()]), sample_ratio=0.0)
+    assert tracer.start_trace("GET /", None) is None
+    assert tracer.start_trace("GET /", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00") is None
+
+    root = tracer.start_trace("GET /api/accounts", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01")
+    token = current_span.set(root)
+    child = tracer.start_span(_statement_name('SELECT accounts.uid FROM "accounts" WHERE uid = ?'))
+    current_span.reset(token)
+    tracer.end(child)
+    tracer.end(root)
+    tracer.processor.flush()
+
+    assert [span["name"] for span in exported] == ["SELECT accounts", "GET /api/accounts"]
+    assert exported[0]["parentSpanId"] == exported[1]["spanId"]
+    assert exported[1]["traceId"] == "0af7651916cd43dd8448eb211c80319c"
+    assert exported[1]["parentSpanId"] == "b7ad6b7169203331"
+
+
+def test_archive_moves_cold_updates_and_reads_hot_window():
+    from datetime import date, timedelta
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from archive import account_updates, archive_batch, hot_cutoff
+    from changes import get_changes
+    from models import Account, Update, UpdateArchive
+
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        session.add(Account(uid="ACC-1"))
+        session.add(Update(account_uid="ACC-1", description="old", date=hot_cutoff() - timedelta(days=1)))
+        session.add(Update(account_uid="ACC-1", description="new", date=date.today()))
+        session.commit()
+
+        assert [u.description for u in account_updates(session, "ACC-1")] == ["new"]
+        assert archive_batch(session, hot_cutoff()) == 1
+        session.commit()
+
+        assert session.get(UpdateArchive, 1).description == "old"
+        assert [u.description for u in account_updates(session, "ACC-1", include_archived=True)] == ["new", "old"]
+        # Delta sync clients see the archived row leave `updates`
+        assert [(c["key"], c["op"]) for c in get_changes(session, 0, 100, ["updates"])["changes"]] == [
+            ("2", "upsert"), ("1", "delete")]
+
+
+def test_full_text_search_indexes_on_write_and_ranks_by_type():
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from search import fts5_query, search
+    from models import Account, UseCase
+
+    assert fts5_query('pipe") OR (x') == '"pipe" "OR" "x"*'
+
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        session.add(Account(uid="ACC-1", team="Claims", notes="Migrating the claims pipeline to Databricks"))
+        session.add(UseCase(account_uid="ACC-1", problem="Slow pipelines", solution="Incremental loads"))
+        session.commit()
+
+        result = search(session, "pipeline")
+        assert set(result["groups"]) == {"account", "use_case"}
+        assert "<mark>pipeline</mark>" in result["groups"]["account"]["results"][0]["snippet"]
+        # Matched only in the title
+        assert result["groups"]["use_case"]["results"][0]["snippet"] == "Slow <mark>pipelines</mark>"
+
+        # Stored text is escaped; only the match markers are markup
+        session.add(Account(uid="ACC-2", team="Ops", notes='<img src=x onerror="alert(1)"> billing pipeline'))
+        session.commit()
+        snippet = search(session, "billing")["groups"]["account"]["results"][0]["snippet"]
+        assert snippet == "&lt;img src=x onerror=&quot;alert(1)&quot;&gt; <mark>billing</mark> pipeline"
+        session.delete(session.get(Account, "ACC-2"))
+        session.commit()
+
+        account = session.get(Account, "ACC-1")
+        account.notes = "Nothing relevant"
+        session.commit()
+        assert set(search(session, "pipeline")["groups"]) == {"use_case"}
+
+        session.delete(session.get(UseCase, 1))
+        session.commit()
+        assert search(session, "pipeline")["total"] == 0
+
+
+def test_portfolio_report_rows_and_xlsx(tmp_path):
+    import zipfile
+    from datetime import date
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from reports import COLUMNS, report_rows, write_xlsx
+    from models import Account, Platform, UseCase, Update
+
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        session.add(Account(uid="ACC-1", team="Claims & Billing", health="Green"))
+        session.add(Account(uid="ACC-2", team="Pharmacy"))
+        session.add(UseCase(account_uid="ACC-1", problem="Slow loads", status="Live"))
+        session.add(Platform(account_uid="ACC-1", platform_name="Databricks", onboarding_status="Completed"))
+        for day in (1, 2, 3, 4):
+            session.add(Update(account_uid="ACC-1", description=f"note {day}", date=date(2024, 1, day)))
+        session.commit()
+
+        rows = {row[0]: dict(zip(COLUMNS, row)) for row in report_rows(session, batch_size=1)}
+        assert rows["ACC-1"]["use_cases"] == "Slow loads [Live]"
+        assert rows["ACC-1"]["platforms"] == "Databricks: Completed"
+        assert rows["ACC-1"]["latest_update_date"] == "2024-01-04"
+        assert rows["ACC-1"]["latest_updates"].count("\n") == 2
+        assert rows["ACC-2"]["use_case_count"] == 0
+
+        path = tmp_path / "report.xlsx"
+        assert write_xlsx(report_rows(session), str(path)) == 2
+        sheet = zipfile.ZipFile(path).read("xl/worksheets/sheet1.xml").decode()
+        assert "Claims &amp; Billing" in sheet
+
+
+def test_onboarding_analytics_buckets_and_cadence():
+    import numpy as np
+    from datetime import date
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from analytics import _compute, bucket_dates
+    from models import Account, Update, UpdateArchive
+
+    days = np.array(["2024-05-15", "2024-01-01", "2024-12-31"], dtype="datetime64[D]")
+    assert [str(d) for d in bucket_dates(days, "week")] == ["2024-05-13", "2024-01-01", "2024-12-30"]
+    assert [str(d) for d in bucket_dates(days, "quarter")] == ["2024-04-01", "2024-01-01", "2024-10-01"]
+
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        session.add(Account(uid="ACC-1", month_onboarded_db=date(2024, 3, 1)))
+        session.add(Account(uid="ACC-2", month_onboarded_db=date(2024, 3, 1), month_onboarded_sf=date(2024, 6, 1)))
+        session.add(UpdateArchive(id=1, account_uid="ACC-1", date=date(2024, 1, 1)))
+        session.add(Update(id=2, account_uid="ACC-1", date=date(2024, 1, 20)))
+        session.add(Update(id=3, account_uid="ACC-2", date=date(2024, 2, 20)))
+        session.commit()
+
+        result = _compute(session, "quarter", date(2024, 1, 1), date(2024, 6, 30), None)
+        assert result["buckets"] == ["2024-01-01", "2024-04-01"]
+        assert [b["accounts"] for b in result["onboardings"]["Databricks"]] == [2, 0]
+        assert result["time_to_onboard"]["Databricks"][0] == {
+            "bucket": "2024-01-01", "accounts": 2, "avg_days": 35.0, "median_days": 35.0}
+        assert result["update_cadence"][0] == {
+            "bucket": "2024-01-01", "updates": 3, "active_accounts": 2, "updates_per_account": 1.5}
+
+
+def test_search_scores_keep_precision_when_terms_are_common():
+    from sqlalchemy import create_engine, text
+    from sqlmodel import Session
+    from search import create_search_index, search
+
+    # bm25 is about 1e-6 when every document matches; rounding to decimal places made it 0
+    engine = create_engine("sqlite://")
+    with engine.connect() as connection:
+        create_search_index(connection)
+        connection.execute(text("INSERT INTO search_documents (entity_type, entity_id, title, body) "
+                                "VALUES ('update', '1', 'Build failed', ''), ('update', '2', 'Build failed again', '')"))
+        results = search(Session(bind=connection), "build failed")["groups"]["update"]["results"]
+    assert all(result["score"] > 0 for result in results)
+
+
+def test_ingest_group_commits_and_rejects_unknown_accounts(client, db_session):
+    import threading
+    from sqlmodel import func, select
+    from ingest import GroupCommitWriter
+    from models import ChangeLogEntry, Update
+
+    before = db_session.exec(select(func.count()).select_from(Update)).one()
+    response = client.post("/api/updates/ingest", json=[
+        {"account_uid": "ACC0001", "description": "Build 42 failed", "date": "2024-05-01"},
+        {"account_uid": "ACC0002", "description": "Work item 7 closed"},
+    ])
+    assert response.json() == {"written": 2}
+    assert client.post("/api/updates/ingest", json={"account_uid": "NOPE"}).status_code == 400
+    assert client.post("/api/updates/ingest", params={"wait": "false"}, json={"account_uid": "NOPE"}).status_code == 400
+    assert db_session.exec(select(func.count()).select_from(Update)).one() == before + 2
+    assert client.get("/api/search", params={"q": "build failed"}).json()["total"] == 1
+
+    # Submissions arriving within the delay share one commit; a bad one fails alone
+    writer = GroupCommitWriter(bind=db_session.connection(), max_delay_ms=200)
+    done = threading.Event()
+    outcomes = []
+
+    def on_done(error):
+        outcomes.append(error)
+        if len(outcomes) == 3:
+            done.set()
+
+    changes = db_session.exec(select(func.count()).select_from(ChangeLogEntry)).one()
+    writer.submit([{"account_uid": "ACC0003", "description": "a"}], on_done)
+    writer.submit([{"account_uid": "NOPE", "description": "b"}], on_done)
+    writer.submit([{"account_uid": "ACC0004", "description": "c"}, {"account_uid": "ACC0005"}], on_done)
+    assert done.wait(5)
+    writer.stop()
+    assert writer.batches == 1 and writer.events_written == 3
+    assert sorted(type(e).__name__ for e in outcomes) == ["NoneType", "NoneType", "UnknownAccountError"]
+    assert db_session.exec(select(func.count()).select_from(ChangeLogEntry)).one() == changes + 3
+
+
+def test_health_scoring_from_signals():
+    from datetime import date, timedelta
+    from sqlmodel import SQLModel, Session as DbSession, create_engine as make_engine
+    from health import score_accounts
+    from models import Account, Platform, UseCase, Update, UpdateArchive
+
+    today = date(2024, 6, 1)
+    test_engine = make_engine("sqlite://")
+    SQLModel.metadata.create_all(test_engine)
+    with DbSession(test_engine) as session:
+        session.add(Account(uid="ACC-1", month_onboarded_db=date(2023, 1, 1)))
+        session.add(Account(uid="ACC-2", health="Green", health_reason="Set by hand"))
+        session.add(UseCase(account_uid="ACC-1", status="Completed"))
+        session.add(UseCase(account_uid="ACC-2", status="Blocked"))
+        session.add(Platform(account_uid="ACC-1", platform_name="Databricks", onboarding_status="Completed"))
+        for days in range(0, 60, 10):
+            session.add(Update(account_uid="ACC-1", date=today - timedelta(days=days)))
+        session.add(UpdateArchive(id=999, account_uid="ACC-2", date=date(2023, 1, 1)))
+        # Orphans (SQLite doesn't enforce the foreign keys) sorting before, between and after the accounts
+        session.add(UseCase(account_uid="ZZZ-gone", status="Completed"))
+        session.add(Platform(account_uid="ACC-15", platform_name="Snowflake", onboarding_status="Not started"))
+        session.add(Update(account_uid="AAA-gone", date=today))
+        session.commit()
+
+        summary = score_accounts(session, as_of=today)
+        assert summary["accounts"] == 2 and summary["changed"] == 2
+        healthy, stale = session.get(Account, "ACC-1"), session.get(Account, "ACC-2")
+        assert (healthy.health, healthy.health_score, healthy.health_reason) == ("Green", 100.0, "On track")
+        assert (stale.health, stale.health_reason) == ("Red", "No update since 2023-01-01")
+
+        # A day later nothing moved enough to rewrite
+        assert score_accounts(session, as_of=today + timedelta(days=1))["changed"] == 0
+
+
+def test_intake_request_matches_update_incrementally(client):
+    use_case = client.post("/api/use-cases", json={
+        "account_uid": "ACC0003", "problem": "Streaming telemetry ingestion into Kafka",
+        "solution": "Structured streaming from Kafka topics into Delta tables"}).json()
+    request = client.post("/api/intake-requests", json={
+        "title": "Kafka telemetry streaming", "description": "We need to ingest device telemetry from Kafka"}).json()
+
+    matches = client.get(f"/api/intake-requests/{request['id']}/matches", params={"k": 3}).json()["matches"]
+    assert matches[0]["entity_type"] == "use_case" and matches[0]["entity_id"] == str(use_case["id"])
+    assert matches[0]["account_uid"] == "ACC0003"
+    assert {"kafka", "telemetry"} <= set(matches[0]["terms"])
+
+    # Applied from the write's bus message, without a rebuild
+    client.put(f"/api/use-cases/{use_case['id']}", json={"problem": "Quarterly budget review", "solution": "Spreadsheets"})
+    matches = client.get(f"/api/intake-requests/{request['id']}/matches", params={"types": "use_case"}).json()["matches"]
+    assert str(use_case["id"]) not in [m["entity_id"] for m in matches]
+    assert client.get(f"/api/intake-requests/{request['id']}/matches", params={"types": "team"}).status_code == 400
+
+
+def test_account_list_includes_children_page_by_page(client, db_session):
+    from datetime import date
+    from models import Update
+
+    page = client.get("/api/accounts", params={
+        "limit": 2, "offset": 1, "fields": "team", "include": "platforms,primary_it_partner,latest_update"}).json()
+    assert [a["uid"] for a in page] == ["ACC0001", "ACC0002"]
+    assert set(page[0]) == {"uid", "team", "platforms", "primary_it_partner", "latest_update"}
+    assert [p["platform_name"] for p in page[0]["platforms"]] == ["Databricks", "Snowflake"]
+    assert page[0]["primary_it_partner"]["primary_it_partner"] == "Partner 1"
+    assert page[0]["latest_update"]["description"] == "Update 0"
+
+    client.post("/api/accounts", json={"uid": "ACC0000A", "team": "No children"})
+    # Past the hot window, like the account's own update list
+    db_session.add(Update(account_uid="ACC0000A", description="Old", date=date(2000, 1, 1)))
+    db_session.commit()
+    bare = client.get("/api/accounts", params={"limit": 1, "offset": 1, "include": "use_cases,latest_update"}).json()
+    assert bare[0]["uid"] == "ACC0000A" and bare[0]["use_cases"] == [] and bare[0]["latest_update"] is None
+    assert client.get("/api/accounts", params={"include": "owners"}).status_code == 400
+
+
+def test_board_follows_state_assignments(client):
+    board = client.get("/api/intake-requests/board", params={"limit": 5, "fields": "title"}).json()
+    assert [(c["state"] and c["state"]["name"], c["count"]) for c in board["columns"]] == [
+        ("New", 34), ("In Review", 33), ("Completed", 33), (None, 0)]
+    assert len(board["columns"][0]["requests"]) == 5
+    assert set(board["columns"][0]["requests"][0]) == {"id", "title", "current_state_id"}
+
+    # The newest assignment is the current state; the moved card sorts first in its new column
+    entered = client.get("/api/intake-requests/1").json()["state_entered_at"]
+    client.post("/api/intake-requests/1/states/3")
+    board = client.get("/api/intake-requests/board").json()
+    assert [c["count"] for c in board["columns"]] == [33, 33, 34, 0]
+    assert board["columns"][2]["requests"][0]["id"] == 1
+
+    client.delete("/api/intake-requests/1/states/3")
+    request = client.get("/api/intake-requests/1").json()
+    assert (request["current_state_id"], request["state_entered_at"]) == (1, entered)
+
+    # Deleting a state moves its cards back to their previous state, here none
+    client.delete("/api/request-states/2")
+    board = client.get("/api/intake-requests/board").json()
+    assert [(c["state"] and c["state"]["name"], c["count"]) for c in board["columns"]] == [
+        ("New", 34), ("Completed", 33), (None, 33)]
+
+    column = client.get("/api/intake-requests/board/column", params={"offset": 30, "limit": 10}).json()
+    assert len(column["requests"]) == 3 and all(r["current_state_id"] is None for r in column["requests"])
+    assert client.get("/api/intake-requests/board/column", params={"state_id": 99}).status_code == 404
+
+
+def test_whole_table_lists_stream_the_same_json(client, monkeypatch):
+    import streaming
+
+    paged = client.get("/api/accounts", params={"limit": 5000})
+    paged_fields = client.get("/api/accounts", params={"limit": 5000, "fields": "team,health"})
+    paged_includes = client.get("/api/accounts", params={"limit": 5000, "include": "platforms"})
+    buffered_requests = client.get("/api/intake-requests")
+    assert "content-length" in buffered_requests.headers
+
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_ROWS", 7)
+    streamed = client.get("/api/accounts")
+    assert "content-length" not in streamed.headers
+    assert streamed.content == paged.content
+    assert client.get("/api/accounts", params={"fields": "team,health"}).content == paged_fields.content
+    assert client.get("/api/accounts", params={"include": "platforms"}).content == paged_includes.content
+    assert client.get("/api/intake-requests").content == buffered_requests.content
+
+
+def test_list_endpoints_negotiate_arrow_and_msgpack(client, db_session, tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    msgpack = pytest.importorskip("msgpack")
+    from formats import ARROW, MSGPACK, negotiate
+    from reports import report_rows, write_arrow
+
+    assert negotiate(None) == negotiate("*/*") == negotiate("application/json, application/msgpack;q=0.5") == "application/json"
+    assert negotiate(f"{ARROW}, */*;q=0.1") == ARROW and negotiate("application/x-msgpack") == MSGPACK
+    assert negotiate("text/html") == negotiate("text/csv, application/*;q=0.5") == "application/json"
+    assert client.get("/api/accounts", headers={"Accept": "text/html"}).status_code == 200
+    assert client.get("/api/accounts", headers={"Accept": "text/csv, application/json;q=0"}).status_code == 406
+
+    response = client.get("/api/accounts", params={"fields": "team,health_score,month_onboarded_db"},
+                          headers={"Accept": ARROW})
+    assert response.headers["content-type"] == ARROW
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == 200 and table.column_names == ["uid", "team", "health_score", "month_onboarded_db"]
+    assert str(table.schema.field("month_onboarded_db").type) == "date32[day]"
+    assert table.column("team")[1].as_py() == "Team 1"
+
+    json_requests = client.get("/api/intake-requests").json()
+    packed = client.get("/api/intake-requests", headers={"Accept": MSGPACK})
+    assert packed.headers["content-type"] == MSGPACK
+    assert msgpack.unpackb(packed.content) == json_requests
+    assert client.get("/api/accounts", params={"include": "platforms"}, headers={"Accept": ARROW}).status_code == 400
+
+    path = tmp_path / "report.arrow"
+    assert write_arrow(report_rows(db_session), str(path), batch_size=64) == 200
+    with pa.ipc.open_stream(pa.memory_map(str(path))) as reader:
+        assert reader.read_all().column("use_case_count").to_pylist()[:2] == [3, 3]
+
+
+def test_report_jobs_recover_only_orphans_and_download_from_any_instance(client, db_session, tmp_path):
+    import os
+    from datetime import datetime, timedelta
+    from models import ReportJob
+    from reports import STATUS_DONE, STATUS_FAILED, STATUS_RUNNING, process_owner, recover_report_jobs, store_report_file
+
+    me = process_owner()
+    host, pid, _ = me.rsplit(":", 2)
+    now = datetime.utcnow()
+    jobs = {
+        "mine": ReportJob(format="csv", status=STATUS_RUNNING, owner=me, heartbeat_at=now - timedelta(hours=1)),
+        "other_host": ReportJob(format="csv", status=STATUS_RUNNING, owner="elsewhere:1:abc", heartbeat_at=now),
+        "stale": ReportJob(format="csv", status=STATUS_RUNNING, owner="elsewhere:2:abc",
+                           heartbeat_at=now - timedelta(hours=1)),
+        "restarted": ReportJob(format="csv", status=STATUS_RUNNING, owner=f"{host}:{pid}:previous", heartbeat_at=now),
+    }
+    db_session.add_all(jobs.values())
+    db_session.flush()
+    assert sorted(recover_report_jobs(db_session, me)) == sorted([jobs["stale"].id, jobs["restarted"].id])
+    assert [jobs[name].status for name in ("mine", "other_host")] == [STATUS_RUNNING, STATUS_RUNNING]
+    assert jobs["stale"].status == STATUS_FAILED
+
+    # The file lives in the database, so the download doesn't depend on the building instance's disk
+    path = tmp_path / "built.csv"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 5))
+    done = ReportJob(format="csv", status=STATUS_DONE)
+    db_session.add(done)
+    db_session.flush()
+    done.file_size = store_report_file(db_session, done.id, str(path))
+    db_session.commit()
+    response = client.get(f"/api/reports/{done.id}/download")
+    assert response.status_code == 200 and response.content == path.read_bytes()
+    assert response.headers["content-disposition"] == f'attachment; filename="portfolio-report-{done.id}.csv"'
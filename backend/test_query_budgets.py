@@ -0,0 +1,110 @@
+"""
+SQL statement and latency budgets for every endpoint, at the seeded data size
+(see conftest.py). A change that adds queries to an endpoint, e.g. an N+1
+loop over accounts, fails here; raise a budget only for a deliberate change.
+Latency budgets are checked only with PERF_BUDGET_SCALE set (see conftest.py).
+"""
+
+import pytest
+from fastapi.routing import APIRoute
+
+from main import app
+from reports import report_runner
+
+# (method, route, request path, JSON body, expected status, max SQL statements, max ms)
+BUDGETS = [
+    # The first request through the app builds its middleware stack
+    ("GET", "/", "/", None, 200, 0, 250),
+    ("GET", "/api/system/pool", "/api/system/pool", None, 200, 0, 50),
+    ("GET", "/api/system/cache", "/api/system/cache", None, 200, 0, 50),
+    ("GET", "/api/system/admission", "/api/system/admission", None, 200, 0, 50),
+    ("GET", "/api/system/ingest", "/api/system/ingest", None, 200, 0, 50),
+    ("GET", "/api/system/tracing", "/api/system/tracing", None, 200, 0, 50),
+    ("GET", "/api/system/profile", "/api/system/profile", None, 404, 0, 50),
+    ("GET", "/api/changes", "/api/changes?since=0&limit=500", None, 200, 6, 1000),
+    ("GET", "/api/search", "/api/search?q=pipeline", None, 200, 2, 100),
+    ("GET", "/api/analytics/onboarding", "/api/analytics/onboarding", None, 200, 6, 300),
+    ("GET", "/api/accounts", "/api/accounts", None, 200, 1, 100),
+    # One IN query per included relation, however many accounts are on the page
+    ("GET", "/api/accounts", "/api/accounts?include=platforms,use_cases,primary_it_partner,latest_update",
+     None, 200, 5, 200),
+    ("GET", "/api/accounts", "/api/accounts?limit=50&offset=50&fields=team&include=platforms,latest_update",
+     None, 200, 3, 100),
+    # Four grouped loads, then the changed accounts' UPDATE, change log and search documents
+    ("POST", "/api/health-scores/run", "/api/health-scores/run", None, 200, 9, 300),
+    ("GET", "/api/accounts/search", "/api/accounts/search?health=Red&limit=50", None, 200, 3, 200),
+    ("GET", "/api/accounts/search", "/api/accounts/search?health=Red&limit=50&include=primary_it_partner",
+     None, 200, 4, 200),
+    ("GET", "/api/accounts/{uid}", "/api/accounts/ACC0001", None, 200, 1, 50),
+    ("POST", "/api/accounts", "/api/accounts", {"uid": "NEW0001", "team": "New team"}, 200, 5, 100),
+    ("PUT", "/api/accounts/{uid}", "/api/accounts/ACC0001", {"health": "Red"}, 200, 6, 100),
+    ("DELETE", "/api/accounts/{uid}", "/api/accounts/ACC0002", None, 200, 20, 150),
+    ("GET", "/api/accounts/{uid}/use-cases", "/api/accounts/ACC0001/use-cases", None, 200, 1, 50),
+    ("POST", "/api/use-cases", "/api/use-cases", {"account_uid": "ACC0001", "problem": "New"}, 200, 5, 100),
+    ("PUT", "/api/use-cases/{id}", "/api/use-cases/1", {"status": "Done"}, 200, 6, 100),
+    ("DELETE", "/api/use-cases/{id}", "/api/use-cases/2", None, 200, 4, 50),
+    ("GET", "/api/accounts/{uid}/updates", "/api/accounts/ACC0001/updates", None, 200, 1, 50),
+    ("POST", "/api/updates", "/api/updates", {"account_uid": "ACC0001", "description": "New"}, 200, 5, 100),
+    # Account check, one multi-row INSERT, change log and search documents, whatever the batch size
+    ("POST", "/api/updates/ingest", "/api/updates/ingest",
+     [{"account_uid": "ACC0001", "description": f"Pipeline run {i} failed"} for i in range(200)], 200, 4, 200),
+    ("PUT", "/api/updates/{id}", "/api/updates/1", {"description": "Edited"}, 200, 6, 100),
+    ("DELETE", "/api/updates/{id}", "/api/updates/2", None, 200, 4, 50),
+    ("GET", "/api/accounts/{uid}/platforms", "/api/accounts/ACC0001/platforms", None, 200, 1, 50),
+    ("POST", "/api/platforms", "/api/platforms", {"account_uid": "ACC0001", "platform_name": "Fabric"}, 200, 3, 100),
+    ("PUT", "/api/platforms/{id}", "/api/platforms/1", {"onboarding_status": "Completed"}, 200, 2, 100),
+    ("DELETE", "/api/platforms/{id}", "/api/platforms/2", None, 200, 3, 50),
+    ("GET", "/api/accounts/{uid}/primary-it-partner", "/api/accounts/ACC0001/primary-it-partner", None, 200, 1, 50),
+    ("POST", "/api/primary-it-partners", "/api/primary-it-partners",
+     {"account_uid": "ACC0001", "primary_it_partner": "New"}, 200, 3, 100),
+    ("PUT", "/api/primary-it-partners/{id}", "/api/primary-it-partners/1", {"primary_it_partner": "Edited"}, 200, 4, 100),
+    ("DELETE", "/api/primary-it-partners/{id}", "/api/primary-it-partners/2", None, 200, 3, 50),
+    ("GET", "/api/intake-requests", "/api/intake-requests", None, 200, 1, 100),
+    ("GET", "/api/intake-requests/{id}", "/api/intake-requests/1", None, 200, 1, 50),
+    # States, a count per column, and one UNION ALL of every column's first page
+    ("GET", "/api/intake-requests/board", "/api/intake-requests/board", None, 200, 3, 100),
+    ("GET", "/api/intake-requests/board/column", "/api/intake-requests/board/column?state_id=1&offset=20",
+     None, 200, 2, 50),
+    # Loads the request, then builds the per-worker index (accounts, use cases, requests) on first use
+    ("GET", "/api/intake-requests/{id}/matches", "/api/intake-requests/1/matches", None, 200, 4, 200),
+    ("POST", "/api/intake-requests", "/api/intake-requests", {"title": "New request"}, 200, 6, 100),
+    ("PUT", "/api/intake-requests/{id}", "/api/intake-requests/1", {"title": "Edited"}, 200, 7, 100),
+    ("DELETE", "/api/intake-requests/{id}", "/api/intake-requests/2", None, 200, 8, 100),
+    ("GET", "/api/request-states", "/api/request-states", None, 200, 1, 50),
+    ("GET", "/api/request-states/{id}", "/api/request-states/1", None, 200, 1, 50),
+    ("POST", "/api/request-states", "/api/request-states", {"name": "Blocked"}, 200, 3, 100),
+    ("PUT", "/api/request-states/{id}", "/api/request-states/1", {"color": "#000000"}, 200, 4, 100),
+    # SQLite can't batch ORM inserts that return ids, so every intake event is its own INSERT here
+    # (one per removed assignment, and per changed request in bulk); Postgres batches them
+    ("DELETE", "/api/request-states/{id}", "/api/request-states/3", None, 200, 41, 150),
+    ("POST", "/api/intake-requests/states/bulk", "/api/intake-requests/states/bulk",
+     {"request_ids": list(range(1, 51)), "assign_state_ids": [3], "remove_state_ids": [1]}, 200, 57, 200),
+    ("GET", "/api/intake-requests/{request_id}/states", "/api/intake-requests/1/states", None, 200, 2, 50),
+    ("POST", "/api/intake-requests/{request_id}/states/{state_id}", "/api/intake-requests/1/states/3",
+     None, 200, 5, 100),
+    ("DELETE", "/api/intake-requests/{request_id}/states/{state_id}", "/api/intake-requests/1/states/1",
+     None, 200, 5, 100),
+    ("POST", "/api/reports", "/api/reports", {"format": "csv"}, 202, 3, 100),
+    ("GET", "/api/reports", "/api/reports", None, 200, 1, 50),
+    ("GET", "/api/reports/{id}", "/api/reports/1", None, 200, 1, 50),
+    ("GET", "/api/reports/{id}/download", "/api/reports/1/download", None, 409, 1, 50),
+    ("GET", "/api/functional-areas", "/api/functional-areas", None, 200, 0, 50),
+]
+
+# Long-lived streams; their cost is per event, not per request
+UNBUDGETED_ROUTES = {("GET", "/api/intake-requests/events")}
+
+
+def test_every_endpoint_has_a_budget():
+    routes = {(method, route.path) for route in app.routes if isinstance(route, APIRoute) for method in route.methods}
+    budgeted = {(method, route) for method, route, *_ in BUDGETS}
+    assert routes - UNBUDGETED_ROUTES - budgeted == set()
+
+
+@pytest.mark.parametrize("method,route,path,body,status,max_queries,max_ms", BUDGETS,
+                         ids=[f"{b[0]} {b[1]}" for b in BUDGETS])
+def test_endpoint_budget(client, query_budget, monkeypatch, method, route, path, body, status, max_queries, max_ms):
+    monkeypatch.setattr(report_runner, "submit", lambda job_id: None)
+    with query_budget(max_queries, max_ms):
+        response = client.request(method, path, json=body)
+    assert response.status_code == status, response.text
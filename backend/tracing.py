@@ -0,0 +1,374 @@
+"""
+Request tracing with OpenTelemetry-compatible spans.
+
+Each sampled request gets a SERVER span with child spans for:
+
+    fastapi.dependencies   - dependency resolution (get_session, body parsing)
+    <SQL operation> <table> - every statement run on any SQLAlchemy engine
+    fastapi.serialize      - response_model validation and jsonable_encoder
+    json.encode            - JSONResponse rendering
+
+Incoming W3C `traceparent` headers are honoured (a sampled parent is always
+recorded), so spans join traces started by the frontend or a gateway. The
+response carries a `traceresponse` header with this request's span.
+
+Spans are batched on a background thread and written as OTLP/JSON: one span
+per line to TRACING_FILE, and to an OTLP/HTTP collector at
+TRACING_OTLP_ENDPOINT (e.g. http://localhost:4318/v1/traces) when set. No
+OpenTelemetry packages are required; any OTel collector or Jaeger/Tempo
+instance accepts the output.
+
+TRACING_SAMPLE_RATIO sets the share of new traces recorded, so tracing can
+stay on in production. Unsampled requests only pay for one random number.
+"""
+
+import contextvars
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.1"))
+TRACING_FILE = os.getenv("TRACING_FILE", "./traces/spans.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "crm-api")
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "5"))
+TRACING_MAX_QUEUE = int(os.getenv("TRACING_MAX_QUEUE", "8192"))
+TRACING_MAX_STATEMENT_LENGTH = 2000
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+STATEMENT_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "status")
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[dict] = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = 0
+        self.attributes = attributes or {}
+        self.status = STATUS_OK
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class JsonLinesExporter:
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps({"service": TRACING_SERVICE_NAME, **span.to_otlp()}) + "\n")
+
+
+class OtlpHttpExporter:
+    def __init__(self, endpoint: str = TRACING_OTLP_ENDPOINT, service_name: str = TRACING_SERVICE_NAME):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def export(self, spans: List[Span]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "crm.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        request = urllib.request.Request(self.endpoint, data=json.dumps(payload).encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+
+
+class BatchSpanProcessor:
+    """Queues finished spans and exports them from a background thread. Drops spans when the queue is full."""
+
+    def __init__(self, exporters: list, interval: float = TRACING_EXPORT_INTERVAL, max_queue: int = TRACING_MAX_QUEUE):
+        self.exporters = exporters
+        self.interval = interval
+        self.queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def on_end(self, span: Span) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="span-exporter")
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> None:
+        spans = []
+        while True:
+            try:
+                spans.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                print(f"Span export to {exporter.__class__.__name__} failed: {e}")
+
+
+class Tracer:
+    def __init__(self, processor: BatchSpanProcessor, sample_ratio: float = TRACING_SAMPLE_RATIO):
+        self.processor = processor
+        self.sample_ratio = sample_ratio
+
+    def start_trace(self, name: str, traceparent: Optional[str], attributes: Optional[dict] = None) -> Optional[Span]:
+        """Root or remote-parented SERVER span, or None when the trace is not sampled."""
+        match = TRACEPARENT.match(traceparent or "")
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+        else:
+            if random.random() >= self.sample_ratio:
+                return None
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+        return Span(trace_id, parent_id, name, SPAN_KIND_SERVER, attributes)
+
+    def start_span(self, name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[dict] = None) -> Optional[Span]:
+        parent = current_span.get()
+        if parent is None:
+            return None
+        return Span(parent.trace_id, parent.span_id, name, kind, attributes)
+
+    def end(self, span: Optional[Span], error: Optional[BaseException] = None) -> None:
+        if span is None:
+            return
+        span.end = time.time_ns()
+        if error is not None:
+            span.status = STATUS_ERROR
+            span.set("exception.type", type(error).__name__)
+            span.set("exception.message", str(error)[:500])
+        self.processor.on_end(span)
+
+    async def trace_async(self, name: str, func, *args, **kwargs):
+        span = self.start_span(name)
+        if span is None:
+            return await func(*args, **kwargs)
+        token = current_span.set(span)
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        finally:
+            current_span.reset(token)
+        self.end(span)
+        return result
+
+
+def create_tracer() -> Tracer:
+    exporters = []
+    if TRACING_FILE:
+        exporters.append(JsonLinesExporter())
+    if TRACING_OTLP_ENDPOINT:
+        exporters.append(OtlpHttpExporter())
+    return Tracer(BatchSpanProcessor(exporters))
+
+
+tracer = create_tracer()
+
+
+class TracingMiddleware:
+    def __init__(self, app, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        span = self.tracer.start_trace(f"{scope['method']} {scope['path']}",
+                                       headers.get(b"traceparent", b"").decode("latin-1"), {
+                                           "http.request.method": scope["method"],
+                                           "url.path": scope["path"],
+                                       })
+        if span is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                span.set("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.status = STATUS_ERROR
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"traceresponse", span.traceparent().encode())]}
+            await send(message)
+
+        token = current_span.set(span)
+        error = None
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                # Low-cardinality name once routing has matched, e.g. "GET /api/accounts/{uid}"
+                span.name = f"{scope['method']} {route.path}"
+                span.set("http.route", route.path)
+            self.tracer.end(span, error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span(_statement_name(statement), SPAN_KIND_CLIENT, {
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:TRACING_MAX_STATEMENT_LENGTH],
+    })
+    conn.info.setdefault("tracing_spans", []).append(span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("tracing_spans")
+    if spans:
+        span = spans.pop()
+        if span is not None and cursor is not None and cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set("db.rows_affected", cursor.rowcount)
+        tracer.end(span)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    spans = conn.info.get("tracing_spans") if conn is not None else None
+    if spans:
+        tracer.end(spans.pop(), exception_context.original_exception)
+
+
+def _statement_name(statement: str) -> str:
+    operation = statement.split(None, 1)[0].upper() if statement.strip() else "SQL"
+    match = STATEMENT_TABLE.search(statement, 0, 4000)
+    return f"{operation} {match.group(1)}" if match else operation
+
+
+_instrumented = False
+
+
+def instrument(app) -> None:
+    """Install the middleware and the SQLAlchemy/FastAPI hooks. Does nothing unless TRACING_ENABLED."""
+    global _instrumented
+    if not TRACING_ENABLED or _instrumented:
+        return
+    _instrumented = True
+
+    import fastapi.routing
+    from starlette.responses import JSONResponse
+
+    app.add_middleware(TracingMiddleware)
+    app.add_event_handler("shutdown", tracer.processor.flush)
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+    # get_request_handler looks these up as module globals on every request
+    solve_dependencies = fastapi.routing.solve_dependencies
+    serialize_response = fastapi.routing.serialize_response
+
+    async def traced_solve_dependencies(*args, **kwargs):
+        return await tracer.trace_async("fastapi.dependencies", solve_dependencies, *args, **kwargs)
+
+    async def traced_serialize_response(*args, **kwargs):
+        return await tracer.trace_async("fastapi.serialize", serialize_response, *args, **kwargs)
+
+    fastapi.routing.solve_dependencies = traced_solve_dependencies
+    fastapi.routing.serialize_response = traced_serialize_response
+
+    render = JSONResponse.render
+
+    def traced_render(self, content) -> bytes:
+        span = tracer.start_span("json.encode")
+        if span is None:
+            return render(self, content)
+        body = render(self, content)
+        span.set("http.response.body.size", len(body))
+        tracer.end(span)
+        return body
+
+    JSONResponse.render = traced_render
+
+
+def tracing_status() -> Dict[str, object]:
+    return {
+        "enabled": TRACING_ENABLED,
+        "sample_ratio": tracer.sample_ratio,
+        "queued": tracer.processor.queue.qsize(),
+        "dropped": tracer.processor.dropped,
+        "exporters": [exporter.__class__.__name__ for exporter in tracer.processor.exporters],
+    }